@@ -26,7 +26,7 @@
 datastore path must be the same.
 """
 
-from __future__ import print_function
+from __future__ import absolute_import, print_function
 
 import json
 import logging
@@ -36,10 +36,12 @@ from os.path import join
 from subprocess import STDOUT, call
 from time import time, localtime, sleep, strftime
 
-from cloud.upload import upload_datastore
+from cloud.upload import upload_datastore, xfer_setup
 from cloud.cloudcfg import ConfigDataLoad, checkDatastore
-from cloud.weather import DEFAULT_CFG_FILE_PATH as CLOUD_DEFUALT_PATH, getLocationTempFromSvc
+from cloud.weather import DEFAULT_CFG_FILE_PATH as CLOUD_DEFUALT_PATH, getLocationTempFromSvcs
+from cloud.weathercache import weatherCacheFromCfg
 from camrecorder.camsnapshot import DEFAULT_CFG_FILE_PATH as CAMRECORDER_DEFUALT_PATH, snap_shot
+from boilerctrl.templog import TEMPLOG_DIR, TempLogHandler, TempLogStore
 
 
 # Globals
@@ -64,18 +66,15 @@ def print_error(msg):
     print('%s;%s' % (strftime("%Y-%m-%d %H:%M:%S"), msg), file=stderr)
 
 
-def getExternalTempFromSvcs(weatherSvc):
-    """Get the external temperature from a bunch of weather services.
-    Returns the average temperature between the available services,
-    None otherwise.
+def getExternalTempFromSvcs(weatherSvc, cache=None):
+    """Get the external temperature from a bunch of weather services,
+    queried at the same time, or from their recent readings in cache.
+    Returns the average temperature between the services
+    answering before the deadline, None otherwise.
     """
-    location_name = weatherSvc['location']['name']
-    latitude = weatherSvc['location']['lat']
-    longitude = weatherSvc['location']['lon']
     c_temp = 0
     nsvc = 0
-    for api in weatherSvc['api-list']:
-        locationTemp = getLocationTempFromSvc(api, latitude, longitude, location_name)
+    for api, locationTemp in getLocationTempFromSvcs(weatherSvc, cache):
         if len(locationTemp) <= 0:
             # error: the weather service is not available
             logging.info("ext temp;%s;-" % api['name'])
@@ -143,12 +142,18 @@ def crank(cloud_cfg, camrecorder_cfg):
     logging.basicConfig(filename=log_file,
                         format='%(asctime)s;%(levelname)s;%(message)s',
                         level=logging.DEBUG)
+    # append the temperatures to the columnar store too
+    templog_store = TempLogStore(join(cloud_cfg.data['datastore'], TEMPLOG_DIR))
+    logging.getLogger().addHandler(TempLogHandler(templog_store, log_file))
 
     boilerstatus_file = join(cloud_cfg.data['datastore'], BOILERSTATUS_FILE)
     boilerstatus = ConfigDataLoad(boilerstatus_file, DEFAULT_BOILERSTATUS)
     boilerstatusChanged = False
 
-    externalTemp = getExternalTempFromSvcs( cloud_cfg.data['weather-svc'] )
+    weather_cache = weatherCacheFromCfg(cloud_cfg.data['weather-svc'],
+                                        cloud_cfg.data['datastore'])
+    externalTemp = getExternalTempFromSvcs( cloud_cfg.data['weather-svc'],
+                                            weather_cache )
 
     current_time = int(time())
     try:
@@ -180,7 +185,7 @@ def crank(cloud_cfg, camrecorder_cfg):
             boilerstatus.update()
         except Exception as e:
             logging.error( '%s: %s' % (type(e).__name__, str(e)) )
-        upload_datastore(cloud_cfg.data['datastore'])
+        upload_datastore(cloud_cfg.data['datastore'], *xfer_setup(cloud_cfg))
 
 
 def main():
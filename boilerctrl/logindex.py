@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Corrado Ubezio
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Day index of a log file whose lines begin with the date (%Y-%m-%d).
+
+The index is a sidecar JSON file (<log-file>.idx) with the byte offset
+of the first line of each day, so that the lines of a day are read
+seeking directly to them.
+The index is updated incrementally, scanning only the lines appended
+since the last update; it is rebuilt if the log file has been replaced
+(different first line).
+
+If the index is missing or stale, day_offset falls back to a binary
+search over the log file.
+'''
+
+import json
+import re
+from bisect import bisect_left
+from os import rename
+from os.path import getsize
+
+
+INDEX_EXT = '.idx'
+
+_DATED_LINE = re.compile(br'\d{4}-\d\d-\d\d')
+
+# lines checked for a date, after a seek in the middle of the file
+_MAX_UNDATED_LINES = 100
+
+
+def index_file_path(log_file_path):
+    return log_file_path + INDEX_EXT
+
+
+class LogDayIndex(object):
+
+    def __init__(self, log_file_path):
+        self.log_file_path = log_file_path
+        self.index_file_path = index_file_path(log_file_path)
+        self.head = None
+        self.size = 0
+        self.days = []
+        self.offsets = []
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.index_file_path) as f:
+                index = json.load(f)
+            self.head = index['head']
+            self.size = index['size']
+            self.days = [day for day, _ in index['days']]
+            self.offsets = [offset for _, offset in index['days']]
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            self.head = None
+            self.size = 0
+            self.days = []
+            self.offsets = []
+
+    def save(self):
+        tmp_file = self.index_file_path + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({'head': self.head, 'size': self.size,
+                       'days': list(zip(self.days, self.offsets))}, f)
+        rename(tmp_file, self.index_file_path)
+
+    def _log_head(self, f):
+        f.seek(0)
+        return f.readline().decode('utf-8', 'replace')
+
+    def is_valid(self, f=None):
+        '''True if the index refers to the log file'''
+        try:
+            if f is None:
+                with open(self.log_file_path, 'rb') as f:
+                    return self.is_valid(f)
+            return self.head is not None and self.head == self._log_head(f) \
+                            and self.size <= getsize(self.log_file_path)
+        except (IOError, OSError):
+            return False
+
+    def update(self):
+        '''Index the lines appended since the last update.
+        Returns True if the index has been changed.
+        '''
+        with open(self.log_file_path, 'rb') as f:
+            if not self.is_valid(f):
+                self.head = self._log_head(f)
+                self.size = 0
+                self.days = []
+                self.offsets = []
+            offset = self.size
+            f.seek(offset)
+            for line in iter(f.readline, b''):
+                if not line.endswith(b'\n'):
+                    # being written: index it next time
+                    break
+                if _DATED_LINE.match(line):
+                    day = line[:10].decode('ascii')
+                    if len(self.days) == 0 or day > self.days[-1]:
+                        self.days.append(day)
+                        self.offsets.append(offset)
+                offset = offset + len(line)
+        if offset == self.size and self.head is not None:
+            return False
+        self.size = offset
+        self.save()
+        return True
+
+    def day_offset(self, day):
+        '''Returns the offset of the first line of the log file
+        dated day or later, None if day is beyond the index.
+        '''
+        idx = bisect_left(self.days, day)
+        if idx < len(self.days):
+            return self.offsets[idx]
+        return None
+
+
+def _line_date(f, pos, end):
+    '''Returns offset and date of the first dated line
+    beginning at pos or later, (end, None) if none.
+    '''
+    if pos > 0:
+        # skip the line pos is in
+        f.seek(pos - 1)
+        f.readline()
+    else:
+        f.seek(0)
+    for _ in range(_MAX_UNDATED_LINES):
+        offset = f.tell()
+        if offset >= end:
+            break
+        line = f.readline()
+        if _DATED_LINE.match(line):
+            return offset, line[:10]
+    return end, None
+
+
+def bsearch_day_offset(f, day, start=0, end=None):
+    '''Binary search in the log file opened in binary mode
+    between the offsets start (a line beginning) and end.
+    Returns the offset of the first line dated day or later,
+    end if none.
+    '''
+    if end is None:
+        f.seek(0, 2)
+        end = f.tell()
+    day = day.encode('ascii')
+    lo, hi = start, end
+    while lo < hi:
+        mid = (lo + hi) // 2
+        _, line_day = _line_date(f, mid, end)
+        if line_day is None or line_day >= day:
+            hi = mid
+        else:
+            lo = mid + 1
+    return _line_date(f, lo, end)[0]
+
+
+def day_offset(log_file_path, day):
+    '''Returns the offset of the first line of the log file
+    dated day ('YYYY-MM-DD') or later, the size of the log file if none.
+    The day index of the log file is used if valid,
+    otherwise the log file is searched.
+    '''
+    index = LogDayIndex(log_file_path)
+    with open(log_file_path, 'rb') as f:
+        start = 0
+        if index.is_valid(f):
+            offset = index.day_offset(day)
+            if offset is not None:
+                return offset
+            # the lines appended after the last index update
+            start = index.size
+        return bsearch_day_offset(f, day, start)
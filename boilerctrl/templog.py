@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Corrado Ubezio
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Columnar store of the temperatures logged by boilerctrl.py.
+
+The store is a directory with a file of fixed size records for each day
+(YYYY-MM-DD.bin), so that a date range is read in O(range) time:
+    time    int64   milliseconds since 1970-01-01 00:00:00 local time
+                    (the naive datetime of the log line)
+    temp    float32 Celsius degrees, NaN for boiler events
+    svc     int16   index of the service name in services.json
+The boiler activations are stored as the services named
+BOILER_ON and BOILER_OFF.
+
+The records are appended to the store:
+    - by TempLogHandler, as boilerctrl.py logs them;
+    - by ingest, reading the lines of the log file (boilerctrl-log.txt)
+      added since the last time.
+The store keeps the offsets of the log file ingested (ingest.json),
+so that the log lines are never stored twice.
+A store can be built from a given day of the log file on,
+seeking to it by means of the log day index (see logindex.py).
+
+Appending requires only the standard library;
+query requires NumPy.
+'''
+
+from __future__ import absolute_import, print_function
+
+import json
+import logging
+import struct
+from datetime import date, datetime, timedelta
+from os import SEEK_END, listdir, makedirs, rename
+from os.path import getsize, isdir, join
+
+from cloud.weathercache import FileLock
+from boilerctrl.logindex import LogDayIndex, day_offset
+
+
+TEMPLOG_DIR = '.templog'
+SERVICES_FILE_NAME = 'services.json'
+INGEST_FILE_NAME = 'ingest.json'
+LOCK_FILE_NAME = 'templog.lock'
+PARTITION_EXT = '.bin'
+
+# the weather service of the log lines without the service name
+DEFAULT_SVC = 'Wunderground'
+TEMP_DESC = 'ext temp'
+BOILER_ON = 'boiler goes ON'
+BOILER_OFF = 'boiler goes OFF'
+
+RECORD_FORMAT = '<qfh'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+EPOCH = datetime(1970, 1, 1)
+_EPOCH_ORDINAL = EPOCH.toordinal()
+_NAN = float('nan')
+
+
+def record_dtype():
+    '''The NumPy dtype of the records'''
+    import numpy as np
+
+    return np.dtype([('time', '<i8'), ('temp', '<f4'), ('svc', '<i2')])
+
+
+def timestamp2datetime(timestamp):
+    '''Convert the record time to the naive datetime of the log line'''
+    return EPOCH + timedelta(milliseconds=int(timestamp))
+
+
+def parse_log_line(line):
+    '''Parse a boilerctrl log line:
+        <%Y-%m-%d %H:%M:%S,%f>;<log_type>;<description>;<service>;<float_temperature_value>
+    Support two temperature log line format:
+    in the older one the weather service name was not saved.
+
+    Returns (day, timestamp, svc, temperature) of the temperature
+    and boiler status lines, otherwise None.
+    '''
+    fields = line.rstrip('\r\n').split(';')
+    if len(fields) < 3:
+        return None
+    desc = fields[2]
+    if desc == TEMP_DESC:
+        if len(fields) < 4:
+            return None
+        if len(fields) < 5:
+            # old log line without weather service name
+            svc = DEFAULT_SVC
+            log_temp = fields[3]
+        else:
+            svc = fields[3]
+            log_temp = fields[4]
+        if log_temp == '-':
+            # the temperature was not disclosed
+            return None
+        temperature = float(log_temp)
+    elif desc == BOILER_ON or desc == BOILER_OFF:
+        svc = desc
+        temperature = _NAN
+    else:
+        return None
+    date_time = fields[0]
+    day = date_time[:10]
+    year, month, mday = day.split('-')
+    hours, minutes, seconds = date_time[11:19].split(':')
+    timestamp = ((date(int(year), int(month), int(mday)).toordinal() -
+                                                _EPOCH_ORDINAL) * 86400 +
+                 int(hours) * 3600 + int(minutes) * 60 + int(seconds)) * 1000 + \
+                int(date_time[20:23] or 0)
+    return day, timestamp, svc, temperature
+
+
+class TempLogStore(object):
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.lock_file = join(store_dir, LOCK_FILE_NAME)
+        self._services = None
+
+    def _makedirs(self):
+        try:
+            makedirs(self.store_dir)
+        except OSError:
+            # prevents a duplicated attempt at creating the directory (race condition)
+            if not isdir(self.store_dir):
+                raise
+
+    def _load(self, file_name, default):
+        try:
+            with open(join(self.store_dir, file_name)) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return default
+
+    def _save(self, file_name, data):
+        file_path = join(self.store_dir, file_name)
+        with open(file_path + '.tmp', 'w') as f:
+            json.dump(data, f)
+        rename(file_path + '.tmp', file_path)
+
+    @property
+    def services(self):
+        '''The service names, indexed by service id'''
+        if self._services is None:
+            self._services = self._load(SERVICES_FILE_NAME, [])
+        return self._services
+
+    def _service_id(self, svc):
+        try:
+            return self.services.index(svc)
+        except ValueError:
+            self.services.append(svc)
+            self._save(SERVICES_FILE_NAME, self.services)
+            return len(self.services) - 1
+
+    def _append(self, records):
+        '''Append the (day, timestamp, svc, temperature) records.
+        Call under lock.
+        '''
+        partitions = {}
+        try:
+            for day, timestamp, svc, temperature in records:
+                f = partitions.get(day)
+                if f is None:
+                    f = open(join(self.store_dir, day + PARTITION_EXT), 'ab')
+                    partitions[day] = f
+                f.write(struct.pack(RECORD_FORMAT, timestamp, temperature,
+                                                    self._service_id(svc)))
+        finally:
+            for f in partitions.values():
+                f.close()
+
+    def _drop_reread(self, records):
+        '''The log file has been replaced, then its records may have been
+        stored already (i.e. the log has been truncated to its last days):
+        drop from each day in the store the records since the first one
+        read again, so that they are not stored twice.
+        Call under lock.
+        '''
+        first_times = {}
+        for day, timestamp, _, _ in records:
+            if day not in first_times:
+                first_times[day] = timestamp
+        stored_days = set(self.days())
+        for day, first_time in first_times.items():
+            if day not in stored_days:
+                continue
+            with open(self.partition_path(day), 'r+b') as f:
+                f.seek(0, SEEK_END)
+                count = f.tell() // RECORD_SIZE
+                keep = 0
+                f.seek(0)
+                while keep < count:
+                    timestamp = struct.unpack(RECORD_FORMAT,
+                                              f.read(RECORD_SIZE))[0]
+                    if timestamp >= first_time:
+                        break
+                    keep = keep + 1
+                f.truncate(keep * RECORD_SIZE)
+
+    @staticmethod
+    def _read_records(f, offset, end=None):
+        '''Parse the log lines from offset up to end (the end of file
+        if None). Returns the records and the offset past the last line.
+        '''
+        f.seek(offset)
+        records = []
+        for line in iter(f.readline, b''):
+            if not line.endswith(b'\n'):
+                # being written: ingest it next time
+                break
+            offset = offset + len(line)
+            try:
+                record = parse_log_line(line.decode('utf-8', 'replace'))
+            except ValueError:
+                record = None
+            if record is not None:
+                records.append(record)
+            if end is not None and offset >= end:
+                break
+        return records, offset
+
+    def ingest(self, log_file_path, since_day=None):
+        '''Append the lines added to the log file since the last ingest.
+        If the log file has been replaced by another one
+        (different first line) or truncated, it is ingested
+        from the beginning, replacing the records read again.
+
+        If since_day ('YYYY-MM-DD') is given, the log file is ingested
+        from the first line of that day, seeking to it
+        (see logindex.day_offset): the days before are not read until
+        an ingest asks for them.
+
+        Returns the number of records appended.
+        '''
+        self._makedirs()
+        with FileLock(self.lock_file):
+            self._services = None
+            state = self._load(INGEST_FILE_NAME, {})
+            try:
+                with open(log_file_path, 'rb') as f:
+                    head = f.readline().decode('utf-8', 'replace')
+                    start = state.get('start', 0)
+                    size = state.get('size', 0)
+                    replaced = head != state.get('head') or \
+                                        size > getsize(log_file_path)
+                    if replaced is True:
+                        # not the log file ingested so far
+                        start = size = 0
+                        if since_day is not None:
+                            start = size = day_offset(log_file_path, since_day)
+                    records = []
+                    if start > 0 and since_day is not None:
+                        begin = day_offset(log_file_path, since_day)
+                        if begin < start:
+                            # the days before the ones ingested so far
+                            days = set(self.days())
+                            records, _ = self._read_records(f, begin, start)
+                            records = [r for r in records if r[0] not in days]
+                            start = begin
+                    new_records, size = self._read_records(f, size)
+                    records.extend(new_records)
+            except (IOError, OSError) as e:
+                logging.debug('%s: not ingested (%s)' % (log_file_path, e))
+                return 0
+            if replaced is True:
+                self._drop_reread(records)
+            self._append(records)
+            self._save(INGEST_FILE_NAME,
+                            {'head': head, 'start': start, 'size': size})
+        return len(records)
+
+    def days(self):
+        '''The sorted list of the days in the store'''
+        try:
+            names = listdir(self.store_dir)
+        except OSError:
+            return []
+        return sorted(name[:-len(PARTITION_EXT)] for name in names
+                                            if name.endswith(PARTITION_EXT))
+
+    def partition_path(self, day):
+        return join(self.store_dir, day + PARTITION_EXT)
+
+    def read_day(self, day):
+        '''Returns the records of day (a 'YYYY-MM-DD' string)
+        as a NumPy structured array, empty if none.
+        '''
+        import numpy as np
+
+        dtype = record_dtype()
+        file_path = self.partition_path(day)
+        try:
+            # ignore a record partially written
+            count = getsize(file_path) // RECORD_SIZE
+        except OSError:
+            return np.empty(0, dtype=dtype)
+        return np.fromfile(file_path, dtype=dtype, count=count)
+
+    def query(self, date_start, date_end):
+        '''Returns the records from date_start to date_end (datetime.date)
+        included, in the order they were appended,
+        and the list of the service names indexed by service id.
+        '''
+        import numpy as np
+
+        parts = []
+        day = date_start
+        while day <= date_end:
+            parts.append(self.read_day(day.strftime('%Y-%m-%d')))
+            day = day + timedelta(days=1)
+        self._services = None
+        return np.concatenate(parts), list(self.services)
+
+
+class TempLogHandler(logging.Handler):
+    '''Append to the store the temperatures and the boiler status
+    as they are logged to log_file_path.
+
+    Add it to the logger after the handler writing log_file_path:
+    the store ingests the lines just written.
+    The day index of log_file_path is updated too (see logindex).
+    '''
+
+    def __init__(self, store, log_file_path):
+        logging.Handler.__init__(self)
+        self.store = store
+        self.log_file_path = log_file_path
+        self.index = LogDayIndex(log_file_path)
+
+    def emit(self, record):
+        try:
+            msg = record.getMessage()
+            if not msg.startswith(TEMP_DESC + ';') and \
+                                        msg not in (BOILER_ON, BOILER_OFF):
+                # neither a temperature nor a boiler status
+                return
+            self.store.ingest(self.log_file_path)
+            self.index.update()
+        except Exception:
+            self.handleError(record)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""Command-line test of templog.py ingesting a log file
+rotated (keeping its last days) and truncated
+
+The records of the days already in the store must not be stored twice.
+"""
+
+from __future__ import print_function
+
+import shutil
+import tempfile
+import traceback
+from datetime import datetime, timedelta
+from os.path import dirname, join, realpath
+from sys import exit, path, version_info
+
+# import the boilerctrl package, not boilerctrl.py of this directory
+path[0] = dirname(dirname(realpath(__file__)))
+
+from boilerctrl.templog import TempLogStore, TEMP_DESC, BOILER_ON
+
+
+TEST_DAYS = 4
+TEST_LINES_PER_DAY = 48  # a temperature every 30 minutes
+
+
+def log_lines(first_day, days):
+    """Returns the boilerctrl log lines of days, starting from first_day,
+    and the number of records they hold.
+    """
+    lines = []
+    for n in range(days * TEST_LINES_PER_DAY):
+        t = first_day + timedelta(minutes=30 * n)
+        stamp = t.strftime('%Y-%m-%d %H:%M:%S') + ',000'
+        lines.append('%s;INFO;%s;svc;%0.1f\n' % (stamp, TEMP_DESC, n % 20))
+        if n % TEST_LINES_PER_DAY == 0:
+            lines.append('%s;INFO;%s\n' % (stamp, BOILER_ON))
+    return lines
+
+
+def write_log(log_file, lines, mode='w'):
+    with open(log_file, mode) as f:
+        f.writelines(lines)
+
+
+def stored_records(store):
+    return sum(len(store.read_day(day)) for day in store.days())
+
+
+def templog_test():
+    """Returns True if the log rotation and truncation succeed."""
+    tmp_dir = tempfile.mkdtemp(prefix='templog_test')
+    try:
+        log_file = join(tmp_dir, 'boilerctrl-log.txt')
+        store = TempLogStore(join(tmp_dir, '.templog'))
+        first_day = datetime(2020, 1, 1)
+        lines = log_lines(first_day, TEST_DAYS)
+        expected = len(lines)
+
+        write_log(log_file, lines)
+        store.ingest(log_file)
+        if stored_records(store) != expected:
+            print('FAILED: %d records stored, %d expected' %
+                                        (stored_records(store), expected))
+            return False
+
+        # rotated: the log keeps the last days, cut in the middle of a day
+        write_log(log_file, lines[len(lines) // 2 + 5:])
+        store.ingest(log_file)
+        if stored_records(store) != expected:
+            print('FAILED: rotated log stored twice (%d records, %d expected)'
+                                        % (stored_records(store), expected))
+            return False
+
+        # truncated: the log restarts empty, then new lines are written
+        write_log(log_file, [])
+        store.ingest(log_file)
+        new_lines = log_lines(first_day + timedelta(days=TEST_DAYS), 1)
+        write_log(log_file, new_lines, 'a')
+        store.ingest(log_file)
+        expected = expected + len(new_lines)
+        if stored_records(store) != expected:
+            print('FAILED: truncated log (%d records, %d expected)' %
+                                        (stored_records(store), expected))
+            return False
+    except Exception:
+        print('FAILED: %s' % traceback.format_exc())
+        return False
+    finally:
+        shutil.rmtree(tmp_dir)
+    print('SUCCEEDED')
+    return True
+
+
+def main():
+    print('Python {}.{}.{}'.format(version_info.major, version_info.minor,
+                                    version_info.micro))
+    print('Ingest a rotated and a truncated temperature log')
+    if templog_test() is not True:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
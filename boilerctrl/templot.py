@@ -3,6 +3,8 @@
 Plot temperature trend grouped by weather services.
 The temperature are read from the log file generated by boilerctrl.py script:
     <%Y-%m-%d %H:%M:%S,%f>;<log_type>;<description>;<service>;<float_temperature_value>
+The log lines are ingested in a columnar store (see templog.py)
+and only the days of the plot are read from it.
 
 References:
 
@@ -41,17 +43,19 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 '''
-from __future__ import print_function
+from __future__ import absolute_import, print_function
 
+import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 from os import path
+from sys import stderr
+from multiprocessing import Pool, cpu_count
 from datetime import date
 from datetime import datetime
 from datetime import timedelta
-from csv import DictReader as csv_dict
-
-DEFAULT_SVC = 'Wunderground'
+from boilerctrl.templog import TEMPLOG_DIR, BOILER_ON, BOILER_OFF, EPOCH, \
+                              TempLogStore, timestamp2datetime
 
 
 def timedelta2string(elapsed):
@@ -187,18 +191,191 @@ class Weather_service_log:
         self.datetime_stats.timespan_close()
         self.timeframe_close()
 
-    def plot(self, daytime, fig_title, fig_file_path):
+    def update_rows(self, records, services):
+        '''Update with the templog records one by one'''
+        for timestamp, temperature, svc_id in records.tolist():
+            date_time = timestamp2datetime(timestamp)
+            svc = services[svc_id]
+            if svc == BOILER_ON:
+                # save the boiler activation date time
+                self.activation_start(date_time)
+            elif svc == BOILER_OFF:
+                self.activation_stop(date_time)
+            else:
+                # the temperatures are logged with one decimal:
+                # drop the float32 representation error
+                self.update_temperature(svc, date_time, round(temperature, 1))
+
+    def update_records(self, records, services):
+        '''Update with the templog records (see templog.TempLogStore.query)
+        as update_rows does, but by NumPy arrays:
+        the timeframes are found by searchsorted and averaged all together;
+        the AVERAGE values logged are checked by joining the sorted
+        timestamps of the timeframes and of the logged values.
+        The last timeframe is left open, as update_temperature does.
+        Records not in time order are updated one by one.
+        '''
+        if len(records) == 0:
+            return
+        times = records['time']
+        if np.any(np.diff(times) < 0) or self.timeframe_nsvc > 0 or \
+                                    self.timeframe_avg_logged is not None:
+            # i.e. clock moved back: the timeframes are not contiguous
+            self.update_rows(records, services)
+            return
+        svc_ids = records['svc']
+        n_records = len(records)
+        ids = dict((name, svc_id) for svc_id, name in enumerate(services))
+        is_avg = svc_ids == ids.get('AVERAGE', -1)
+        is_event = (svc_ids == ids.get(BOILER_ON, -1)) | \
+                   (svc_ids == ids.get(BOILER_OFF, -1))
+        is_temp = ~is_event
+        # the temperatures are logged with one decimal:
+        # drop the float32 representation error
+        temps = np.round(records['temp'].astype(np.float64), 1)
+        date_times = times.astype('datetime64[ms]').astype(object)
+
+        # timeframes: a temperature later than 2 minutes after the first one
+        # of the current timeframe opens the next timeframe
+        svc_pos = np.flatnonzero(is_temp & ~is_avg)
+        svc_times = times[svc_pos]
+        frame_ms = 2 * 60 * 1000
+        begin_ms = int((self.timeframe_begin - EPOCH).total_seconds() * 1000)
+        next_open = np.searchsorted(svc_times, svc_times + frame_ms,
+                                                        side='right').tolist()
+        # timeframe 0 is the one open before the records
+        starts = [0]
+        idx = int(np.searchsorted(svc_times, begin_ms + frame_ms, side='right'))
+        while idx < len(svc_times):
+            starts.append(idx)
+            idx = next_open[idx]
+        starts = np.array(starts)
+        counts = np.diff(np.append(starts, len(svc_times)))
+        # record position closing each timeframe
+        close_pos = np.append(svc_pos[starts[1:]], n_records)
+        open_pos = np.append(-1, close_pos[:-1])
+        begins = [self.timeframe_begin] + date_times[svc_pos[starts[1:]]].tolist()
+        averages = [None] * len(starts)
+        nonempty = np.flatnonzero(counts > 0)
+        if len(nonempty) > 0:
+            # sum the temperatures of all the timeframes column by column,
+            # in the same order of update_temperature
+            # (a pairwise sum may round the average differently)
+            frame_of = np.repeat(np.arange(len(starts)), counts)
+            rank = np.arange(len(svc_times)) - starts[frame_of]
+            matrix = np.zeros((len(starts), counts.max()))
+            matrix[frame_of, rank] = temps[svc_pos]
+            sums = np.zeros(len(starts))
+            for column in matrix.T:
+                sums = sums + column
+            for frame, total, count in zip(nonempty.tolist(),
+                                           sums[nonempty].tolist(),
+                                           counts[nonempty].tolist()):
+                averages[frame] = round(total / count, 1)
+
+        # the last AVERAGE logged in each timeframe
+        avg_pos = np.flatnonzero(is_avg)
+        logged = np.full(len(starts), -1)
+        np.maximum.at(logged, np.searchsorted(open_pos, avg_pos, side='right') - 1,
+                                                                        avg_pos)
+        last_frame = len(starts) - 1
+        closed = [frame for frame in nonempty.tolist() if frame < last_frame]
+        computed = [frame for frame in closed if logged[frame] < 0]
+        checked = [frame for frame in closed if logged[frame] >= 0]
+
+        # check the AVERAGE logged: join by timestamp
+        if len(checked) > 0:
+            avg_times = times[avg_pos]
+            idx = np.searchsorted(avg_times, times[logged[checked]])
+            avg_logged = temps[avg_pos][idx].tolist()
+            for frame, value in zip(checked, avg_logged):
+                avg_delta = round(abs(averages[frame] - value), 1)
+                if avg_delta > 0.1:
+                    avg_log_timestamp = date_times[logged[frame]]
+                    print('AVERAGE: values do not match at',avg_log_timestamp)
+                    print('-- read {}, expected {}'.format(value, averages[frame]))
+
+        # services table, in order of appearance;
+        # the AVERAGE computed is appended as its timeframe is closed,
+        # just after the record closing it
+        table = []
+        temp_pos = np.flatnonzero(is_temp)
+        temp_ids = svc_ids[temp_pos]
+        for svc_id in np.unique(temp_ids).tolist():
+            pos = temp_pos[temp_ids == svc_id]
+            table.append([int(pos[0]), services[svc_id], pos,
+                          date_times[pos].tolist(), temps[pos].tolist()])
+        if len(computed) > 0:
+            computed_pos = close_pos[computed]
+            computed_keys = computed_pos + 0.5
+            computed_times = [begins[frame] for frame in computed]
+            computed_temps = [averages[frame] for frame in computed]
+            for entry in table:
+                if entry[1] == 'AVERAGE':
+                    # merge with the AVERAGE logged
+                    keys = np.append(entry[2], computed_keys)
+                    order = np.argsort(keys, kind='stable').tolist()
+                    entry[0] = keys[order[0]]
+                    merged_times = entry[3] + computed_times
+                    merged_temps = entry[4] + computed_temps
+                    entry[3] = [merged_times[i] for i in order]
+                    entry[4] = [merged_temps[i] for i in order]
+                    break
+            else:
+                table.append([computed_keys[0], 'AVERAGE', None,
+                              computed_times, computed_temps])
+        table.sort(key=lambda entry: entry[0])
+        for _, svc, _, svc_times, svc_temps in table:
+            svc_table = self.svc_table.setdefault(svc, ([], []))
+            svc_table[0].extend(svc_times)
+            svc_table[1].extend(svc_temps)
+
+        # boiler activations
+        stats = self.datetime_stats
+        lower_bound = stats.lower_bound
+        for pos in np.flatnonzero(is_event).tolist():
+            if svc_ids[pos] == ids[BOILER_ON]:
+                self.activation_start(date_times[pos])
+            else:
+                self.activation_stop(date_times[pos])
+
+        # time range: the AVERAGE computed are updated
+        # with the beginning of their timeframe
+        if lower_bound is None:
+            lower_bound = date_times[0]
+        stats.lower_bound = lower_bound
+        last = n_records - 1
+        stats.upper_bound = date_times[last]
+        if len(computed) > 0 and computed_pos[-1] == last:
+            stats.upper_bound = computed_times[-1]
+
+        # the last timeframe is left open
+        self.timeframe_begin = begins[last_frame]
+        if counts[last_frame] > 0:
+            self.timeframe_avg = sum(temps[svc_pos[starts[last_frame]:]].tolist())
+            self.timeframe_nsvc = int(counts[last_frame])
+        if logged[last_frame] >= 0:
+            self.timeframe_avg_logged = date_times[logged[last_frame]]
+
+    def plot(self, daytime, fig_title, fig_file_path, fig=None):
+        '''Plot to fig_file_path.
+        If fig is given, the figure is cleared and reused.
+        '''
         if len(self.svc_table) == 0:
             return False
 
         # Create the figure and the subplot for the temperatures line graph
-        fig, ax = plt.subplots()
+        if fig is None:
+            fig, ax = plt.subplots()
+        else:
+            fig.clf()
+            ax = fig.add_subplot(111)
 
         # format the xaxis ticks
         if daytime is True:
             # format x-axis ticks by hours of the day
-            plt.xticks(rotation='vertical')
-            plt.subplots_adjust(bottom=.2)
+            plt.setp(ax.get_xticklabels(), rotation='vertical')
+            fig.subplots_adjust(bottom=.2)
             xfmt = mdates.DateFormatter('%H:%M')
             ax.xaxis.set_major_locator(mdates.HourLocator())
         else:
@@ -229,7 +406,7 @@ class Weather_service_log:
             # see: https://stackoverflow.com/a/24988486
             activation_label = 'SwitchOn'
             for xc in self.activation_timestamp:
-                plt.axvline(x=xc, color='magenta', label=activation_label)
+                ax.axvline(x=xc, color='magenta', label=activation_label)
                 activation_label = None  # Only one legend entry for all activation plot
 
         ax.set(ylabel='C degrees',
@@ -243,7 +420,21 @@ class Weather_service_log:
         return True
 
 
-def templot(log_file_name, plot_file_path, start_from_day, end_at_day=None):
+def range_plot_file_path(plot_file_path, date_range_str):
+    '''The plot file of a date range: <root>_<date_range_str><ext>'''
+    plot_file_path, plot_file_ext = path.splitext(plot_file_path)
+    return '{root}_{range}{ext}'.format( root=plot_file_path,
+                                         ext=plot_file_ext,
+                                         range=date_range_str )
+
+
+def templot(log_file_name, plot_file_path, start_from_day, end_at_day=None,
+                                                            store_dir=None):
+    '''Plot the temperatures logged from start_from_day to end_at_day.
+    The log is ingested in the store_dir columnar store,
+    by default TEMPLOG_DIR in the log file directory,
+    seeking to the first line of start_from_day.
+    '''
     print('Plot from file {}'.format(log_file_name))
     date_start = datetime.strptime(start_from_day, '%Y-%m-%d').date()
     if end_at_day is None:
@@ -253,51 +444,18 @@ def templot(log_file_name, plot_file_path, start_from_day, end_at_day=None):
         date_end = datetime.strptime(end_at_day, '%Y-%m-%d').date()
         date_range_str = '{}_{}'.format( date_start.strftime('%Y-%m-%d'),
                                          date_end.strftime('%Y-%m-%d') )
-    plot_file_path, plot_file_ext = path.splitext(plot_file_path)
-    plot_file_path = '{root}_{range}{ext}'.format( root=plot_file_path,
-                                                   ext=plot_file_ext,
-                                                   range=date_range_str )
+    plot_file_path = range_plot_file_path(plot_file_path, date_range_str)
     plot_title = 'Temperature of ' + date_range_str
     print(plot_title)
 
+    if store_dir is None:
+        store_dir = path.join(path.dirname(log_file_name), TEMPLOG_DIR)
+    store = TempLogStore(store_dir)
+    store.ingest(log_file_name, date_start.strftime('%Y-%m-%d'))
+    records, services = store.query(date_start, date_end)
+
     svc_log = Weather_service_log()
-    with open(log_file_name, mode='r') as csv_file:
-        # support two temperature log line format:
-        # in the older one the weather service name was not saved
-        csv_fields = ['date_time', 'log_type', 'desc', 'old_temp_field', 'new_temp_field']
-        for log_items in csv_dict(csv_file, fieldnames=csv_fields, delimiter=';'):
-            # check the date range
-            date_time = datetime.strptime(log_items["date_time"], '%Y-%m-%d %H:%M:%S,%f')
-            if date_time.date() < date_start:
-                continue
-            if date_time.date() > date_end:
-                break
-            
-            # search for temperature or boiler status log lines
-            item_desc = log_items['desc']
-            if item_desc != 'ext temp' and 'boiler goes ' not in item_desc:
-                continue
-            if item_desc == 'boiler goes ON':
-                # save the boiler activation date time
-                svc_log.activation_start(date_time)
-                continue
-            if item_desc == 'boiler goes OFF':
-                svc_log.activation_stop(date_time)
-                continue
-
-            # get the date time of temperature disclosed by the weather service
-            # fixing the log line format
-            if log_items['new_temp_field'] is None:
-                # old log line without weather service name
-                log_temp = log_items['old_temp_field']
-                svc = DEFAULT_SVC
-            else:
-                log_temp = log_items['new_temp_field']
-                svc = log_items["old_temp_field"]
-            if log_temp == '-':
-                # the temperature was not disclosed
-                continue
-            svc_log.update_temperature(svc, date_time, float(log_temp))
+    svc_log.update_records(records, services)
     svc_log.update_close()
 
     if svc_log.plot(date_end == date_start, plot_title, plot_file_path) is not True:
@@ -306,6 +464,96 @@ def templot(log_file_name, plot_file_path, start_from_day, end_at_day=None):
     return 0
 
 
+# the figure reused by a worker process plotting the days
+_day_figure = None
+
+
+def _init_day_worker():
+    # the plots are only saved to files
+    plt.switch_backend('Agg')
+
+
+def plot_day(job):
+    '''Pool worker: plot the temperatures of a day from the store,
+    as templot does. Returns (day, status).
+    A day failing to plot doesn't stop the others: its error is printed
+    and its status is -1.
+    '''
+    global _day_figure
+    store_dir, day, plot_file_path = job
+    try:
+        day_date = datetime.strptime(day, '%Y-%m-%d').date()
+        records, services = TempLogStore(store_dir).query(day_date, day_date)
+        svc_log = Weather_service_log()
+        svc_log.update_records(records, services)
+        svc_log.update_close()
+        if _day_figure is None:
+            _day_figure = plt.figure()
+        if svc_log.plot(True, 'Temperature of ' + day, plot_file_path,
+                                                    _day_figure) is not True:
+            return day, -1
+    except Exception as e:
+        print('Unable to plot %s: %s: %s' % (day, type(e).__name__, e),
+                                                            file=stderr)
+        return day, -1
+    return day, 0
+
+
+def templot_days(log_file_name, plot_file_path, days, store_dir=None,
+                                                processes=None, force=False):
+    '''Plot the temperatures of each of the days ('YYYY-MM-DD' strings)
+    to its own file, named as templot does.
+    The log is ingested once, then the days are plotted concurrently
+    by processes worker processes (default: number of CPUs).
+    A day is not plotted again if its plot file is newer than
+    the day in the store, unless force is True.
+
+    Returns the list of the (day, plot_file_path) plotted.
+    '''
+    days = sorted(days)
+    if len(days) == 0:
+        return []
+    print('Plot from file {}'.format(log_file_name))
+    if store_dir is None:
+        store_dir = path.join(path.dirname(log_file_name), TEMPLOG_DIR)
+    store = TempLogStore(store_dir)
+    store.ingest(log_file_name, days[0])
+    jobs = []
+    for day in days:
+        day_plot_file_path = range_plot_file_path(plot_file_path, day)
+        try:
+            day_mtime = path.getmtime(store.partition_path(day))
+        except OSError:
+            print('Nothing to plot at', day)
+            continue
+        if force is not True and path.isfile(day_plot_file_path) and \
+                            path.getmtime(day_plot_file_path) >= day_mtime:
+            # up to date
+            continue
+        jobs.append((store_dir, day, day_plot_file_path))
+    plotted = []
+    if len(jobs) == 0:
+        return plotted
+    if processes is None:
+        processes = cpu_count()
+    pool = Pool(processes=min(processes, len(jobs)),
+                initializer=_init_day_worker)
+    try:
+        results = dict(pool.imap_unordered(plot_day, jobs))
+        pool.close()
+    except (Exception, KeyboardInterrupt):
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    for _, day, day_plot_file_path in jobs:
+        if results[day] == 0:
+            plotted.append((day, day_plot_file_path))
+        else:
+            print('Nothing to plot at', day)
+    return plotted
+
+
 def date_range_by_day(start_date, ndays):
     '''Generates dates, day by day, starting from `start_date`
     for `ndays`
@@ -318,9 +566,12 @@ def date_range_by_day(start_date, ndays):
 
 
 def main(argv):
+    '''With 'byday' after the end date, each day of the range
+    is plotted to its own file (see templot_days).
+    '''
     argc = len(argv)
-    if argc < 4 or argc > 5:
-        print('Sintax: {} <log_file_path> <plot_file_path> <start_date> [<end_date>]'
+    if argc < 4 or argc > 6 or (argc == 6 and argv[5] != 'byday'):
+        print('Sintax: {} <log_file_path> <plot_file_path> <start_date> [<end_date> [byday]]'
                                                 .format(path.basename(argv[0])) )
         return -1
 
@@ -330,6 +581,11 @@ def main(argv):
     except IndexError:
         end_date = None
 
+    if argc == 6:
+        ndays = (datetime.strptime(end_date, '%Y-%m-%d') -
+                 datetime.strptime(argv[3], '%Y-%m-%d')).days + 1
+        templot_days(argv[1], argv[2], date_range_by_day(argv[3], ndays))
+        return 0
     templot(argv[1], argv[2], argv[3], end_date)
     return 0
 
@@ -355,4 +611,6 @@ if __name__ == "__main__":
     from_date = (today - timedelta(days=7)).strftime('%Y-%m-%d')
     to_date = today.strftime('%Y-%m-%d')
     main(argv + [from_date, to_date])
+    # and each one of them
+    main(argv + [from_date, to_date, 'byday'])
  
\ No newline at end of file
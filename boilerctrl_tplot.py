@@ -6,6 +6,10 @@ Download the temperature log from the boilerctrl dropbox datastore;
 plot temperature trend of the previous day grouped by weather services;
 upload the plot graph to the same boilerctrl dropbox datastore.
 
+If a number of days is given, each one of the days before today
+is plotted to its own graph, rendered by a pool of processes;
+the graphs already up to date in the working directory are skipped.
+
 The dropbox datastore has the following directory structure:
     datastore-name
     |-- directory_1
@@ -24,9 +28,11 @@ The dropbox datastore has the following directory structure:
     |-- file_1
     |-- ...
     |-- file_n
-    `-- boilerctrl-log.txt
+    |-- boilerctrl-log.txt
+    `-- boilerctrl-log.txt.idx
 
-boilerctrl-log.txt file is generated by boilerctrl.py
+boilerctrl-log.txt file is generated by boilerctrl.py,
+along with its day index boilerctrl-log.txt.idx (see boilerctrl/logindex.py).
 The plot graph is uploaded to temp-plot-byday directory.
 
 
@@ -61,11 +67,14 @@ from datetime import date, timedelta
 from os import makedirs, rename
 from os.path import dirname, basename, join, realpath, isdir
 from sys import argv
-from boilerctrl.templot import templot
+from boilerctrl.templot import date_range_by_day, templot, templot_days
+from boilerctrl.templog import TEMPLOG_DIR
+from boilerctrl.logindex import index_file_path
 from cloud.upload import download_datastore, upload_datastore
 
 
 LOG_FILE_NAME = 'boilerctrl-log.txt'
+LOG_INDEX_NAME = index_file_path(LOG_FILE_NAME)
 PLOT_FILE_NAME = 'templot.png'
 WORKING_SUB_DIR = 'temp-plot-byday'
 
@@ -76,10 +85,19 @@ def main(argv):
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s',
                         level=logging.DEBUG)
     argc = len(argv)
-    if argc != 2:
-        print('Sintax: {} <local-datastore>'.format(basename(argv[0]) ))
+    if argc < 2 or argc > 3:
+        print('Sintax: {} <local-datastore> [<days>]'.format(basename(argv[0]) ))
         return 1
     local_datastore = argv[1]
+    ndays = 1
+    if argc == 3:
+        try:
+            ndays = int(argv[2])
+        except ValueError:
+            ndays = 0
+        if ndays < 1:
+            print('days must be a positive integer')
+            return 1
     working_dir = join(local_datastore, WORKING_SUB_DIR)
     try: 
         makedirs(working_dir)
@@ -98,9 +116,29 @@ def main(argv):
     except:
         logging.error('Unable to move %s to %s' % (LOG_FILE_NAME, working_dir))
         return 1
+    # the day index of the log is optional: without it the log is searched
+    if download_datastore(local_datastore, LOG_INDEX_NAME) == 0:
+        try:
+            rename(join(local_datastore, LOG_INDEX_NAME),
+                                        index_file_path(log_file_path))
+        except OSError:
+            logging.error('Unable to move %s to %s' % (LOG_INDEX_NAME, working_dir))
+
+    # the columnar store is kept in the datastore root, not uploaded
+    store_dir = join(local_datastore, TEMPLOG_DIR)
+    if ndays > 1:
+        # batch: the log is read once and the days are plotted concurrently
+        first_day = (date.today() - timedelta(days=ndays)).strftime('%Y-%m-%d')
+        plotted = templot_days(log_file_path, plot_file_path,
+                        date_range_by_day(first_day, ndays), store_dir=store_dir)
+        if len(plotted) == 0:
+            logging.info('Nothing to plot since %s' % first_day)
+            return 1
+        return upload_datastore(local_datastore)
 
     plot_day = (date.today() - timedelta(days=1)).strftime('%Y-%m-%d')
-    if templot(log_file_path, plot_file_path, plot_day) != 0:
+    if templot(log_file_path, plot_file_path, plot_day,
+                                            store_dir=store_dir) != 0:
         logging.info('Nothing to plot at %s' % plot_day)
         return 1
 
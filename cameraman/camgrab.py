@@ -40,14 +40,40 @@ See also: Link: http://stackoverflow.com/a/11094891
 
 from __future__ import print_function
 
-from requests import get, post
 from time import sleep
 from sys import stderr
 
+try:
+    # For Python 3.3 and later
+    from time import monotonic
+except ImportError:
+    # Fall back to Python 2: wall clock
+    from time import time as monotonic
+
+from cameraman.camsession import CAMERA_SESSIONS, formatPoolStats
+from cameraman.usbcapture import USB_IDLE_RELEASE, USB_SETTLE_TIME, \
+                                 getUsbCaptureWorker
+
 
 '''In dark image detection, compare 'light' pixels with 'dark' ones.'''
 LIGHT_THRESHOLD_DEFAULT = -1
 
+'''Dark image detection decodes the JPEG image reduced by this factor.'''
+DARK_DETECT_SCALE = 8
+
+'''Size of the blocks read from the IP camera connection.'''
+GRAB_CHUNK_SIZE = 64 * 1024
+
+'''Size of the blocks read from the IP camera MJPEG stream.
+A block is returned only when all its bytes are received,
+then it is much smaller than a frame, not to delay the frames.
+'''
+STREAM_CHUNK_SIZE = 4 * 1024
+
+'''JPEG start and end of image markers.'''
+JPEG_SOI = b'\xff\xd8'
+JPEG_EOI = b'\xff\xd9'
+
 
 def cv2_gshistogram(imageAsByteArray):
     '''Use OpenCV tp convert the bytearray image buffer to grayscale and
@@ -57,12 +83,10 @@ def cv2_gshistogram(imageAsByteArray):
     Since the source image has been converted to one only band (grayscale),
     there are 256 pixel counts, that is an index for each shade of grey.
     '''
-    from cv2 import calcHist, imdecode, IMREAD_GRAYSCALE
-    from numpy import frombuffer, uint8
+    from pydimage.imgbackend import get_backend
 
-    img = frombuffer(imageAsByteArray, dtype=uint8)
-    grayimg = imdecode(img, IMREAD_GRAYSCALE)
-    return calcHist([grayimg],[0],None,[256],[0,256])
+    backend = get_backend('opencv')
+    return backend.histogram(backend.decode(imageAsByteArray, grey=True))
 
 
 def pil_gshistogram(imageAsByteArray):
@@ -72,20 +96,69 @@ def pil_gshistogram(imageAsByteArray):
 
     Since the source image has been converted to one only band (grayscale),
     there are 256 pixel counts, that is an index for each shade of grey.
+
+    It doesn't require NumPy, then it is the fallback
+    of the pydimage.imgbackend backends.
     '''
     from PIL import Image
-    import StringIO
+    from io import BytesIO
 
     # Convert the bytes object containing a jpeg image to Pillow
     # see: https://stackoverflow.com/a/24997383
-    img = Image.open(StringIO.StringIO(imageAsByteArray))
+    # (BytesIO accepts the bytearray returned by grabImage)
+    img = Image.open(BytesIO(imageAsByteArray))
 
     # Convert to greyscale and return the pixel counts list
     grayimg = img.convert(mode='L')
     return grayimg.histogram()
 
 
-def isDarkImage(imageAsBytearray, lightThreshold=LIGHT_THRESHOLD_DEFAULT):
+def histogram_lightcounts(pixel_counts):
+    '''In a grayscale histogram, the first 128 values are 'dark',
+    the last 128 are 'light' pixels.
+
+    Returns light_pixels, dark_pixels
+    '''
+    indexes = len(pixel_counts)  # should be 256 (an index for each shade of grey)
+    return sum(pixel_counts[indexes//2:]), sum(pixel_counts[:indexes//2])
+
+
+def backend_lightcounts(backend, scale):
+    '''Returns a function counting light and dark pixels of a JPEG image
+    by means of the named pydimage.imgbackend backend
+    (the fastest installed if None),
+    decoding the luminance only, reduced by the scale factor.
+    '''
+    def lightcounts(imageAsByteArray):
+        from pydimage.imgbackend import lightcounts as imgbackend_lightcounts
+        return imgbackend_lightcounts(imageAsByteArray, scale, backend)
+    return lightcounts
+
+
+'''The ways to count light and dark pixels of a JPEG image.
+'auto' uses the fastest pydimage.imgbackend backend installed.
+'''
+DARK_DETECT_BACKENDS = {
+    'auto': backend_lightcounts(None, DARK_DETECT_SCALE),
+    'pil-draft': backend_lightcounts('pil', DARK_DETECT_SCALE),
+    'cv2-reduced': backend_lightcounts('opencv', DARK_DETECT_SCALE),
+    'cv2-histogram': backend_lightcounts('opencv', 1),
+    'pil-histogram': lambda img: histogram_lightcounts(pil_gshistogram(img))
+}
+DARK_DETECT_BACKEND = 'auto'
+DARK_DETECT_FALLBACK = 'pil-histogram'
+
+
+def setDarkDetectBackend(backend):
+    '''Select the default backend used by isDarkImage.'''
+    global DARK_DETECT_BACKEND
+    if backend not in DARK_DETECT_BACKENDS:
+        raise ValueError('Unknown dark detect backend %s' % backend)
+    DARK_DETECT_BACKEND = backend
+
+
+def isDarkImage(imageAsBytearray, lightThreshold=LIGHT_THRESHOLD_DEFAULT,
+                                                            backend=None):
     '''Return True if in the grayscale histogram of the image there are
     less 'light' pixels than 'dark' ones.
     If lightThreshold is supplied then 'light' pixels are compared with it.
@@ -93,12 +166,21 @@ def isDarkImage(imageAsBytearray, lightThreshold=LIGHT_THRESHOLD_DEFAULT):
     # In a grayscale histogram, the first 128 values are 'dark',
     # the last 128 are 'light' pixels.
     See: https://stackoverflow.com/a/8659785
+
+    The pixels are counted by the given backend (see DARK_DETECT_BACKENDS),
+    by default DARK_DETECT_BACKEND. If the backend library is not installed,
+    then DARK_DETECT_FALLBACK is used.
     '''
-    pixel_counts = pil_gshistogram(imageAsBytearray)
-    indexes = len(pixel_counts)  # should be 256 (an index for each shade of grey)
-    light_pixels = sum(pixel_counts[indexes/2:])
+    if backend is None:
+        backend = DARK_DETECT_BACKEND
+    try:
+        light_pixels, dark_pixels = \
+                        DARK_DETECT_BACKENDS[backend](imageAsBytearray)
+    except ImportError:
+        light_pixels, dark_pixels = \
+                DARK_DETECT_BACKENDS[DARK_DETECT_FALLBACK](imageAsBytearray)
     if lightThreshold <= LIGHT_THRESHOLD_DEFAULT:
-        lightThreshold = sum(pixel_counts[:indexes/2])  # dark pixels
+        lightThreshold = dark_pixels
     if light_pixels <= lightThreshold:
         return True
     return False
@@ -115,8 +197,9 @@ def lightsIP(cameraUrl, username, password, switchOn):
         payload = {"IRLed":"1"}
     else:
         payload = {"IRLed":"0"}
+    session = CAMERA_SESSIONS.get(cameraUrl, username, password)
     try:
-        r = post(cameraUrl, auth=(username, password),  data=payload)
+        r = session.post(cameraUrl, data=payload, timeout=10)
     except Exception:
         # TODO: better to handle exceptions as in:
         # http://docs.python-requests.org/en/latest/user/quickstart/#errors-and-exceptions
@@ -129,41 +212,150 @@ def lightsIP(cameraUrl, username, password, switchOn):
     return False
 
 
-def grabImageFromIP(cameraUrl, username, password):
+def accumulateChunks(chunks, contentLength=None):
+    '''Join the data blocks returned by the chunks iterator.
+
+    Appending each block to a bytes object copies the whole image every time
+    (quadratic in the image size), then the blocks are copied in place
+    into a bytearray preallocated to contentLength, if known,
+    or grown by amortized resizing otherwise.
+
+    Returns bytearray.
+    '''
+    try:
+        buf = bytearray(int(contentLength))
+    except (TypeError, ValueError):
+        buf = bytearray()
+    nbytes = 0
+    for chunk in chunks:
+        end = nbytes + len(chunk)
+        # replace the preallocated bytes, or grow past the end of buf
+        buf[nbytes:end] = chunk
+        nbytes = end
+    if nbytes < len(buf):
+        # less data than announced
+        del buf[nbytes:]
+    return buf
+
+
+def grabImageFromIP(cameraUrl, username, password, sinkFile=None,
+                                                        deadline=None):
     '''Grabs a snapshot from the IP camera referenced by its URL.
     See: http://stackoverflow.com/a/13137873
 
+    The connection to the camera is kept alive (see camsession module).
+
+    If the binary file object sinkFile is given, the image is written
+    straight into it while received, and it is not returned.
+    Writing it is given up at the deadline (a monotonic() time), if any.
+
     Returns bool, JPEG bytearray.
     '''
+    session = CAMERA_SESSIONS.get(cameraUrl, username, password)
     try:
-        r = get(cameraUrl, auth=(username, password), timeout=10, stream=True)
+        r = session.get(cameraUrl, timeout=10, stream=True)
     except Exception:
         # TODO: better to handle exceptions as in:
         # http://docs.python-requests.org/en/latest/user/quickstart/#errors-and-exceptions
         return False, None
     if r.status_code != 200:
+        r.close()
         return False, None
-    jpgImage = b""
-    for chunk in r.iter_content(1024):
-        jpgImage = jpgImage + chunk
-    if len(jpgImage) == 0:
+    try:
+        if sinkFile is None:
+            jpgImage = accumulateChunks(r.iter_content(GRAB_CHUNK_SIZE),
+                                        r.headers.get('content-length'))
+            nbytes = len(jpgImage)
+        else:
+            jpgImage = None
+            nbytes = 0
+            for chunk in r.iter_content(GRAB_CHUNK_SIZE):
+                if deadline is not None and monotonic() > deadline:
+                    r.close()
+                    return False, None
+                sinkFile.write(chunk)
+                nbytes = nbytes + len(chunk)
+    except Exception:
+        # connection broken while receiving
+        r.close()
+        return False, None
+    if nbytes == 0:
         return False, None
     return True, jpgImage
 
 
-def grabImageFromUSB(cameraNumber=0):
+def splitJpegFrames(chunks):
+    '''Split the data blocks of a MJPEG stream (i.e. multipart/x-mixed-replace)
+    into JPEG frames, delimited by their start and end of image markers;
+    the part boundaries and headers in between are discarded.
+    The data are scanned only once: a frame is searched for its end marker
+    only in the blocks received after the last search.
+
+    Yields the frames as bytes.
+    '''
+    buf = bytearray()
+    scan = -1  # where to search for the end marker, -1 if no frame started
+    for chunk in chunks:
+        buf += chunk
+        while True:
+            if scan < 0:
+                start = buf.find(JPEG_SOI)
+                if start < 0:
+                    # keep the last byte: it may begin a marker
+                    del buf[:-1]
+                    break
+                del buf[:start]
+                scan = len(JPEG_SOI)
+            end = buf.find(JPEG_EOI, scan)
+            if end < 0:
+                scan = max(len(buf) - 1, len(JPEG_SOI))
+                break
+            end = end + len(JPEG_EOI)
+            frame = bytes(buf[:end])
+            del buf[:end]
+            scan = -1
+            yield frame
+
+
+def iterFramesFromIP(streamUrl, username, password):
+    '''Read the MJPEG stream of the IP camera referenced by its URL,
+    on a connection of the camera session (see camsession module).
+
+    Yields the JPEG frames as bytes,
+    until the stream ends or the connection is broken.
+    '''
+    session = CAMERA_SESSIONS.get(streamUrl, username, password)
+    try:
+        r = session.get(streamUrl, timeout=10, stream=True)
+    except Exception:
+        return
+    try:
+        if r.status_code != 200:
+            return
+        for frame in splitJpegFrames(r.iter_content(STREAM_CHUNK_SIZE)):
+            yield frame
+    except Exception:
+        # connection broken while receiving
+        return
+    finally:
+        r.close()
+
+
+def grabImageFromUSB(cameraNumber=0, settleTime=USB_SETTLE_TIME,
+                                            idleRelease=USB_IDLE_RELEASE):
     '''Grabs a snapshot from the specified USB camera.
 
+    The camera is kept open by a worker thread (see usbcapture module)
+    and released after idleRelease seconds without snapshots,
+    so only the first snapshot waits settleTime seconds for the exposure.
+
     Returns bool, video frame decoded as a JPEG bytearray.
     '''
-    from cv2 import VideoCapture, imencode
+    from cv2 import imencode
 
-    # initialize the camera
-    cam = VideoCapture(cameraNumber)    
-    sleep(5)  # wait for camera setting, otherwise the image will be dark
-    retVal, rawData = cam.read()
-    cam.release()
-    if not retVal:
+    rawData = getUsbCaptureWorker(cameraNumber,
+                                  settleTime, idleRelease).grabFrame()
+    if rawData is None:
         # frame captured returns errors
         return False, None
     retVal, jpgData = imencode('.jpg', rawData)
@@ -183,7 +375,16 @@ def grabImage(cameraDesc):
     jpgImage = b""
     camProtAndAddr = cameraDesc['source'].split('://')
     if camProtAndAddr[0] == 'usb':
-        retval, jpgImage = grabImageFromUSB(eval(camProtAndAddr[1]))
+        try:
+            settleTime = float(cameraDesc['optional-usb']['settle-time'])
+        except (KeyError, ValueError):
+            settleTime = USB_SETTLE_TIME
+        try:
+            idleRelease = float(cameraDesc['optional-usb']['idle-release'])
+        except (KeyError, ValueError):
+            idleRelease = USB_IDLE_RELEASE
+        retval, jpgImage = grabImageFromUSB(eval(camProtAndAddr[1]),
+                                            settleTime, idleRelease)
     elif camProtAndAddr[0] == 'http':
         retval, jpgImage = grabImageFromIP(cameraDesc['source'],
                         cameraDesc['optional-auth']['user-name'],
@@ -191,7 +392,51 @@ def grabImage(cameraDesc):
     return retval, jpgImage
 
 
-def imageCapture(cameraDesc, imageFileName):
+def grabImageToFile(cameraDesc, imageFileName, deadline=None):
+    '''Wraps grabImage saving the snapshot to the specified file.
+    Images from IP cameras are written while received,
+    without holding them in memory.
+    The image is written to a temporary file renamed when complete,
+    so that imageFileName never contains a truncated image.
+    An image completed after the deadline (a monotonic() time), if any,
+    is discarded: the caller has already given up waiting for it.
+
+    Returns bool
+    '''
+    from os import remove, rename
+
+    partFileName = imageFileName + '.part'
+    retVal = False
+    try:
+        with open(partFileName, 'wb') as f:
+            if cameraDesc['source'].split('://')[0] == 'http':
+                try:
+                    username = cameraDesc['optional-auth']['user-name']
+                    password = cameraDesc['optional-auth']['password']
+                except KeyError:
+                    username = ''
+                    password = ''
+                retVal, _ = grabImageFromIP(cameraDesc['source'],
+                                            username, password, f, deadline)
+            else:
+                retVal, jpgImage = grabImage(cameraDesc)
+                if retVal:
+                    f.write(jpgImage)
+        if retVal and deadline is not None and monotonic() > deadline:
+            retVal = False
+        if retVal:
+            rename(partFileName, imageFileName)
+    except (IOError, OSError):
+        retVal = False
+    if not retVal:
+        try:
+            remove(partFileName)
+        except OSError:
+            pass
+    return bool(retVal)
+
+
+def imageCapture(cameraDesc, imageFileName, deadline=None):
     '''Saves a snapshot from a camera to the specified file.
     If camera has night vision capability, use IrLeds; and if threshold is given
     first take am image with night vision off and if it is too dark compared
@@ -209,6 +454,8 @@ def imageCapture(cameraDesc, imageFileName):
         },
         "source":  "<camera_protocol_and_address>"
     }
+    The image completed after the deadline, if any, is discarded
+    (see grabImageToFile).
 
     Returns bool
     '''
@@ -248,7 +495,15 @@ def imageCapture(cameraDesc, imageFileName):
                 # grabImage returns errors
                 return False
             # and then compare with threshold
-            if isDarkImage(jpgImage, threshold):
+            try:
+                backend = cameraDesc['optional-irled']['opt-dark-detect-backend']
+            except KeyError:
+                backend = None
+            if backend is not None and backend not in DARK_DETECT_BACKENDS:
+                print('Unknown dark detect backend %s: using %s' %
+                                    (backend, DARK_DETECT_BACKEND), file=stderr)
+                backend = None
+            if isDarkImage(jpgImage, threshold, backend):
                 applyNightVision = True
                 print('Recover a Dark Image', file=stderr)
             else:
@@ -264,8 +519,8 @@ def imageCapture(cameraDesc, imageFileName):
             # wait for IrLeds settling
             sleep(4)
 
-    # take the image
-    grabOk, jpgImage = grabImage(cameraDesc)
+    # take the image and save it
+    grabOk = grabImageToFile(cameraDesc, imageFileName, deadline)
 
     # switch IrLeds OFF
     if applyNightVision:
@@ -275,17 +530,16 @@ def imageCapture(cameraDesc, imageFileName):
             print('FAIL to switch IrLeds OFF', file=stderr)
 
     if not grabOk:
-        # grabImage returns errors
+        # grabImage or saving the image returns errors
         return False
+    return True
 
-    # save the image
-    retVal = True
-    try:
-        with open(imageFileName, 'wb') as f:
-            f.write(jpgImage)
-    except IOError:
-        retVal = False
-    return retVal
+
+def httpPoolStats():
+    '''Returns the connection reuse statistics of the IP cameras
+    as printable lines.
+    '''
+    return formatPoolStats()
 
 
 if __name__ == "__main__":
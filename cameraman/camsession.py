@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Corrado Ubezio
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Keep-alive HTTP sessions shared by all the requests to IP cameras
+
+A requests.Session is created for each camera host (scheme, address, user)
+the first time it is accessed, with the camera credentials preconfigured.
+Then the next requests to the same host reuse the TCP connection
+instead of opening a new one each time.
+
+Sessions are thread safe, so the same session can be used
+by the concurrent snapshots and by the web app handlers.
+
+See: http://docs.python-requests.org/en/latest/user/advanced/#session-objects
+"""
+
+from __future__ import print_function
+
+from threading import Lock
+from requests import Session
+from requests.adapters import HTTPAdapter
+
+try:
+    from urllib3.util.retry import Retry
+except ImportError:
+    # older requests releases bundle urllib3
+    from requests.packages.urllib3.util.retry import Retry
+
+try:
+    # For Python 3.0 and later
+    from urllib.parse import urlparse
+except ImportError:
+    # Fall back to Python 2's urlparse
+    from urlparse import urlparse
+
+
+'''Connections kept alive for each camera host.
+More than one are required only if the same camera is accessed concurrently
+(i.e. the web app and snapshots grabbed at the same time).
+'''
+POOL_MAXSIZE = 4
+
+'''Retry the requests failed because of connection errors
+or temporary server errors, waiting {backoff factor} * (2 ^ (retry - 1))
+seconds between retries.
+Requests already sent (POST) are retried only on connection errors.
+Read timeouts are never retried: a camera not answering would hold
+a grab for several request timeouts (see RETRY_READ).
+'''
+RETRY_TOTAL = 2
+RETRY_BACKOFF_FACTOR = 0.3
+RETRY_STATUS_FORCELIST = (500, 502, 503, 504)
+RETRY_READ = 0
+
+
+class CameraSessionPool(object):
+    '''The set of sessions, one for each camera host.'''
+
+    def __init__(self, pool_maxsize=POOL_MAXSIZE, retry_total=RETRY_TOTAL):
+        self._lock = Lock()
+        self._sessions = {}
+        self.pool_maxsize = pool_maxsize
+        self.retry_total = retry_total
+
+    def _new_session(self, username, password):
+        retries = Retry(total=self.retry_total,
+                        read=RETRY_READ,
+                        backoff_factor=RETRY_BACKOFF_FACTOR,
+                        status_forcelist=RETRY_STATUS_FORCELIST,
+                        raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=self.pool_maxsize,
+                              max_retries=retries)
+        session = Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if username or password:
+            session.auth = (username, password)
+        return session
+
+    def get(self, url, username='', password=''):
+        '''Returns the session bound to the camera host of the given url.'''
+        parsed_url = urlparse(url)
+        key = (parsed_url.scheme, parsed_url.netloc, username, password)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._new_session(username, password)
+                self._sessions[key] = session
+        return session
+
+    def stats(self):
+        '''Returns the connection reuse statistics for each camera host
+        as a list of dictionaries:
+            host         <scheme>://<address>
+            requests     number of requests sent
+            connections  number of new connections opened
+            reuse-rate   fraction of requests sent on a kept alive connection
+        '''
+        with self._lock:
+            sessions = list(self._sessions.items())
+        stats_list = []
+        for (scheme, netloc, _, _), session in sessions:
+            nrequests = 0
+            nconnections = 0
+            for adapter in set(session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for pool_key in pools.keys():
+                    pool = pools.get(pool_key)
+                    if pool is None:
+                        continue
+                    nrequests = nrequests + pool.num_requests
+                    nconnections = nconnections + pool.num_connections
+            reuse_rate = 0.0
+            if nrequests > 0:
+                reuse_rate = 1.0 - float(nconnections) / nrequests
+            stats_list.append({
+                'host': '%s://%s' % (scheme, netloc),
+                'requests': nrequests,
+                'connections': nconnections,
+                'reuse-rate': reuse_rate
+            })
+        return stats_list
+
+    def close(self):
+        '''Close all the sessions and their connections.'''
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions = {}
+        for session in sessions:
+            session.close()
+
+
+'''The pool shared by all the modules accessing IP cameras.'''
+CAMERA_SESSIONS = CameraSessionPool()
+
+
+def formatPoolStats(stats_list=None):
+    '''Returns the statistics of the shared pool as printable lines.'''
+    if stats_list is None:
+        stats_list = CAMERA_SESSIONS.stats()
+    lines = []
+    for host_stats in stats_list:
+        lines.append('%s: %d requests on %d connections (%0.0f%% reused)' %
+                        (host_stats['host'], host_stats['requests'],
+                         host_stats['connections'],
+                         100 * host_stats['reuse-rate']))
+    return lines
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Corrado Ubezio
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Compare the ways of joining the JPEG blocks received from an IP camera
+
+The former grabImageFromIP appended 1 KiB blocks to a bytes object,
+copying the whole image at each block: the time spent grows
+with the square of the image size.
+camgrab.accumulateChunks copies each block once into a bytearray
+(preallocated when the Content-Length is known): the time spent grows
+linearly with the image size.
+
+The camera is simulated by a list of random blocks, so the benchmark
+measures only the joining of the blocks.
+
+Run from the repository root:
+    python -m cameraman.grabbenchmark [<max_image_size_in_MB>]
+'''
+
+from __future__ import print_function
+
+import os
+import sys
+from time import time
+from cameraman.camgrab import GRAB_CHUNK_SIZE, accumulateChunks
+
+
+def concatChunks(chunks, contentLength=None):
+    '''The former way of joining the blocks'''
+    jpgImage = b""
+    for chunk in chunks:
+        jpgImage = jpgImage + chunk
+    return jpgImage
+
+
+class Benchmark(object):
+
+    def __init__(self, name, joinFunction, chunkSize, useContentLength):
+        self.name = name
+        self.joinFunction = joinFunction
+        self.chunkSize = chunkSize
+        self.useContentLength = useContentLength
+        self.results = []
+
+    def run(self, image):
+        '''Compute the spent time joining the blocks of the image.'''
+        chunks = [image[i:i+self.chunkSize]
+                        for i in range(0, len(image), self.chunkSize)]
+        contentLength = len(image) if self.useContentLength else None
+        deltat = time()
+        jpgImage = self.joinFunction(chunks, contentLength)
+        deltat = time() - deltat
+        if bytes(jpgImage) != image:
+            print('%s: joined image mismatch!' % self.name)
+        self.results.append((len(image), deltat))
+
+    def report(self):
+        print('\n%s stats:' % self.name)
+        base_size, base_deltat = self.results[0]
+        for size, deltat in self.results:
+            # with linear growth the time per MB is constant
+            print('%5.1f MB in %f seconds (%f s/MB, x%0.1f size -> x%0.1f time)'
+                        % (size / 1e6, deltat, deltat / (size / 1e6),
+                           float(size) / base_size,
+                           deltat / base_deltat if base_deltat > 0 else 0))
+
+
+if __name__ == "__main__":
+    if len(sys.argv[1:]) > 0:
+        max_size_mb = float(sys.argv[1])
+    else:
+        max_size_mb = 5.0
+    benchmarks = [
+        Benchmark('bytes concatenation (1 KiB blocks)', concatChunks, 1024, False),
+        Benchmark('bytearray (1 KiB blocks)', accumulateChunks, 1024, False),
+        Benchmark('bytearray (%d KiB blocks)' % (GRAB_CHUNK_SIZE / 1024),
+                                    accumulateChunks, GRAB_CHUNK_SIZE, False),
+        Benchmark('preallocated bytearray (%d KiB blocks)' %
+                                    (GRAB_CHUNK_SIZE / 1024),
+                                    accumulateChunks, GRAB_CHUNK_SIZE, True)
+    ]
+    size = 0.5e6
+    while size <= max_size_mb * 1e6:
+        print('Running %0.1f MB image...' % (size / 1e6))
+        image = os.urandom(int(size))
+        for benchmark in benchmarks:
+            benchmark.run(image)
+        size = size * 2
+    for benchmark in benchmarks:
+        benchmark.report()
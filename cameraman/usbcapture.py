@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Corrado Ubezio
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Long-lived USB camera capture
+
+Opening an USB camera requires some seconds to let the exposure settle,
+otherwise the image will be dark.
+Instead of opening and releasing the camera at each snapshot,
+a worker thread keeps the device open and continuously drains its frames,
+so that the latest one is served at once.
+
+The device is opened on the first request and released
+when no frame has been requested for idle_release seconds.
+
+The frames are drained with VideoCapture.grab(), that doesn't decode them;
+only some of them are decoded (retrieved) into a small ring buffer:
+periodically and whenever a request is waiting.
+
+See: https://docs.opencv.org/master/d8/dfe/classcv_1_1VideoCapture.html
+'''
+
+from __future__ import print_function
+
+import atexit
+from collections import deque
+from threading import Condition, Event, Lock, Thread
+from time import sleep, time
+
+
+'''Seconds to wait after opening the device before serving frames.'''
+USB_SETTLE_TIME = 5
+
+'''Seconds without requests before releasing the device.'''
+USB_IDLE_RELEASE = 60
+
+'''Number of decoded frames kept.'''
+USB_RING_SIZE = 4
+
+'''Seconds between two frames decoded when no request is waiting.'''
+USB_RETRIEVE_INTERVAL = 0.5
+
+'''Consecutive read errors before giving up the device.'''
+USB_MAX_READ_ERRORS = 10
+
+
+class UsbCaptureWorker(Thread):
+    '''Keep an USB camera open and serve its latest settled frame.'''
+
+    def __init__(self, cameraNumber, settleTime=USB_SETTLE_TIME,
+                        idleRelease=USB_IDLE_RELEASE, ringSize=USB_RING_SIZE):
+        super(UsbCaptureWorker, self).__init__(
+                                    name='UsbCapture-%d' % cameraNumber)
+        self.daemon = True
+        self.cameraNumber = cameraNumber
+        self.settleTime = settleTime
+        self.idleRelease = idleRelease
+        self.ring = deque(maxlen=ringSize)  # (timestamp, frame) tuples
+        self.cond = Condition()
+        self.wake_evt = Event()
+        self._f_running = True
+        self._open_time = None  # None if the device is released
+        self._last_request = 0
+        self._waiting = 0  # number of pending requests
+        self._failures = 0  # increased each time the device fails
+
+    def _settled_frame(self):
+        '''Returns the latest frame taken after the settle time, or None'''
+        if self._open_time is None or len(self.ring) == 0:
+            return None
+        timestamp, frame = self.ring[-1]
+        if timestamp < self._open_time + self.settleTime:
+            return None
+        return frame
+
+    def _open(self):
+        from cv2 import VideoCapture
+
+        cam = VideoCapture(self.cameraNumber)
+        if not cam.isOpened():
+            cam.release()
+            return None
+        with self.cond:
+            self.ring.clear()
+            self._open_time = time()
+        return cam
+
+    def _release(self, cam, failed=False):
+        cam.release()
+        with self.cond:
+            self.ring.clear()
+            self._open_time = None
+            # requests served while the device was open
+            # don't have to open it again, but a pending one does
+            # (the failed requests are woken up below with None)
+            if self._waiting == 0 or failed is True:
+                self.wake_evt.clear()
+            if failed is True:
+                self._failures = self._failures + 1
+                self.cond.notify_all()
+
+    def run(self):
+        cam = None
+        read_errors = 0
+        last_retrieve = 0
+        while self._f_running is True:
+            if cam is None:
+                # wait for a request
+                self.wake_evt.wait()
+                self.wake_evt.clear()
+                if self._f_running is not True:
+                    break
+                cam = self._open()
+                if cam is None:
+                    with self.cond:
+                        self._failures = self._failures + 1
+                        self.cond.notify_all()
+                    continue
+                read_errors = 0
+            # drain the device buffer
+            if not cam.grab():
+                read_errors = read_errors + 1
+                if read_errors >= USB_MAX_READ_ERRORS:
+                    self._release(cam, failed=True)
+                    cam = None
+                else:
+                    sleep(0.1)
+                continue
+            read_errors = 0
+            now = time()
+            with self.cond:
+                waiting = self._waiting > 0
+                idle = now - self._last_request
+                settled = now >= self._open_time + self.settleTime
+            if (waiting and settled) or \
+                                now - last_retrieve >= USB_RETRIEVE_INTERVAL:
+                retVal, frame = cam.retrieve()
+                if retVal:
+                    last_retrieve = now
+                    with self.cond:
+                        self.ring.append((now, frame))
+                        self.cond.notify_all()
+            if idle >= self.idleRelease and not waiting:
+                self._release(cam)
+                cam = None
+        if cam is not None:
+            self._release(cam)
+
+    def grabFrame(self, timeout=None):
+        '''Returns the latest settled frame (numpy array)
+        or None on timeout or device errors.
+        If the device is released, it is opened and the settle time
+        is waited for.
+        '''
+        if timeout is None:
+            timeout = self.settleTime + 5
+        deadline = time() + timeout
+        with self.cond:
+            self._last_request = time()
+            failures = self._failures
+            frame = self._settled_frame()
+            if frame is not None:
+                # served from the ring buffer if recent enough
+                if time() - self.ring[-1][0] <= USB_RETRIEVE_INTERVAL:
+                    return frame
+            self._waiting = self._waiting + 1
+            self.wake_evt.set()
+            try:
+                last_timestamp = self.ring[-1][0] if len(self.ring) > 0 else 0
+                while True:
+                    frame = self._settled_frame()
+                    if frame is not None and \
+                                    self.ring[-1][0] > last_timestamp:
+                        return frame
+                    if self._failures != failures:
+                        return None
+                    remaining = deadline - time()
+                    if remaining <= 0:
+                        return None
+                    self.cond.wait(remaining)
+            finally:
+                self._waiting = self._waiting - 1
+
+    def terminate(self):
+        '''Release the device and wait until the thread terminates.'''
+        self._f_running = False
+        self.wake_evt.set()
+        if self.is_alive():
+            self.join()
+
+
+_workers_lock = Lock()
+_workers = {}
+
+
+def getUsbCaptureWorker(cameraNumber, settleTime=USB_SETTLE_TIME,
+                                            idleRelease=USB_IDLE_RELEASE):
+    '''Returns the running worker of the given camera,
+    creating it the first time.
+    '''
+    with _workers_lock:
+        worker = _workers.get(cameraNumber)
+        if worker is None:
+            worker = UsbCaptureWorker(cameraNumber, settleTime, idleRelease)
+            worker.start()
+            _workers[cameraNumber] = worker
+        else:
+            worker.settleTime = settleTime
+            worker.idleRelease = idleRelease
+    return worker
+
+
+@atexit.register
+def terminateUsbCaptureWorkers():
+    '''Release all the USB cameras.'''
+    with _workers_lock:
+        workers = list(_workers.values())
+        _workers.clear()
+    for worker in workers:
+        worker.terminate()
+
+
+if __name__ == "__main__":
+    '''Grab some frames from the first USB camera'''
+    worker = getUsbCaptureWorker(0)
+    for loop_cnt in range(5):
+        deltat = time()
+        frame = worker.grabFrame()
+        deltat = time() - deltat
+        if frame is None:
+            print('Frame %d: grab failed in %fs' % (loop_cnt, deltat))
+        else:
+            print('Frame %d: %s grabbed in %fs' % (loop_cnt, frame.shape, deltat))
+        sleep(1)
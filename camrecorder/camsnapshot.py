@@ -27,12 +27,24 @@ from __future__ import print_function
 import logging
 from os.path import dirname, join, realpath
 
+try:
+    # For Python 3.3 and later
+    from time import monotonic
+except ImportError:
+    # Fall back to Python 2: wall clock
+    from time import time as monotonic
+
 
 # Globals
 VERSION = '1.0'
 DEFAULT_CFG_FILE = 'camrecordercfg.json'
 LOG_FILE_NAME = 'camcorderlog.txt'
 
+# Capture engine defaults
+CAPTURE_MAX_WORKERS = 0  # that is a thread for each camera
+CAPTURE_CAMERA_TIMEOUT = 40  # seconds (two grabs plus IR leds settling)
+CAPTURE_CYCLE_TIMEOUT = 60  # seconds
+
 DEFAULT_CFG_FILE_PATH = join(dirname(realpath(__file__)), DEFAULT_CFG_FILE)
 
 USAGE = """Take a snapshots from a bunch of cameras.
@@ -68,6 +80,64 @@ def mkdir(dir_name, verbose=False):
     return exists
 
 
+def capture_settings(cfg):
+    """Read the optional capture engine settings from the configuration:
+        "optional-capture": {
+            "max-workers": "<max_number_of_cameras_captured_at_the_same_time>",
+            "camera-timeout": "<max_seconds_spent_capturing_one_camera>",
+            "cycle-timeout": "<max_seconds_spent_capturing_all_cameras>"
+        }
+    Missing or malformed values fall back to the defaults.
+
+    Returns max_workers, camera_timeout, cycle_timeout
+    """
+    settings = [
+        ('max-workers', CAPTURE_MAX_WORKERS),
+        ('camera-timeout', CAPTURE_CAMERA_TIMEOUT),
+        ('cycle-timeout', CAPTURE_CYCLE_TIMEOUT)
+    ]
+    values = []
+    for key, default in settings:
+        try:
+            value = int(cfg.data['optional-capture'][key])
+        except (KeyError, TypeError, ValueError):
+            value = default
+        values.append(value)
+    return tuple(values)
+
+
+def remove_part_files(dir_name, min_age):
+    """Remove the temporary files (*.part) older than min_age seconds
+    left in dir_name by the captures interrupted or abandoned
+    (i.e. the process exited while a camera was still sending).
+    """
+    from glob import glob
+    from os import remove
+    from os.path import getmtime
+    from time import time
+
+    for part_file in glob(join(dir_name, '*.part')):
+        try:
+            if time() - getmtime(part_file) > min_age:
+                remove(part_file)
+                logging.info('Remove stale %s' % part_file)
+        except OSError:
+            pass
+
+
+def capture_job(camera, pictureFileFullName, camera_timeout, cycle_deadline):
+    """Returns the fan out job capturing the camera.
+    The capture is given the same deadline of the job, so that
+    once abandoned it doesn't save the image after the cycle end.
+    """
+    from cameraman.camgrab import imageCapture
+
+    def job():
+        deadline = min(monotonic() + camera_timeout, cycle_deadline)
+        return imageCapture(camera, pictureFileFullName, deadline)
+    return job
+
+
 def snap_shot(cfg):
     '''Takes a snap shot from each camera in the list,
     and saves the image in a file with the following path name:
@@ -81,9 +151,12 @@ def snap_shot(cfg):
         SS  is the second as a decimal number [00,59].
 
         XX  is the camera index as a decimal number [00,99].
+
+    The cameras are captured concurrently (see capture_settings),
+    so the whole cycle lasts about as long as the slowest camera.
     '''
-    from cameraman.camgrab import imageCapture
     from datetime import datetime
+    from utils.threadingpool import fan_out
 
     # Make the grabbed picture file path
     picturesDirName = '{0:s}/SNAPSHOT_{1:%y%m%d}'\
@@ -93,20 +166,40 @@ def snap_shot(cfg):
         logging.error('Error create directory %s' % picturesDirName)
         return 1
 
-    nsnaps = 0
+    max_workers, camera_timeout, cycle_timeout = capture_settings(cfg)
+    remove_part_files(picturesDirName, cycle_timeout)
+    cycle_deadline = monotonic() + cycle_timeout
+
     print('Taking snap shots...')
+    jobs = []
+    pictures = []
     cameraIndex = 0
     for camera in cfg.data['cameras-list']:
         pictureFileFullName = '{0:s}/S_{1:%y%m%d_%H%M%S}_{2:02d}.jpg'\
                                     .format(picturesDirName,
                                         datetime.now(),
                                          cameraIndex)
-        if imageCapture(camera, pictureFileFullName) is False:
+        jobs.append(capture_job(camera, pictureFileFullName,
+                                camera_timeout, cycle_deadline))
+        pictures.append((camera, pictureFileFullName))
+        cameraIndex = cameraIndex + 1
+
+    results = fan_out(jobs, max_workers, camera_timeout, cycle_timeout,
+                                                        name='SnapShot')
+    nsnaps = 0
+    for (camera, pictureFileFullName), result in zip(pictures, results):
+        if result.timed_out is True:
+            logging.error('get image from camera %s: timeout after %0.1fs' %
+                                        (camera['source'], result.elapsed))
+        elif result.error is not None:
+            logging.error('get image from camera %s: %s' %
+                                        (camera['source'], result.error))
+        elif result.value is False:
             logging.error('get image from camera %s' % camera['source'])
         else:
             nsnaps = nsnaps + 1
-            logging.info('Save image %s' % pictureFileFullName)
-        cameraIndex = cameraIndex + 1
+            logging.info('Save image %s in %0.1fs' %
+                                    (pictureFileFullName, result.elapsed))
     print('Total %d snap shots' % nsnaps)
     return 0
 
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Corrado Ubezio
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+'''Skip the upload of duplicated volatile files.
+
+Consecutive snapshots of a static camera (i.e. at night)
+are often byte-identical or nearly identical.
+
+Exact duplicates: a file with the same content hash (sha256)
+of a file already uploaded (see uploadmanifest.remote_copy)
+or scheduled for upload in the same run is not uploaded.
+
+Near duplicates (optional, lossy): the average hash of an image is
+computed from its greyscale decode reduced by 8 (see pydimage.imgbackend):
+the image is divided in 8x8 blocks and each bit of the hash tells
+if a block is lighter than the average of the whole image.
+An image is not uploaded if its hash differs in no more than
+max_distance bits from the one of the last image uploaded
+from the same camera (the XX suffix of S_yymmdd_HHMMSS_XX.jpg),
+and its average brightness differs in no more than
+DEDUP_MAX_BRIGHTNESS_DELTA grey levels (the average hash doesn't
+change when the whole scene gets darker or lighter).
+Requires NumPy and Pillow or OpenCV.
+
+Duplicates are removed from the datastore as if they were uploaded.
+Persistent files are never deduplicated.
+'''
+
+
+import logging
+from os.path import basename, splitext
+from threading import Lock
+
+
+DEDUP_EXACT = True
+DEDUP_PERCEPTUAL = False
+
+'''Max number of different bits (out of 64) between near duplicates.'''
+DEDUP_MAX_DISTANCE = 3
+
+'''Max difference of average grey level between near duplicates.'''
+DEDUP_MAX_BRIGHTNESS_DELTA = 8
+
+'''Images checked for near duplicates.'''
+DEDUP_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+AHASH_SIZE = 8
+
+
+def average_hash(image_file, backend=None):
+    '''Returns the 64 bit average hash of the image as an integer
+    and the average grey level of the image.
+    '''
+    from pydimage.imgbackend import get_backend
+
+    grey = get_backend(backend).decode(image_file, grey=True, reduce=8)
+    height = grey.shape[0] - grey.shape[0] % AHASH_SIZE
+    width = grey.shape[1] - grey.shape[1] % AHASH_SIZE
+    if height == 0 or width == 0:
+        raise ValueError('%s: image too small' % image_file)
+    blocks = grey[:height, :width].reshape(AHASH_SIZE, height // AHASH_SIZE,
+                                           AHASH_SIZE, width // AHASH_SIZE)
+    means = blocks.mean(axis=(1, 3))
+    brightness = means.mean()
+    ahash = 0
+    for bit in (means > brightness).ravel():
+        ahash = (ahash << 1) | int(bit)
+    return ahash, float(brightness)
+
+
+def hamming_distance(hash1, hash2):
+    return bin(hash1 ^ hash2).count('1')
+
+
+def camera_key(local_filepath):
+    '''The camera suffix of the snapshot file name'''
+    name, _ = splitext(basename(local_filepath))
+    return name.rsplit('_', 1)[-1]
+
+
+class UploadDedup(object):
+    '''Find the duplicates among the files to upload.
+
+    The files are checked sequentially, in the order they are uploaded.
+    '''
+
+    def __init__(self, manifest, exact=None, perceptual=None, max_distance=None):
+        '''None arguments take the module defaults (see set_dedup).'''
+        self.manifest = manifest
+        self.exact = DEDUP_EXACT if exact is None else exact
+        self.perceptual = DEDUP_PERCEPTUAL if perceptual is None else perceptual
+        self.max_distance = DEDUP_MAX_DISTANCE if max_distance is None \
+                                                            else max_distance
+        self.scheduled = {}  # sha256: remote path of files to upload
+        self._lock = Lock()
+
+    def duplicate_of(self, local_filepath, remote_filepath):
+        '''Returns the remote path of the file duplicated by local_filepath,
+        None if it has to be uploaded.
+        '''
+        if not (self.exact or self.perceptual):
+            return None
+        if not self.manifest.needs_upload(local_filepath):
+            # already uploaded
+            return None
+        digest = self.manifest.get(local_filepath)['sha256']
+        with self._lock:
+            if self.exact:
+                original = self.scheduled.get(digest)
+                if original is None:
+                    original = self.manifest.remote_copy(digest)
+                if original is not None and original != remote_filepath:
+                    return original
+            if self.perceptual:
+                original = self._near_duplicate_of(local_filepath,
+                                                            remote_filepath)
+                if original is not None and original != remote_filepath:
+                    return original
+            self.scheduled[digest] = remote_filepath
+        return None
+
+    def _near_duplicate_of(self, local_filepath, remote_filepath):
+        if splitext(local_filepath)[1].lower() not in DEDUP_IMAGE_EXTENSIONS:
+            return None
+        try:
+            ahash, brightness = average_hash(local_filepath)
+        except Exception as e:
+            logging.debug('%s: no average hash (%s: %s)' %
+                                (local_filepath, type(e).__name__, e))
+            return None
+        key = camera_key(local_filepath)
+        with self.manifest.lock:
+            last_hashes = self.manifest.dedup_state.setdefault('ahash', {})
+            last = last_hashes.get(key)
+            if last is not None and \
+                    hamming_distance(ahash, last[0]) <= self.max_distance and \
+                    abs(brightness - last[1]) <= DEDUP_MAX_BRIGHTNESS_DELTA:
+                return last[2]
+            last_hashes[key] = [ahash, brightness, remote_filepath]
+        return None
+
+
+def set_dedup(exact, perceptual, max_distance=DEDUP_MAX_DISTANCE):
+    '''Set the deduplication defaults of the next uploads.'''
+    global DEDUP_EXACT, DEDUP_PERCEPTUAL, DEDUP_MAX_DISTANCE
+    DEDUP_EXACT = exact
+    DEDUP_PERCEPTUAL = perceptual
+    DEDUP_MAX_DISTANCE = max_distance
+
+
+def dedup_settings(cfg):
+    """Read the optional deduplication settings from the configuration:
+        "optional-dedup": {
+            "exact": "<yes|no>",
+            "perceptual": "<yes|no>",
+            "max-distance": "<max_different_bits_of_near_duplicate_images>"
+        }
+    Missing or malformed values fall back to the defaults.
+
+    Returns exact, perceptual, max_distance
+    """
+    try:
+        dedup_cfg = cfg.data['optional-dedup']
+    except (KeyError, TypeError, AttributeError):
+        dedup_cfg = {}
+    values = []
+    for key, default in (('exact', DEDUP_EXACT),
+                         ('perceptual', DEDUP_PERCEPTUAL)):
+        value = str(dedup_cfg.get(key, '')).lower()
+        if value in ('yes', 'true', 'on'):
+            values.append(True)
+        elif value in ('no', 'false', 'off'):
+            values.append(False)
+        else:
+            values.append(default)
+    try:
+        values.append(int(dedup_cfg['max-distance']))
+    except (KeyError, TypeError, ValueError):
+        values.append(DEDUP_MAX_DISTANCE)
+    return tuple(values)
@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Corrado Ubezio
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+'''Dropbox HTTP API v2 client.
+
+Files are transferred in process by one requests.Session,
+so that the TLS connections to Dropbox are kept alive and shared
+by all the transfers, even the concurrent ones.
+
+The credentials are read from the Dropbox-Uploader configuration file
+(~/.dropbox_uploader, created running dropbox_uploader.sh the first time):
+either a long-lived access token (OAUTH_ACCESS_TOKEN)
+or the app key, secret and refresh token (OAUTH_APP_KEY, OAUTH_APP_SECRET,
+OAUTH_REFRESH_TOKEN) to get short-lived access tokens.
+
+Files larger than UPLOAD_SESSION_THRESHOLD are uploaded
+in chunks of UPLOAD_CHUNK_SIZE by an upload session,
+then the memory used is bounded whatever the file size:
+the chunks are sliced from the memory-mapped file.
+Each chunk is sent with its Dropbox content hash, so that Dropbox
+rejects a corrupted chunk, and the content hash of the whole file,
+computed from the hashes of the chunks, is checked against the one
+of the committed file.
+The session state (id, offset, block hashes) is saved by an optional
+resume state object after each chunk (see
+uploadmanifest.UploadResumeState), then an interrupted upload
+resumes from the last chunk received by Dropbox.
+
+Ref: https://www.dropbox.com/developers/documentation/http/documentation
+'''
+
+
+import json
+import hashlib
+import logging
+import mmap
+from binascii import unhexlify
+from os import remove, rename
+from os.path import expanduser, getmtime, getsize
+from threading import Lock
+from time import time
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+
+
+DROPBOX_UPLOADER_CFG = '~/.dropbox_uploader'
+
+API_URL = 'https://api.dropboxapi.com'
+CONTENT_URL = 'https://content.dropboxapi.com'
+TOKEN_URL = 'https://api.dropbox.com/oauth2/token'
+
+'''Keep-alive connections, at least the number of concurrent transfers.'''
+POOL_MAXSIZE = 8
+
+'''Dropbox content hash block; chunks must be a multiple of it.'''
+HASH_BLOCK_SIZE = 4 * 1024 * 1024
+
+UPLOAD_CHUNK_SIZE = 2 * HASH_BLOCK_SIZE
+UPLOAD_SESSION_THRESHOLD = 4 * UPLOAD_CHUNK_SIZE
+DOWNLOAD_BLOCK_SIZE = 64 * 1024
+
+'''Seconds waiting for the server, per request.'''
+REQUEST_TIMEOUT = 60
+
+
+class DropboxApiError(Exception):
+    def __init__(self, value, status_code=None, error=None):
+        self.value = value
+        self.status_code = status_code
+        self.error = error  # the decoded error of the API call, if any
+
+    def __str__(self):
+        return "{0}".format(self.value)
+
+
+def block_hashes(data):
+    '''Returns the sha256 hex digests of the HASH_BLOCK_SIZE blocks of data'''
+    return [hashlib.sha256(data[i:i+HASH_BLOCK_SIZE]).hexdigest()
+                            for i in range(0, len(data), HASH_BLOCK_SIZE)]
+
+
+def content_hash(hashes):
+    '''Dropbox content hash from the block hashes.
+    Ref: https://www.dropbox.com/developers/reference/content-hash
+    '''
+    digest = hashlib.sha256()
+    for block_hash in hashes:
+        digest.update(unhexlify(block_hash))
+    return digest.hexdigest()
+
+
+def read_uploader_config(cfg_file=DROPBOX_UPLOADER_CFG):
+    '''Returns the KEY=VALUE pairs of the Dropbox-Uploader configuration.
+    Raises IOError if the file is missing.
+    '''
+    cfg = {}
+    with open(expanduser(cfg_file)) as f:
+        for line in f:
+            key, sep, value = line.strip().partition('=')
+            if sep == '=':
+                cfg[key.strip()] = value.strip().strip('"\'')
+    return cfg
+
+
+def remote_path(remote_file):
+    '''Dropbox paths are absolute (from the app folder)'''
+    return '/' + remote_file.lstrip('/')
+
+
+class DropboxApiTransport(object):
+    '''Upload and download files with the Dropbox HTTP API.'''
+    name = 'api'
+
+    def __init__(self, cfg_file=DROPBOX_UPLOADER_CFG):
+        cfg = read_uploader_config(cfg_file)
+        self._access_token = cfg.get('OAUTH_ACCESS_TOKEN')
+        self._app_key = cfg.get('OAUTH_APP_KEY')
+        self._app_secret = cfg.get('OAUTH_APP_SECRET')
+        self._refresh_token = cfg.get('OAUTH_REFRESH_TOKEN')
+        if not self._access_token and not self._refresh_token:
+            raise DropboxApiError('No Dropbox credentials in %s' % cfg_file)
+        self._token_expiry = None  # long-lived token
+        if self._refresh_token:
+            self._access_token = None
+        self._token_lock = Lock()
+        self.session = Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=POOL_MAXSIZE)
+        self.session.mount('https://', adapter)
+
+    def _token(self, renew=False):
+        '''Returns the access token, refreshing it if expired'''
+        with self._token_lock:
+            if self._refresh_token and (renew or self._access_token is None
+                                or time() >= self._token_expiry):
+                r = self.session.post(TOKEN_URL, data={
+                        'grant_type': 'refresh_token',
+                        'refresh_token': self._refresh_token,
+                        'client_id': self._app_key,
+                        'client_secret': self._app_secret
+                    }, timeout=REQUEST_TIMEOUT)
+                if r.status_code != 200:
+                    raise DropboxApiError('token refresh: HTTP %d %s' %
+                                                    (r.status_code, r.text))
+                token = r.json()
+                self._access_token = token['access_token']
+                # renew a minute before the expiry
+                self._token_expiry = time() + int(token.get('expires_in', 0)) - 60
+            return self._access_token
+
+    def _post(self, url, api_arg=None, data=None, json_body=None, stream=False):
+        '''POST an API call, renewing the access token once if rejected.
+        Returns the response; raises DropboxApiError on HTTP errors.
+        '''
+        renew = False
+        while True:
+            headers = {'Authorization': 'Bearer %s' % self._token(renew)}
+            if api_arg is not None:
+                headers['Dropbox-API-Arg'] = json.dumps(api_arg)
+                headers['Content-Type'] = 'application/octet-stream'
+            if hasattr(data, 'seek'):
+                data.seek(0)
+            r = self.session.post(url, headers=headers, data=data,
+                                  json=json_body, stream=stream,
+                                  timeout=REQUEST_TIMEOUT)
+            if r.status_code == 401 and self._refresh_token and not renew:
+                r.close()
+                renew = True
+                continue
+            if r.status_code != 200:
+                error = None
+                if r.status_code == 409:
+                    # endpoint specific error
+                    try:
+                        error = r.json().get('error')
+                    except ValueError:
+                        pass
+                raise DropboxApiError('%s: HTTP %d %s' % (url, r.status_code,
+                                                r.text), r.status_code, error)
+            return r
+
+    def upload(self, local_file, remote_file, resume_state=None):
+        path = remote_path(remote_file)
+        commit = {'path': path, 'mode': 'overwrite', 'mute': True}
+        size = getsize(local_file)
+        if size <= UPLOAD_SESSION_THRESHOLD:
+            with open(local_file, 'rb') as f:
+                self._post(CONTENT_URL + '/2/files/upload', commit, f)
+            return
+        with open(local_file, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                self._upload_session(data, size, getmtime(local_file),
+                                                        commit, resume_state)
+            finally:
+                data.close()
+
+    def _upload_session(self, data, size, mtime, commit, resume_state):
+        state = None
+        if resume_state is not None:
+            state = resume_state.load()
+            if state is not None and (state.get('path') != commit['path'] or
+                    state.get('size') != size or state.get('mtime') != mtime):
+                # the file changed since the session started
+                state = None
+        if state is not None:
+            logging.info('Resume upload of %s at %d of %d bytes' %
+                                        (commit['path'], state['offset'], size))
+        else:
+            chunk = data[0:UPLOAD_CHUNK_SIZE]
+            hashes = block_hashes(chunk)
+            r = self._post(CONTENT_URL + '/2/files/upload_session/start',
+                        {'close': False, 'content_hash': content_hash(hashes)},
+                        chunk)
+            state = {
+                'session_id': r.json()['session_id'],
+                'offset': len(chunk),
+                'path': commit['path'],
+                'size': size,
+                'mtime': mtime,
+                'block_hashes': hashes
+            }
+            if resume_state is not None:
+                resume_state.save(state)
+        while True:
+            offset = state['offset']
+            chunk = data[offset:offset+UPLOAD_CHUNK_SIZE]
+            hashes = block_hashes(chunk)
+            cursor = {'session_id': state['session_id'], 'offset': offset}
+            if offset + len(chunk) >= size:
+                break
+            try:
+                self._post(CONTENT_URL + '/2/files/upload_session/append_v2',
+                           {'cursor': cursor, 'close': False,
+                            'content_hash': content_hash(hashes)}, chunk)
+            except DropboxApiError as e:
+                if e.status_code != 409:
+                    # temporary failure: resume from this chunk next time
+                    raise
+                if e.error is None or \
+                        e.error.get('.tag') != 'incorrect_offset' or \
+                        e.error.get('correct_offset') != offset + len(chunk):
+                    if resume_state is not None:
+                        # session lost: restart from scratch next time
+                        resume_state.clear()
+                    raise
+                # the chunk was received, but the reply was lost
+            state['offset'] = offset + len(chunk)
+            state['block_hashes'] = state['block_hashes'] + hashes
+            if resume_state is not None:
+                resume_state.save(state)
+        try:
+            r = self._post(CONTENT_URL + '/2/files/upload_session/finish',
+                           {'cursor': cursor, 'commit': commit,
+                            'content_hash': content_hash(hashes)}, chunk)
+        except DropboxApiError as e:
+            if e.status_code == 409 and resume_state is not None:
+                resume_state.clear()
+            raise
+        if resume_state is not None:
+            resume_state.clear()
+        expected_hash = content_hash(state['block_hashes'] + hashes)
+        remote_hash = r.json().get('content_hash')
+        if remote_hash is not None and remote_hash != expected_hash:
+            raise DropboxApiError('%s: content hash mismatch' % commit['path'])
+
+    def download(self, local_file, remote_file):
+        '''Download to a temporary file, renamed when complete.'''
+        part_file = local_file + '.part'
+        r = self._post(CONTENT_URL + '/2/files/download',
+                            {'path': remote_path(remote_file)}, stream=True)
+        try:
+            with open(part_file, 'wb') as f:
+                for block in r.iter_content(DOWNLOAD_BLOCK_SIZE):
+                    f.write(block)
+        except:
+            try:
+                remove(part_file)
+            except OSError:
+                pass
+            raise
+        finally:
+            r.close()
+        rename(part_file, local_file)
+
+    def xfer(self, command, local_file, remote_file, resume_state=None):
+        '''Returns success'''
+        try:
+            if command == 'upload':
+                self.upload(local_file, remote_file, resume_state)
+                logging.info('Uploaded %s to %s' % (local_file, remote_file))
+            else:
+                self.download(local_file, remote_file)
+                logging.info('Downloaded %s to %s' % (remote_file, local_file))
+        except (DropboxApiError, RequestException, IOError, OSError,
+                                            ValueError, KeyError) as e:
+            logging.error('Dropbox %s %s: %s: %s' % (command, local_file,
+                                                        type(e).__name__, e))
+            return False
+        return True
+
+    def close(self):
+        self.session.close()
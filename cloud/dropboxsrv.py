@@ -23,46 +23,155 @@
 # SOFTWARE.
 
 
-'''This module wraps the Dropbox Uploader BASH script.
+'''Transfer files to/from a remote Dropbox folder.
 
-It is required Dropbox-Uploader.
-Ref: https://github.com/andreafabrizi/Dropbox-Uploader
+The transfers are delegated to a transport:
+    'shell'     the Dropbox Uploader BASH script, run for each file.
+                It is required Dropbox-Uploader.
+                Ref: https://github.com/andreafabrizi/Dropbox-Uploader
+    'api'       the in process Dropbox HTTP API client (see dropboxapi),
+                keeping one authenticated session for all the transfers.
+                It is required requests.
+    'local'     a local directory standing in for the Dropbox folder,
+                for testing without network access.
+By default ('auto') the 'api' transport is used if requests is installed
+and the Dropbox-Uploader configuration has credentials,
+otherwise the 'shell' one.
 
 It is mandatory to run Dropbox-Uploader-Install.sh
+and then dropbox_uploader.sh, to link the Dropbox account,
 before call this module the first time.
 
 '''
 
 
 import logging
+import shutil
+from os import makedirs
+from os.path import dirname, isdir, join
+from threading import Lock
 from utils.extcmd import ExtCmdRunError, runcmd
 
 
-def dropbox_file_xfer(command, local_file, remote_file):
+class ShellTransport(object):
+    '''Run dropbox_uploader.sh for each file.'''
+    name = 'shell'
+
+    def xfer(self, command, local_file, remote_file, resume_state=None):
+        '''Returns success'''
+        success = False
+        if command == 'upload':
+            xfercmd = 'dropbox_uploader.sh upload {0} {1}'.format(
+                                                        local_file, remote_file )
+        else:
+            xfercmd = 'dropbox_uploader.sh download {1} {0}'.format(
+                                                        local_file, remote_file )
+        retcode = -1
+        cmdoutput = ''
+        try:
+            retcode, cmdoutput = runcmd(xfercmd)
+        except ExtCmdRunError as e:
+            cmdoutput = 'ExtCmdRunError: {0}'.format(e)
+        if retcode == 0:
+            success = True
+        if len(cmdoutput) > 0:
+            #display the output of the external command
+            for outLine in cmdoutput.splitlines():
+                if success is True:
+                    logging.info(outLine)
+                else:
+                    logging.error(outLine)
+        return success
+
+
+class LocalTransport(object):
+    '''Copy files to/from a local directory standing in for Dropbox.'''
+    name = 'local'
+
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+
+    def xfer(self, command, local_file, remote_file, resume_state=None):
+        '''Returns success'''
+        remote_file = join(self.root_dir, remote_file.lstrip('/'))
+        if command == 'upload':
+            src, dst = local_file, remote_file
+        else:
+            src, dst = remote_file, local_file
+        try:
+            if not isdir(dirname(dst)):
+                makedirs(dirname(dst))
+            shutil.copyfile(src, dst)
+        except (IOError, OSError) as e:
+            logging.error('Local %s %s: %s' % (command, local_file, e))
+            return False
+        logging.info('%s %s to %s' % (command, src, dst))
+        return True
+
+
+def _api_transport(cfg_file=None):
+    from cloud.dropboxapi import DropboxApiTransport
+
+    if cfg_file is None:
+        return DropboxApiTransport()
+    return DropboxApiTransport(cfg_file)
+
+
+def _auto_transport():
+    try:
+        return _api_transport()
+    except Exception as e:
+        # requests not installed or account not linked
+        logging.debug('Dropbox API transport not available (%s)' % e)
+        return ShellTransport()
+
+
+'''Transport factories by name.'''
+XFER_TRANSPORTS = {
+    'auto': _auto_transport,
+    'shell': ShellTransport,
+    'api': _api_transport,
+    'local': LocalTransport
+}
+
+XFER_TRANSPORT = 'auto'
+
+_transport = None
+_transport_lock = Lock()
+
+
+def set_xfer_transport(name, *args):
+    '''Select the transport used by dropbox_file_xfer.
+    args are passed to the transport factory
+    (i.e. the root directory of the 'local' transport).
+    Raises KeyError if the name is unknown.
+    '''
+    global _transport
+    transport = XFER_TRANSPORTS[name](*args)
+    with _transport_lock:
+        old_transport = _transport
+        _transport = transport
+    if hasattr(old_transport, 'close'):
+        old_transport.close()
+    return transport
+
+
+def get_xfer_transport():
+    '''Returns the current transport, creating the default one the first time.'''
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = XFER_TRANSPORTS[XFER_TRANSPORT]()
+            logging.info('Dropbox transport: %s' % _transport.name)
+        return _transport
+
+
+def dropbox_file_xfer(command, local_file, remote_file, resume_state=None):
     '''upload/download local file to/from a remote Dropbox folder.
+    The uploads are resumed by the transports supporting it ('api')
+    if resume_state is given (see uploadmanifest.UploadResumeState).
 
     Returns success
     '''
-    success = False
-    if command == 'upload':
-        xfercmd = 'dropbox_uploader.sh upload {0} {1}'.format(
-                                                    local_file, remote_file )
-    else:
-        xfercmd = 'dropbox_uploader.sh download {1} {0}'.format(
-                                                    local_file, remote_file )
-    retcode = -1
-    cmdoutput = ''
-    try:
-        retcode, cmdoutput = runcmd(xfercmd)
-    except ExtCmdRunError as e:
-        cmdoutput = 'ExtCmdRunError: {0}'.format(e)
-    if retcode == 0:
-        success = True
-    if len(cmdoutput) > 0:
-        #display the output of the external command
-        for outLine in cmdoutput.splitlines():
-            if success is True:
-                logging.info(outLine)
-            else:
-                logging.error(outLine)
-    return success
+    return get_xfer_transport().xfer(command, local_file, remote_file,
+                                                                resume_state)
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Corrado Ubezio
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Compiled paths to the items of JSON documents.
+
+A path is a string of keys separated by '/';
+numeric keys are array indexes (i.e. 'data/0/temp').
+
+JsonPath compiles the path once into a sequence of keys and indexes.
+
+JsonExtractor gets the items of a set of paths from the JSON text
+with a partial parse: the document is scanned, only the values on the
+paths are decoded, the other ones are skipped without building them,
+and the scan stops as soon as all the items are found.
+Then large documents (i.e. forecasts) are never fully materialized.
+
+Usage: python jsonpath.py <json-file> <path> [<path>...]
+'''
+
+from __future__ import print_function
+
+import re
+import json
+from json.decoder import scanstring
+
+
+class JsonPath(object):
+
+    def __init__(self, path):
+        self.path = path
+        keys = path.split('/')
+        if len(path) == 0 or '' in keys:
+            raise ValueError("Invalid JSON path '%s'" % path)
+        self.keys = tuple(int(key) if key.isdigit() else key for key in keys)
+
+    def extract(self, json_value, depth=0):
+        '''Returns the item of the decoded JSON value,
+        skipping the first depth keys of the path.
+        A missing object key gives None, like dict.get;
+        going on past it raises an exception.
+        '''
+        for key in self.keys[depth:]:
+            if isinstance(key, int):
+                # Accessing array
+                json_value = json_value[key]
+            else:
+                json_value = json_value.get(key)
+        return json_value
+
+    def __repr__(self):
+        return 'JsonPath(%r)' % self.path
+
+
+_paths = {}
+
+
+def compileJsonPath(path):
+    '''Returns the compiled path, compiling it only the first time.'''
+    json_path = _paths.get(path)
+    if json_path is None:
+        json_path = JsonPath(path)
+        _paths[path] = json_path
+    return json_path
+
+
+_WS = re.compile(r'[ \t\n\r]*')
+# up to the next bracket out of strings
+_NEXT_BRACKET = re.compile(r'[^"\[\]{}]*(?:"(?:[^"\\]|\\.)*"[^"\[\]{}]*)*([\[\]{}])')
+_SCALAR_END = re.compile(r'[,\]}\s]|$')
+_decoder = json.JSONDecoder()
+
+# trie key of the paths ending at a node
+_ENDS = None
+
+
+class _AllFound(Exception):
+    pass
+
+
+def _ws(text, idx):
+    return _WS.match(text, idx).end()
+
+
+def _skip(text, idx):
+    '''Returns the index past the JSON value starting at idx'''
+    c = text[idx]
+    if c == '"':
+        return scanstring(text, idx + 1)[1]
+    if c not in '[{':
+        return _SCALAR_END.search(text, idx).start()
+    depth = 0
+    while True:
+        match = _NEXT_BRACKET.match(text, idx)
+        if match is None:
+            raise ValueError('Unterminated JSON value')
+        idx = match.end()
+        if match.group(1) in '[{':
+            depth = depth + 1
+        else:
+            depth = depth - 1
+            if depth == 0:
+                return idx
+
+
+class JsonExtractor(object):
+    '''Get the items of a set of paths from JSON text.'''
+
+    def __init__(self, paths):
+        self.paths = [compileJsonPath(path) for path in paths]
+        self.trie = {}
+        for json_path in self.paths:
+            node = self.trie
+            for key in json_path.keys:
+                node = node.setdefault(key, {})
+            node.setdefault(_ENDS, []).append(json_path)
+
+    @staticmethod
+    def _subtree_paths(node):
+        '''The paths ending at node or under it'''
+        paths = []
+        stack = [node]
+        while len(stack) > 0:
+            n = stack.pop()
+            for key, child in n.items():
+                if key is _ENDS:
+                    paths.extend(child)
+                else:
+                    stack.append(child)
+        return paths
+
+    def _walk(self, text, idx, node, depth, found):
+        '''Scan the value at idx following the trie node.
+        Returns the index past the value.
+        '''
+        if _ENDS in node:
+            # a path ends here: decode the whole value
+            value, end = _decoder.raw_decode(text, idx)
+            for json_path in self._subtree_paths(node):
+                try:
+                    found[json_path.path] = json_path.extract(value, depth)
+                except (LookupError, AttributeError, TypeError):
+                    # left to the full decode
+                    pass
+            if len(found) == len(self.paths):
+                raise _AllFound()
+            return end
+        c = text[idx]
+        if c == '{':
+            idx = _ws(text, idx + 1)
+            if text[idx] == '}':
+                return idx + 1
+            while True:
+                if text[idx] != '"':
+                    raise ValueError('Expecting property name at %d' % idx)
+                key, idx = scanstring(text, idx + 1)
+                idx = _ws(text, idx)
+                if text[idx] != ':':
+                    raise ValueError("Expecting ':' at %d" % idx)
+                idx = _ws(text, idx + 1)
+                child = node.get(key)
+                if child is None:
+                    idx = _skip(text, idx)
+                else:
+                    idx = self._walk(text, idx, child, depth + 1, found)
+                idx = _ws(text, idx)
+                if text[idx] == ',':
+                    idx = _ws(text, idx + 1)
+                elif text[idx] == '}':
+                    return idx + 1
+                else:
+                    raise ValueError("Expecting ',' or '}' at %d" % idx)
+        if c == '[':
+            idx = _ws(text, idx + 1)
+            if text[idx] == ']':
+                return idx + 1
+            index = 0
+            while True:
+                child = node.get(index)
+                if child is None:
+                    idx = _skip(text, idx)
+                else:
+                    idx = self._walk(text, idx, child, depth + 1, found)
+                index = index + 1
+                idx = _ws(text, idx)
+                if text[idx] == ',':
+                    idx = _ws(text, idx + 1)
+                elif text[idx] == ']':
+                    return idx + 1
+                else:
+                    raise ValueError("Expecting ',' or ']' at %d" % idx)
+        # scalar where a container was expected
+        return _skip(text, idx)
+
+    def extract(self, json_text, errors=None):
+        '''Returns the list of the items, in the same order of the paths.
+        An item missing in the document is extracted from the fully
+        decoded document, so that the result is the same of JsonPath.extract
+        (None or an exception).
+        If errors is a dict, the exception of a path is stored in it
+        by path string and the item is None, instead of raising.
+        Raises ValueError if the text is not valid JSON.
+        '''
+        if isinstance(json_text, bytes):
+            json_text = json_text.decode('utf-8')
+        found = {}
+        try:
+            self._walk(json_text, _ws(json_text, 0), self.trie, 0, found)
+        except _AllFound:
+            pass
+        except IndexError:
+            raise ValueError('Truncated JSON document')
+        if len(found) < len(self.paths):
+            json_value = json.loads(json_text)
+            for json_path in self.paths:
+                if json_path.path in found:
+                    continue
+                try:
+                    found[json_path.path] = json_path.extract(json_value)
+                except (LookupError, AttributeError, TypeError) as e:
+                    if errors is None:
+                        raise
+                    errors[json_path.path] = e
+                    found[json_path.path] = None
+        return [found[json_path.path] for json_path in self.paths]
+
+    def validate(self, sample_text):
+        '''Check the paths against a sample document.
+        Returns the list of the paths not found.
+        '''
+        missing = []
+        json_value = json.loads(sample_text)
+        for json_path in self.paths:
+            try:
+                if json_path.extract(json_value) is None:
+                    missing.append(json_path.path)
+            except (LookupError, AttributeError, TypeError):
+                missing.append(json_path.path)
+        return missing
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 3:
+        print('Usage: python jsonpath.py <json-file> <path> [<path>...]')
+        sys.exit(1)
+    with open(sys.argv[1]) as f:
+        text = f.read()
+    extractor = JsonExtractor(sys.argv[2:])
+    missing = extractor.validate(text)
+    for path, value in zip(sys.argv[2:], extractor.extract(text)):
+        print('%s: %r%s' % (path, value, ' (not found)' if path in missing else ''))
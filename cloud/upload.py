@@ -24,11 +24,16 @@
 
 
 import logging
-from os import remove, rmdir, walk, makedirs
+from os import listdir, remove, rmdir, walk, makedirs
 from os.path import dirname, join, realpath, split, isdir
+from random import uniform
+from time import sleep
 from utils.cli import cfg_file_arg
+from utils.threadingpool import fan_out
 from cloud.cloudcfg import ConfigDataLoad
-from cloud.dropboxsrv import dropbox_file_xfer
+from cloud.dropboxsrv import XFER_TRANSPORT, dropbox_file_xfer, set_xfer_transport
+from cloud.uploadmanifest import MANIFEST_FILES, UploadManifest
+from cloud.dedup import UploadDedup, dedup_settings, set_dedup
 
 
 # Globals
@@ -37,6 +42,11 @@ DEFAULT_CFG_FILE = 'cloudcfg.json'
 
 DEFAULT_CFG_FILE_PATH = join(dirname(realpath(__file__)), DEFAULT_CFG_FILE)
 
+# Transfers defaults, see xfer_settings()
+XFER_MAX_WORKERS = 4
+XFER_RETRIES = 3
+XFER_RETRY_DELAY = 2  # seconds, doubled at each retry
+
 USAGE = '''Upload the local datastore to a cloud service.
 
 Datastore directory structure:
@@ -60,48 +70,227 @@ Any other sub-directories and files are "volatile".
 If a member is "volatile", it will be removed after succesfull uploaded.
 Otherwise it will remain stored.
 
+Only new or changed members are uploaded: their state is recorded
+in the upload manifest %s in the datastore root.
+Members are uploaded concurrently, retrying the failed transfers.
+Volatile members duplicating a file already uploaded are removed
+without uploading them (see cloud.dedup).
+Files and directories beginning with '.' in the datastore root
+hold local state and are not uploaded.
+
 The datastore path is taken from a configuration file in JSON format.
 If none given, the configuration is read from the file:
     %s
-''' % DEFAULT_CFG_FILE_PATH
+''' % (MANIFEST_FILES[0], DEFAULT_CFG_FILE_PATH)
+
+
+def xfer_settings(cfg):
+    """Read the optional transfers settings from the configuration:
+        "optional-xfer": {
+            "max-workers": "<max_number_of_files_transferred_at_the_same_time>",
+            "retries": "<max_number_of_retries_of_a_failed_transfer>",
+            "retry-delay": "<seconds_before_the_first_retry>"
+        }
+    Missing or malformed values fall back to the defaults.
+
+    Returns max_workers, retries, retry_delay
+    """
+    settings = [
+        ('max-workers', XFER_MAX_WORKERS),
+        ('retries', XFER_RETRIES),
+        ('retry-delay', XFER_RETRY_DELAY)
+    ]
+    values = []
+    for key, default in settings:
+        try:
+            value = int(cfg.data['optional-xfer'][key])
+        except (KeyError, TypeError, ValueError):
+            value = default
+        values.append(value)
+    return tuple(values)
+
+
+def xfer_setup(cfg):
+    """Select the transport given by the configuration:
+        "optional-xfer": {
+            "transport": "<auto|shell|api|local>",
+            "local-dir": "<directory_standing_in_for_dropbox_if_local>"
+        }
+    and the deduplication settings (see cloud.dedup.dedup_settings),
+    then read the other transfers settings.
+
+    Returns max_workers, retries, retry_delay
+    """
+    try:
+        xfer_cfg = cfg.data['optional-xfer']
+        transport = xfer_cfg.get('transport', XFER_TRANSPORT)
+        if transport == 'local':
+            set_xfer_transport(transport, xfer_cfg['local-dir'])
+        elif transport != XFER_TRANSPORT:
+            set_xfer_transport(transport)
+    except (KeyError, TypeError, AttributeError):
+        pass
+    set_dedup(*dedup_settings(cfg))
+    return xfer_settings(cfg)
+
+
+def file_xfer(command, local_filepath, remote_filepath,
+                            retries=XFER_RETRIES, retry_delay=XFER_RETRY_DELAY,
+                            resume_state=None):
+    """Transfer a file, retrying with exponential backoff on failure.
+    A random jitter spreads the retries of concurrent transfers.
+    Chunked uploads resume from the last chunk sent (see resume_state).
+
+    Returns success
+    """
+    attempt = 0
+    while True:
+        if dropbox_file_xfer(command, local_filepath, remote_filepath,
+                                                    resume_state) is True:
+            return True
+        if attempt >= retries:
+            logging.error('%s %s failed after %d attempts' %
+                                    (command, local_filepath, attempt + 1))
+            return False
+        delay = retry_delay * (2 ** attempt)
+        attempt = attempt + 1
+        logging.info('%s %s: retry %d in %0.1fs' %
+                                    (command, local_filepath, attempt, delay))
+        sleep(uniform(delay / 2.0, delay))
 
 
-def upload_files(local_dirpath, filelist, remote_datastore_name, persistent):
-    local_remove = False
-    for filename in filelist:
+def upload_file(local_filepath, remote_filepath, persistent, manifest=None,
+                            retries=XFER_RETRIES, retry_delay=XFER_RETRY_DELAY):
+    """Upload a file, then remove it if volatile.
+    A volatile file is removed only after its own upload succeeded.
+
+    Returns success
+    """
+    if manifest is None or manifest.needs_upload(local_filepath):
+        resume_state = None
+        if manifest is not None:
+            resume_state = manifest.resume_state(local_filepath)
+        success = file_xfer('upload', local_filepath, remote_filepath,
+                                        retries, retry_delay, resume_state)
+        if success is True and manifest is not None:
+            manifest.mark_uploaded(local_filepath, remote_filepath)
+    else:
+        # uploaded by a previous run (i.e. interrupted before removing it)
+        logging.debug('%s unchanged, skip upload' % local_filepath)
+        success = True
+    if persistent is False and success is True:
+        logging.info('Remove %s' % local_filepath)
+        remove(local_filepath)
+        if manifest is not None:
+            manifest.forget(local_filepath)
+    return success
+
+
+def upload_jobs(local_dirpath, filelist, remote_datastore_name, persistent,
+                manifest=None, retries=XFER_RETRIES, retry_delay=XFER_RETRY_DELAY,
+                dedup=None):
+    """Returns the list of (local_filepath, job) uploading the files.
+    The volatile files duplicating an uploaded one are removed at once.
+    """
+    jobs = []
+    for filename in sorted(filelist):
+        if persistent is True and \
+                    (filename in MANIFEST_FILES or filename.startswith('.')):
+            # local state files (i.e. caches) are not uploaded
+            continue
         remote_dirpath = remote_datastore_name
         (_, tail) = split(local_dirpath)
         if tail != remote_datastore_name:
             remote_dirpath = join(remote_dirpath, tail)
         remote_filepath = join(remote_dirpath, filename)
         local_filepath = join(local_dirpath, filename)
-        local_remove = dropbox_file_xfer('upload', local_filepath, remote_filepath)
-        if persistent is False:
-            if local_remove is True:
-                logging.info('Remove %s' % local_filepath)
+        if persistent is False and dedup is not None:
+            original = dedup.duplicate_of(local_filepath, remote_filepath)
+            if original is not None:
+                logging.info('Remove %s, duplicate of %s' %
+                                                    (local_filepath, original))
                 remove(local_filepath)
+                manifest.forget(local_filepath)
+                continue
+        jobs.append((local_filepath,
+                     lambda l=local_filepath, r=remote_filepath:
+                        upload_file(l, r, persistent, manifest,
+                                                    retries, retry_delay)))
+    return jobs
 
 
-def upload_datastore(local_datastore_path_name):
-    persistent = True
-    (_, datastore_name) = split(local_datastore_path_name)
-    for (dirpath, dirnames, filenames) in \
+def run_xfer_jobs(jobs, max_workers):
+    """Run the (local_filepath, job) list concurrently.
+
+    Returns the number of failed transfers.
+    """
+    failures = 0
+    results = fan_out([job for _, job in jobs], max_workers, name='Xfer')
+    for (local_filepath, _), result in zip(jobs, results):
+        if result.error is not None:
+            logging.error('%s: %s: %s' % (local_filepath,
+                                type(result.error).__name__, result.error))
+        if not result.succeeded() or result.value is not True:
+            failures = failures + 1
+    return failures
+
+
+def upload_files(local_dirpath, filelist, remote_datastore_name, persistent,
+                    manifest=None, max_workers=XFER_MAX_WORKERS,
+                    retries=XFER_RETRIES, retry_delay=XFER_RETRY_DELAY):
+    jobs = upload_jobs(local_dirpath, filelist, remote_datastore_name,
+                                    persistent, manifest, retries, retry_delay)
+    return run_xfer_jobs(jobs, max_workers)
+
+
+def upload_datastore(local_datastore_path_name, max_workers=XFER_MAX_WORKERS,
+                            retries=XFER_RETRIES, retry_delay=XFER_RETRY_DELAY):
+    manifest = UploadManifest(local_datastore_path_name)
+    if manifest.acquire() is not True:
+        logging.info('Upload of %s already in progress' %
+                                                    local_datastore_path_name)
+        return 0
+    try:
+        persistent = True
+        (_, datastore_name) = split(local_datastore_path_name)
+        dedup = UploadDedup(manifest)
+        jobs = []
+        volatile_dirs = []
+        for (dirpath, dirnames, filenames) in \
                                 walk(local_datastore_path_name, topdown=True):
-        # The triple for a directory is generated before
-        # the triples for any of its subdirectories
-        # (directories are generated top-down).
-        if len(dirnames) == 0 and len(filenames) == 0:
-            # dirpath is empty.
+            # The triple for a directory is generated before
+            # the triples for any of its subdirectories
+            # (directories are generated top-down).
             if persistent is False:
+                volatile_dirs.append(dirpath)
+            else:
+                # local state directories (i.e. stores) are not uploaded
+                dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            jobs.extend(upload_jobs(dirpath, filenames, datastore_name,
+                            persistent, manifest, retries, retry_delay, dedup))
+            persistent = False
+        failures = run_xfer_jobs(jobs, max_workers)
+        # remove the volatile directories left empty, children first
+        for dirpath in reversed(volatile_dirs):
+            if len(listdir(dirpath)) == 0:
                 logging.info('remove directory %s' % dirpath)
                 rmdir(dirpath)
-        else:
-            upload_files(dirpath, filenames, datastore_name, persistent)
-        persistent = False
+        manifest.prune()
+        manifest.save()
+    finally:
+        manifest.release()
+    if failures > 0:
+        logging.error('%d of %d files not uploaded' % (failures, len(jobs)))
+        return 1
     return 0
 
 
-def download_datastore(local_datastore_path_name, filepath):
+def download_datastore(local_datastore_path_name, filepath,
+                    max_workers=XFER_MAX_WORKERS,
+                    retries=XFER_RETRIES, retry_delay=XFER_RETRY_DELAY):
+    """Download filepath, either a path name or a list of path names,
+    relative to the remote datastore.
+    """
     try: 
         makedirs(local_datastore_path_name)
     except OSError:
@@ -110,9 +299,16 @@ def download_datastore(local_datastore_path_name, filepath):
             logging.error('Unable to create %s directory' % local_datastore_path_name)
             return 1
     (_, datastore_name) = split(local_datastore_path_name)
-    local_filepath = join(local_datastore_path_name, filepath)
-    remote_filepath = join(datastore_name, filepath)
-    if dropbox_file_xfer('download', local_filepath, remote_filepath) is not True:
+    if not isinstance(filepath, (list, tuple)):
+        filepath = [filepath]
+    jobs = []
+    for remote_name in filepath:
+        local_filepath = join(local_datastore_path_name, remote_name)
+        remote_filepath = join(datastore_name, remote_name)
+        jobs.append((local_filepath,
+                     lambda l=local_filepath, r=remote_filepath:
+                        file_xfer('download', l, r, retries, retry_delay)))
+    if run_xfer_jobs(jobs, max_workers) > 0:
         return 1
     return 0
 
@@ -136,14 +332,16 @@ def cloud_download(cloud_cfg_file_path, remote_filename):
     cfg_data = get_config(cloud_cfg_file_path)
     if cfg_data == None:
         return 1
-    return download_datastore(cfg_data.data['datastore'], remote_filename)
+    return download_datastore(cfg_data.data['datastore'], remote_filename,
+                                                    *xfer_setup(cfg_data))
 
 
 def cloud_upload(cloud_cfg_file_path):
     cfg_data = get_config(cloud_cfg_file_path)
     if cfg_data == None:
         return 1
-    return upload_datastore(cfg_data.data['datastore'])
+    return upload_datastore(cfg_data.data['datastore'],
+                                                    *xfer_setup(cfg_data))
 
 
 def main():
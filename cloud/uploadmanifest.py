@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Corrado Ubezio
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+'''Upload manifest of a datastore.
+
+The manifest records for each file of the datastore:
+    size, mtime     from the last stat
+    sha256          content hash (hex digest)
+    remote          'uploaded' if the remote copy is up to date,
+                    'pending' otherwise
+It is persisted in the datastore root as MANIFEST_FILE_NAME
+and it is never uploaded.
+
+A file is transferred only if it is new or its content changed:
+when size or mtime differ from the manifest, the content hash is computed
+and compared with the recorded one, so that a file rewritten with the same
+content (i.e. boilerstatus.json) is not uploaded again.
+
+The manifest is saved (atomically replaced) after each transfer,
+then an interrupted upload resumes from the files still pending.
+The state of the chunked upload of a large file is saved in its entry
+after each chunk (see UploadResumeState), so that it resumes mid-file.
+
+The content hashes of the last REMOTE_INDEX_SIZE files uploaded
+are kept with their remote path, so that a file already uploaded
+under another name can be found (see dedup module).
+
+The upload holds an exclusive lock on LOCK_FILE_NAME,
+so that concurrent uploads of the same datastore
+(i.e. triggered by boilerctrl and pwrmonitor) don't overlap.
+'''
+
+
+import json
+import hashlib
+import logging
+from collections import OrderedDict
+from os import close, open as os_open, remove, rename, stat, \
+                                                O_CREAT, O_RDWR
+from os.path import join, relpath
+from threading import RLock
+from time import time
+
+try:
+    import fcntl
+except ImportError:
+    # not POSIX
+    fcntl = None
+
+
+MANIFEST_FILE_NAME = '.upload-manifest.json'
+LOCK_FILE_NAME = '.upload-manifest.lock'
+
+'''Files of the datastore root never uploaded.'''
+MANIFEST_FILES = (MANIFEST_FILE_NAME, LOCK_FILE_NAME,
+                  MANIFEST_FILE_NAME + '.tmp')
+
+HASH_BLOCK_SIZE = 64 * 1024
+
+'''Content hashes of uploaded files kept in the manifest.'''
+REMOTE_INDEX_SIZE = 500
+
+
+def file_sha256(file_path):
+    '''Returns the hex digest of the file content'''
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while True:
+            block = f.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class UploadResumeState(object):
+    '''The upload session state of a file, saved in the manifest.
+    The state is a dictionary defined by the transport.
+    '''
+
+    def __init__(self, manifest, key):
+        self.manifest = manifest
+        self.key = key
+
+    def load(self):
+        '''Returns the saved state, None if any'''
+        with self.manifest.lock:
+            entry = self.manifest.entries.get(self.key)
+            if entry is None or 'session' not in entry:
+                return None
+            return dict(entry['session'])
+
+    def save(self, state):
+        with self.manifest.lock:
+            entry = self.manifest.entries.get(self.key)
+            if entry is not None:
+                entry['session'] = dict(state)
+                self.manifest.save()
+
+    def clear(self):
+        with self.manifest.lock:
+            entry = self.manifest.entries.get(self.key)
+            if entry is not None and entry.pop('session', None) is not None:
+                self.manifest.save()
+
+
+class UploadManifest(object):
+    '''Track the upload state of the datastore files.
+
+    Files are identified by their path relative to the datastore root.
+    Methods are thread safe.
+    '''
+
+    def __init__(self, datastore_path):
+        self.datastore_path = datastore_path
+        self.manifest_file = join(datastore_path, MANIFEST_FILE_NAME)
+        self.lock = RLock()
+        self.entries = {}
+        self.remote_index = OrderedDict()  # sha256: remote path, oldest first
+        self.dedup_state = {}  # see dedup module
+        self._lock_fd = None
+        try:
+            with open(self.manifest_file) as f:
+                manifest = json.load(f)
+            self.entries = manifest['files']
+            self.remote_index = OrderedDict(manifest.get('remote-index', []))
+            self.dedup_state = manifest.get('dedup', {})
+        except (IOError, OSError):
+            # first upload
+            pass
+        except (ValueError, KeyError, TypeError):
+            logging.error('Corrupted upload manifest %s: upload all files' %
+                                                            self.manifest_file)
+
+    def acquire(self):
+        '''Lock the datastore against concurrent uploads.
+
+        Returns False if another upload is in progress.
+        '''
+        if fcntl is None:
+            return True
+        fd = os_open(join(self.datastore_path, LOCK_FILE_NAME), O_CREAT | O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    def release(self):
+        if self._lock_fd is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+            close(self._lock_fd)
+            self._lock_fd = None
+
+    def key(self, local_filepath):
+        return relpath(local_filepath, self.datastore_path)
+
+    def needs_upload(self, local_filepath):
+        '''Returns True if the file is new or changed since its last upload.
+
+        A changed file is recorded as pending with its new size, mtime
+        and content hash.
+        '''
+        key = self.key(local_filepath)
+        st = stat(local_filepath)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry['size'] == st.st_size and \
+                                            entry['mtime'] == st.st_mtime:
+                return entry['remote'] != 'uploaded'
+        # hash outside the lock: it reads the whole file
+        digest = file_sha256(local_filepath)
+        with self.lock:
+            if entry is not None and entry['sha256'] == digest and \
+                                            entry['remote'] == 'uploaded':
+                # same content, only touched
+                entry['size'] = st.st_size
+                entry['mtime'] = st.st_mtime
+                return False
+            self.entries[key] = {
+                'size': st.st_size,
+                'mtime': st.st_mtime,
+                'sha256': digest,
+                'remote': 'pending'
+            }
+        return True
+
+    def get(self, local_filepath):
+        with self.lock:
+            entry = self.entries.get(self.key(local_filepath))
+            return None if entry is None else dict(entry)
+
+    def resume_state(self, local_filepath):
+        return UploadResumeState(self, self.key(local_filepath))
+
+    def mark_uploaded(self, local_filepath, remote_filepath=None):
+        '''Record the successful upload and save the manifest.'''
+        with self.lock:
+            entry = self.entries.get(self.key(local_filepath))
+            if entry is not None:
+                entry['remote'] = 'uploaded'
+                entry['uploaded'] = time()
+                entry.pop('session', None)
+                if remote_filepath is not None:
+                    self.remote_index.pop(entry['sha256'], None)
+                    self.remote_index[entry['sha256']] = remote_filepath
+                    while len(self.remote_index) > REMOTE_INDEX_SIZE:
+                        self.remote_index.popitem(last=False)
+            self.save()
+
+    def remote_copy(self, digest):
+        '''Returns the remote path of an uploaded file
+        with the given content hash, None if unknown.
+        '''
+        with self.lock:
+            return self.remote_index.get(digest)
+
+    def forget(self, local_filepath):
+        '''Drop the file from the manifest (i.e. a volatile file removed).'''
+        with self.lock:
+            self.entries.pop(self.key(local_filepath), None)
+
+    def prune(self):
+        '''Drop the files no more in the datastore.'''
+        with self.lock:
+            for key in list(self.entries):
+                try:
+                    stat(join(self.datastore_path, key))
+                except OSError:
+                    del self.entries[key]
+
+    def save(self):
+        '''Write the manifest to a temporary file, then replace the old one,
+        so that an interrupted save doesn't corrupt it.
+        '''
+        with self.lock:
+            tmp_file = self.manifest_file + '.tmp'
+            try:
+                with open(tmp_file, 'w') as f:
+                    json.dump({'files': self.entries,
+                               'remote-index': list(self.remote_index.items()),
+                               'dedup': self.dedup_state}, f)
+                rename(tmp_file, self.manifest_file)
+            except (IOError, OSError) as e:
+                logging.error('Unable to save upload manifest: %s' % e)
+                try:
+                    remove(tmp_file)
+                except OSError:
+                    pass
@@ -26,9 +26,10 @@ from __future__ import print_function
 
 import logging
 import time
-import json
 import sys
 from os.path import dirname, join, realpath
+from utils.threadingpool import fan_out
+from cloud.jsonpath import JsonExtractor, compileJsonPath
 
 try:
     # For Python 3.0 and later
@@ -45,6 +46,12 @@ DEFAULT_CFG_FILE = 'cloudcfg.json'
 
 DEFAULT_CFG_FILE_PATH = join(dirname(realpath(__file__)), DEFAULT_CFG_FILE)
 
+# Weather services are queried concurrently:
+# each one must answer within WEATHER_SVC_TIMEOUT seconds
+# and all of them within WEATHER_SVCS_DEADLINE seconds.
+WEATHER_SVC_TIMEOUT = 10
+WEATHER_SVCS_DEADLINE = 20
+
 USAGE = '''Get the location current temperature in Celsius degrees.
 
 Data are logged in CSV format: datetime;city;temperature
@@ -64,69 +71,189 @@ def getJsonItemByPath(nested_json_value, path_to_field):
     path_to_field is a string consisting of individual keys separated by '/'.
     If the JSON object contains arrays, the key is its numeric index.
     """
-    for key in path_to_field.split("/"):
-        if key.isdigit():
-            # Accessing array
-            nested_json_value = nested_json_value[int(key)]
-        else:
-            nested_json_value = nested_json_value.get(key)
-    return nested_json_value
+    return compileJsonPath(path_to_field).extract(nested_json_value)
+
+
+class WeatherSvcApi(object):
+    """A weather service api of the configuration:
+    the JSON paths are compiled once and the answers
+    are parsed only up to the needed items (see jsonpath).
+    """
+
+    def __init__(self, svc_api):
+        self.name = svc_api['name']
+        self.request = svc_api['request']
+        self.key = svc_api['key']
+        self.temp_path = svc_api['path-to-temperature-value']
+        self.city_path = svc_api.get('optional-path-to-city-name')
+        paths = [self.temp_path]
+        if self.city_path is not None:
+            paths.append(self.city_path)
+        self.extractor = JsonExtractor(paths)
+        sample_file = svc_api.get('optional-sample-response')
+        if sample_file is not None:
+            self.validate(sample_file)
+
+    def validate(self, sample_file):
+        """Check the JSON paths against a sample answer of the service
+        saved in sample_file: the paths not found are reported.
+        Returns True if all the paths are found.
+        """
+        try:
+            with open(sample_file) as f:
+                missing = self.extractor.validate(f.read())
+        except (IOError, OSError, ValueError) as e:
+            print_error("%s: unable to read sample response;%s" % (self.name, e))
+            return False
+        for path in missing:
+            print_error("%s: path not found in sample response;%s" % (self.name, path))
+        return len(missing) == 0
+
+    def request_url(self, lat, lon):
+        return self.request.format(key=self.key, lat=lat, lon=lon)
+
+    def parse(self, json_string):
+        """Returns temperature and location name (None if the api
+        doesn't return it) from the service answer.
+        Raises an exception if the temperature is not found.
+        """
+        errors = {}
+        items = self.extractor.extract(json_string, errors)
+        if self.temp_path in errors:
+            raise errors[self.temp_path]
+        if self.city_path is None or self.city_path in errors:
+            return items[0], None
+        return items[0], items[1]
 
 
-def getLocationTempFromSvc(svc_api, search_lat, search_lon, search_name):
+_svc_apis = {}
+
+
+def compileSvcApi(svc_api):
+    """Returns the WeatherSvcApi of the configuration item svc_api,
+    compiling it only the first time.
+    """
+    key = tuple(svc_api.get(item) for item in ('name', 'request', 'key',
+                                'path-to-temperature-value',
+                                'optional-path-to-city-name'))
+    compiled = _svc_apis.get(key)
+    if compiled is None:
+        compiled = WeatherSvcApi(svc_api)
+        _svc_apis[key] = compiled
+    return compiled
+
+
+def getLocationTempFromSvc(svc_api, search_lat, search_lon, search_name,
+                                    timeout=WEATHER_SVC_TIMEOUT, cache=None):
     """Use a weather service api to get the current temperature
     by location coordinates latitude and longitude.
     'search_name' is used only if the api doesn't return the location name.
+    'timeout' is the max seconds waiting for the service to answer.
+    If 'cache' (a weathercache.WeatherCache) is given, a recent reading
+    is returned without querying the service.
 
     Returns tuple (location_name, temperature-celsius-degrees),
     otherwise an empty tuple if rised some errors.
     """
-    request_url = svc_api['request'].format( key=svc_api['key'],
-                                             lat=search_lat, lon=search_lon )
+    if cache is not None:
+        return cache.fetch(cache.key(svc_api['name'], search_lat, search_lon),
+                           lambda: getLocationTempFromSvc(svc_api, search_lat,
+                                        search_lon, search_name, timeout),
+                           timeout)
+    try:
+        api = compileSvcApi(svc_api)
+    except (KeyError, ValueError) as e:
+        print_error("%s: invalid api configuration;%s" % (svc_api.get('name'), e))
+        return ()
     try:
-        f = urlopen(request_url)
+        f = urlopen(api.request_url(search_lat, search_lon), timeout=timeout)
         json_string = f.read()
         f.close()
     except:
         # See: http://stackoverflow.com/a/4990739
-        print_error("%s: urllib2 error;%s" % (svc_api['name'], sys.exc_info()[0]))
+        print_error("%s: urllib2 error;%s" % (api.name, sys.exc_info()[0]))
         return ()
     try:
         # Parse the JSON object
-        json_obj = json.loads(json_string)
-        temp_c = getJsonItemByPath(json_obj, svc_api['path-to-temperature-value'])
+        temp_c, location_name = api.parse(json_string)
     except:
         # See: http://stackoverflow.com/a/4990739
         #print(json_string, file=sys.stderr)
-        print_error("%s: parse json error;%s" % (svc_api['name'], sys.exc_info()[0]))
+        print_error("%s: parse json error;%s" % (api.name, sys.exc_info()[0]))
         return ()
     try:
         f_temp_c = float(temp_c)
     except:
         # See: http://stackoverflow.com/a/4990739
-        print_error("%s: string convertion to float error;%s" % (svc_api['name'], sys.exc_info()[0]))
+        print_error("%s: string convertion to float error;%s" % (api.name, sys.exc_info()[0]))
         return ()
-    try:
-        location_name = getJsonItemByPath(json_obj, svc_api['optional-path-to-city-name'])
-    except:
+    if api.city_path is None or location_name is None:
         # API doesn't return the location name
         # then use the provided one
         location_name = search_name
     return (location_name, f_temp_c)
 
 
-def updateLogFromSvcs(weatherSvc):
+def weatherSvcTimeouts(weatherSvc):
+    """Read the optional timeouts from the weather services configuration:
+        "optional-svc-timeout": "<max_seconds_waiting_for_a_service>",
+        "optional-deadline": "<max_seconds_waiting_for_all_services>"
+    Missing or malformed values fall back to the defaults.
+
+    Returns svc_timeout, deadline
+    """
+    values = []
+    for key, default in (('optional-svc-timeout', WEATHER_SVC_TIMEOUT),
+                         ('optional-deadline', WEATHER_SVCS_DEADLINE)):
+        try:
+            value = float(weatherSvc[key])
+        except (KeyError, TypeError, ValueError):
+            value = default
+        values.append(value)
+    return tuple(values)
+
+
+def getLocationTempFromSvcs(weatherSvc, cache=None):
+    """Query all the weather services at the same time.
+    The services not answering before the deadline are given up.
+    See getLocationTempFromSvc about 'cache'.
+
+    Returns the list of (api, locationTemp) in the same order
+    of weatherSvc['api-list'], where locationTemp is
+    the getLocationTempFromSvc result (empty tuple on errors).
+    """
+    location_name = weatherSvc['location']['name']
+    latitude = weatherSvc['location']['lat']
+    longitude = weatherSvc['location']['lon']
+    svc_timeout, deadline = weatherSvcTimeouts(weatherSvc)
+    api_list = weatherSvc['api-list']
+    jobs = [lambda api=api: getLocationTempFromSvc(api, latitude, longitude,
+                                        location_name, svc_timeout, cache)
+            for api in api_list]
+    # the job timeout is a safety net: urlopen timeout is per socket operation
+    results = fan_out(jobs, 0, job_timeout=svc_timeout * 2,
+                                    cycle_timeout=deadline, name='WeatherSvc')
+    locationTemps = []
+    for api, result in zip(api_list, results):
+        if result.timed_out is True:
+            print_error("%s: no answer within the deadline" % api['name'])
+            locationTemps.append((api, ()))
+        elif result.error is not None:
+            print_error("%s: %s" % (api['name'], type(result.error).__name__))
+            locationTemps.append((api, ()))
+        else:
+            locationTemps.append((api, result.value))
+    return locationTemps
+
+
+def updateLogFromSvcs(weatherSvc, cache=None):
     """Updates location temperature log from a bunch of weather services.
     Log CSV format: datetime;api-name;city;temperature
     If getting the temperature fron a service doesn't succeed,
     then 'city' and 'temperature' fields are replaced by '-'.
     Return value is always 0
     """
-    location_name = weatherSvc['location']['name']
-    latitude = weatherSvc['location']['lat']
-    longitude = weatherSvc['location']['lon']
-    for api in weatherSvc['api-list']:
-        locationTemp = getLocationTempFromSvc(api, latitude, longitude, location_name)
+    for api, locationTemp in getLocationTempFromSvcs(weatherSvc, cache):
         if len(locationTemp) <= 0:
             # error
             logging.info("%s;-;-" % api['name'])
@@ -138,6 +265,7 @@ def updateLogFromSvcs(weatherSvc):
 def main():
     from utils.cli import cfg_file_arg
     from cloudcfg import ConfigDataLoad, checkDatastore
+    from weathercache import weatherCacheFromCfg
 
     options = cfg_file_arg(VERSION, USAGE, DEFAULT_CFG_FILE_PATH, VERSION_DATE)
     print('Read configuration from file: %s' % options.cfg_file)
@@ -163,7 +291,8 @@ def main():
     #                    cfg.data['wu-search-city'] )
 
     # NEW getLocationTemp from a bunch of weather services
-    status = updateLogFromSvcs( cfg.data['weather-svc'] )
+    cache = weatherCacheFromCfg(cfg.data['weather-svc'], cfg.data['datastore'])
+    status = updateLogFromSvcs( cfg.data['weather-svc'], cache )
     if status == 0:
         print('Temperature log in file: %s' % log_file)
     else:
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Corrado Ubezio
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''On disk cache of the weather services readings.
+
+The readings are shared by all the processes using the same datastore
+(i.e. boilerctrl and weather.py run by cron), keyed by
+(service name, latitude, longitude).
+
+A reading is:
+    fresh       if younger than ttl seconds:
+                it is returned without querying the service;
+    stale       if younger than stale seconds:
+                a background thread queries the service to refresh it,
+                waited for up to the service timeout; the stale reading
+                is returned only if the refresh fails or is late;
+    expired     otherwise: the service is queried.
+If the service fails, the last reading younger than max_age seconds
+is returned (last known good).
+
+The cache is a JSON file in the datastore (CACHE_FILE_NAME), updated under
+an exclusive lock (LOCK_FILE_NAME) and replaced atomically,
+so that concurrent processes never read a partial file.
+The files beginning with '.' in the datastore root are not uploaded.
+'''
+
+from __future__ import print_function
+
+import json
+import logging
+from os import close, open as os_open, remove, rename, O_CREAT, O_RDWR
+from os.path import join
+from threading import Event, Lock, Thread
+from time import time
+
+try:
+    import fcntl
+except ImportError:
+    # not POSIX
+    fcntl = None
+
+
+CACHE_FILE_NAME = '.weather-cache.json'
+LOCK_FILE_NAME = '.weather-cache.lock'
+
+WEATHER_CACHE_TTL = 10*60  # 10 minutes
+WEATHER_CACHE_STALE = 60*60  # 1 hour
+WEATHER_CACHE_MAX_AGE = 6*60*60  # 6 hours
+
+
+class FileLock(object):
+    '''Exclusive lock among processes (no-op if not POSIX)'''
+
+    def __init__(self, lock_file):
+        self.lock_file = lock_file
+        self.fd = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self.fd = os_open(self.lock_file, O_CREAT | O_RDWR)
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            close(self.fd)
+            self.fd = None
+
+
+class WeatherCache(object):
+
+    def __init__(self, datastore_path, ttl=WEATHER_CACHE_TTL,
+                    stale=WEATHER_CACHE_STALE, max_age=WEATHER_CACHE_MAX_AGE):
+        self.cache_file = join(datastore_path, CACHE_FILE_NAME)
+        self.lock_file = join(datastore_path, LOCK_FILE_NAME)
+        self.ttl = ttl
+        self.stale = max(stale, ttl)
+        self.max_age = max(max_age, self.stale)
+        self._revalidating = {}  # key: Event set when refreshed
+        self._lock = Lock()
+
+    @staticmethod
+    def key(svc_name, lat, lon):
+        return '%s;%s;%s' % (svc_name, lat, lon)
+
+    def _load(self):
+        try:
+            with open(self.cache_file) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def get(self, key):
+        '''Returns the cached entry {'time': seconds, 'value': [...]}, or None'''
+        # the file is replaced atomically, then it can be read without lock
+        return self._load().get(key)
+
+    def put(self, key, value):
+        with FileLock(self.lock_file):
+            entries = self._load()
+            now = time()
+            entries[key] = {'time': now, 'value': list(value)}
+            # drop the readings useless even as last known good
+            for old_key in list(entries):
+                if now - entries[old_key]['time'] > self.max_age:
+                    del entries[old_key]
+            tmp_file = self.cache_file + '.tmp'
+            try:
+                with open(tmp_file, 'w') as f:
+                    json.dump(entries, f)
+                rename(tmp_file, self.cache_file)
+            except (IOError, OSError) as e:
+                logging.error('Unable to update weather cache: %s' % e)
+                try:
+                    remove(tmp_file)
+                except OSError:
+                    pass
+
+    def _revalidate(self, key, fetch):
+        '''Refresh the entry in background, once at a time.
+        Returns the Event set when the refresh ends.
+        '''
+        with self._lock:
+            done = self._revalidating.get(key)
+            if done is not None:
+                return done
+            done = Event()
+            self._revalidating[key] = done
+
+        def refresh():
+            try:
+                value = fetch()
+                if len(value) > 0:
+                    self.put(key, value)
+            finally:
+                with self._lock:
+                    del self._revalidating[key]
+                done.set()
+
+        # not a daemon: a short-lived process waits for the refresh
+        # (bounded by the service timeout) before exiting
+        Thread(target=refresh, name='WeatherRefresh').start()
+        return done
+
+    def fetch(self, key, fetch, timeout=None):
+        '''Returns the cached value of key, calling fetch() to get it
+        if not fresh. fetch returns an empty tuple on errors.
+        A stale value is refreshed waiting up to timeout seconds
+        (the service timeout), then it is returned only if not refreshed.
+        '''
+        entry = self.get(key)
+        age = None
+        if entry is not None:
+            age = time() - entry['time']
+            if age < self.ttl:
+                return tuple(entry['value'])
+            if age < self.stale:
+                self._revalidate(key, fetch).wait(timeout)
+                refreshed = self.get(key)
+                if refreshed is not None and refreshed['time'] > entry['time']:
+                    return tuple(refreshed['value'])
+                logging.info('%s: stale reading of %d minutes ago' %
+                                                        (key, age // 60))
+                return tuple(entry['value'])
+        value = fetch()
+        if len(value) > 0:
+            self.put(key, value)
+            return value
+        if age is not None and age < self.max_age:
+            logging.info('%s: last known good reading of %d minutes ago' %
+                                                        (key, age // 60))
+            return tuple(entry['value'])
+        return value
+
+
+def weatherCacheFromCfg(weatherSvc, datastore_path):
+    """Returns the WeatherCache of the datastore, configured by:
+        "optional-cache-ttl": "<seconds_a_reading_is_fresh>",
+        "optional-cache-stale": "<seconds_a_reading_is_returned_if_not_refreshed_in_time>",
+        "optional-cache-max-age": "<seconds_a_reading_is_returned_on_errors>"
+    or None if the TTL is 0 (cache disabled).
+    """
+    values = []
+    for key, default in (('optional-cache-ttl', WEATHER_CACHE_TTL),
+                         ('optional-cache-stale', WEATHER_CACHE_STALE),
+                         ('optional-cache-max-age', WEATHER_CACHE_MAX_AGE)):
+        try:
+            value = int(weatherSvc[key])
+        except (KeyError, TypeError, ValueError):
+            value = default
+        values.append(value)
+    if values[0] <= 0:
+        return None
+    return WeatherCache(datastore_path, *values)
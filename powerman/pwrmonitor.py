@@ -36,7 +36,7 @@ from apiclient import errors
 from traceback import format_exc
 
 from powerman.upower import UPowerManager
-from cloud.upload import upload_datastore
+from cloud.upload import upload_datastore, xfer_setup
 from cloud.googleapis.gmailapi import gmSend
 from cloud.cloudcfg import ConfigDataLoad, checkDatastore
 
@@ -208,7 +208,7 @@ def main():
             psu_switch2battery = 1
             logging.debug('send alert')
             alert_send(receiver_address, 'AC power adapter has been unplugged.')
-            upload_datastore(cloud_cfg.data['datastore'])
+            upload_datastore(cloud_cfg.data['datastore'], *xfer_setup(cloud_cfg))
 
     return psu_switch2battery
 
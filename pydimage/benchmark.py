@@ -22,172 +22,297 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-'''Compare performance between PIL and OpenCV'''
+'''Benchmark the image pipeline of each backend (see imgbackend module)
+
+The pipeline is split in stages, each one timed separately:
+    decode          JPEG bytes to RGB array
+    decode-grey8    JPEG bytes to greyscale array reduced by 8
+                    (the dark image detection path)
+    greyscale       RGB array to greyscale array
+    histogram       greyscale array to pixel counts
+    encode          RGB array to JPEG bytes
+The JPEG images are read in memory before benchmarking,
+so file access is never timed.
+
+Each stage runs some warmup times, not recorded, then it is timed
+the given number of runs with the highest resolution clock available
+(perf_counter_ns from Python 3.7).
+The report shows min, mean, median (p50), p90, p99 and max time,
+and the peak of memory allocated during the stage as traced by tracemalloc
+(Python 3.4 and later; NumPy arrays are traced, the internal buffers
+of Pillow and OpenCV are not).
+
+Images are taken from a JPG file or directory (top listing only);
+if none is given, synthetic images are generated.
+
+The results can be saved in JSON format and compared with a previous one,
+in order to catch regressions between revisions:
+    python benchmark.py --json new.json --compare old.json
+
+Usage: python benchmark.py -h
+'''
 
 from __future__ import print_function
 
 import os
 import sys
-import cv2
-from PIL import Image
-from time import time
-from pilib import ExtendedImage as pilImage
-from cvlib import ExtendedImage as cvImage
+import json
+import platform
+from datetime import datetime
+from argparse import ArgumentParser
+import numpy as np
+from imgbackend import available_backends, get_backend
 
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2
+    tracemalloc = None
 
-class Benchmark(object):
+try:
+    from time import perf_counter_ns as clock_ns
+except ImportError:
+    try:
+        from time import perf_counter as _clock
+    except ImportError:
+        # Python 2
+        from timeit import default_timer as _clock
 
-    def __init__(self, bmClass):
-        self.imageClass = bmClass
-        self.runs = 0
-        self.deltat_min = sys.maxint
-        self.deltat_max = 0
-        self.elapsedt = 0
-
-    def run(self, src_image_file):
-        '''Compute the spent time
-        converting a color image to greyscale
-        and returning the pixel counts (histogram).
-        '''
-        self.runs = self.runs + 1
-        #img = self.imageClass(src_image_file).greyscale()
-        img = self.imageClass(src_image_file)
-        deltat = time()
-        img.greyscale()
-        pixel_counts = img.histogram()
-        deltat = time() - deltat
-        if self.deltat_min > deltat:
-            self.deltat_min = deltat
-        if self.deltat_max < deltat:
-            self.deltat_max = deltat
-        self.elapsedt = self.elapsedt + deltat
-
-    def report(self):
-        print('Read %d pictures in %f seconds' % (self.runs, self.elapsedt))
-        print('deltat min: %fs' % self.deltat_min)
-        print('deltat max: %fs' % self.deltat_max)
-        print('deltat average %fs:' % (self.elapsedt / self.runs))
-
-
-class Benchmark_PIL(object):
-
-    def __init__(self):
-        self.runs = 0
-        self.deltat_min = sys.maxint
-        self.deltat_max = 0
-        self.elapsedt = 0
-        self.width_ave = 0
-        self.height_ave = 0
-
-    def run(self, src_image_file):
-        '''Compute the spent time
-        converting a color image to greyscale
-        and returning the pixel counts (histogram).
-        '''
-        self.runs = self.runs + 1
-        img = Image.open(src_image_file)
-        width, height = img.size
-        self.width_ave = self.width_ave + width
-        self.height_ave = self.height_ave + height
-        deltat = time()
-        img = img.convert(mode='L')
-        pixel_counts = img.histogram()
-        deltat = time() - deltat
-        if self.deltat_min > deltat:
-            self.deltat_min = deltat
-        if self.deltat_max < deltat:
-            self.deltat_max = deltat
-        self.elapsedt = self.elapsedt + deltat
-
-    def report(self):
-        print('Read %d %dx%d pictures in %f seconds' %
-            (self.runs, (self.width_ave/self.runs), (self.height_ave/self.runs), self.elapsedt))
-        print('deltat min: %fs' % self.deltat_min)
-        print('deltat max: %fs' % self.deltat_max)
-        print('deltat average %fs:' % (self.elapsedt / self.runs))
-
-
-class Benchmark_OpenCV(object):
-
-    def __init__(self):
-        self.runs = 0
-        self.deltat_min = sys.maxint
-        self.deltat_max = 0
-        self.elapsedt = 0
-        self.width_ave = 0
-        self.height_ave = 0
-
-    def run(self, src_image_file):
-        '''Compute the spent time
-        converting a color image to greyscale
-        and returning the pixel counts (histogram).
-        '''
-        self.runs = self.runs + 1
-        #img = cv2.imread(src_image_file, cv2.IMREAD_GRAYSCALE)
-        img = cv2.imread(src_image_file)
-        height, width = img.shape[:2]
-        self.width_ave = self.width_ave + width
-        self.height_ave = self.height_ave + height
-        deltat = time()
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        pixel_counts = cv2.calcHist([img],[0],None,[256],[0,256])
-        deltat = time() - deltat
-        if self.deltat_min > deltat:
-            self.deltat_min = deltat
-        if self.deltat_max < deltat:
-            self.deltat_max = deltat
-        self.elapsedt = self.elapsedt + deltat
-
-    def report(self):
-        print('Read %d %dx%d pictures in %f seconds' %
-            (self.runs, (self.width_ave/self.runs), (self.height_ave/self.runs), self.elapsedt))
-        print('deltat min: %fs' % self.deltat_min)
-        print('deltat max: %fs' % self.deltat_max)
-        print('deltat average %fs:' % (self.elapsedt / self.runs))
+    def clock_ns():
+        return int(_clock() * 1e9)
 
 
-if __name__ == "__main__":
-    if len(sys.argv[1:]) > 0:
-        imagePathName = sys.argv[1]
-    else:
-        imagePathName = '.'
-    loop_cnt = 0
-    bmPIL = Benchmark(pilImage)
-    bmPIL_native = Benchmark_PIL()
-    bmCV = Benchmark(cvImage)
-    bmCV_native = Benchmark_OpenCV()
-    if os.path.isdir(imagePathName):
+STAGES = ['decode', 'decode-grey8', 'greyscale', 'histogram', 'encode']
+
+SYNTHETIC_SIZES = [(640, 480), (1920, 1080), (2592, 1944)]
+
+'''A stage is a regression if its median time grows more than this percent.'''
+REGRESSION_THRESHOLD = 10.0
+
+
+def percentile(sorted_values, percent):
+    '''Linear interpolation between the closest ranks'''
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    rank = (len(sorted_values) - 1) * percent / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    fraction = rank - lower
+    return sorted_values[lower] + \
+                    (sorted_values[upper] - sorted_values[lower]) * fraction
+
+
+def synthetic_image(width, height, seed=0):
+    '''RGB uint8 image: gradients, blocks and noise,
+    so that JPEG compression behaves like a camera picture.
+    '''
+    rng = np.random.RandomState(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)
+    img = np.empty((height, width, 3), dtype=np.float32)
+    img[..., 0] = x[np.newaxis, :]
+    img[..., 1] = y[:, np.newaxis]
+    img[..., 2] = (x[np.newaxis, :] + y[:, np.newaxis]) / 2
+    block = max(8, width // 16)
+    for _ in range(16):
+        bx = rng.randint(0, max(1, width - block))
+        by = rng.randint(0, max(1, height - block))
+        img[by:by+block, bx:bx+block] = rng.randint(0, 256, 3)
+    img = img + rng.normal(0, 12, img.shape)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+def load_images(image_path_name):
+    '''Returns a list of (name, JPEG bytes)'''
+    images = []
+    if image_path_name is None:
+        codec = get_backend()
+        for width, height in SYNTHETIC_SIZES:
+            jpeg = codec.encode(synthetic_image(width, height))
+            images.append(('synthetic-%dx%d' % (width, height), jpeg))
+    elif os.path.isdir(image_path_name):
         # iterate top directory listing
-        for dirname, dirnames, filenames in os.walk(imagePathName):
-            for imageFileName in filenames:
-                if imageFileName.lower().endswith('.jpg'):
-                    if (loop_cnt % 20) == 0:
-                        print('Running loop %d...' % (loop_cnt+1))
-                    loop_cnt = loop_cnt + 1
-                    bmPIL.run(os.path.join(dirname, imageFileName))
-                    bmPIL_native.run(os.path.join(dirname, imageFileName))
-                    bmCV.run(os.path.join(dirname, imageFileName))
-                    bmCV_native.run(os.path.join(dirname, imageFileName))
+        for dirname, dirnames, filenames in os.walk(image_path_name):
+            for image_file_name in sorted(filenames):
+                if image_file_name.lower().endswith('.jpg'):
+                    with open(os.path.join(dirname, image_file_name), 'rb') as f:
+                        images.append((image_file_name, f.read()))
             break  # only top directory listing
+    elif image_path_name.lower().endswith('.jpg'):
+        with open(image_path_name, 'rb') as f:
+            images.append((os.path.basename(image_path_name), f.read()))
+    return images
+
+
+class Benchmark(object):
+
+    def __init__(self, backend_name, runs, warmup):
+        self.backend = get_backend(backend_name)
+        self.runs = runs
+        self.warmup = warmup
+        self.samples = {}  # stage: list of nanoseconds
+        self.peak_bytes = {}  # stage: max bytes allocated
+
+    def stage_functions(self, jpeg):
+        '''Returns stage name and function, each one taking its input
+        from the previous stage output computed once.
+        '''
+        backend = self.backend
+        rgb = backend.decode(jpeg)
+        grey = backend.greyscale(rgb)
+        return [
+            ('decode', lambda: backend.decode(jpeg)),
+            ('decode-grey8', lambda: backend.decode(jpeg, grey=True, reduce=8)),
+            ('greyscale', lambda: backend.greyscale(rgb)),
+            ('histogram', lambda: backend.histogram(grey)),
+            ('encode', lambda: backend.encode(rgb))
+        ]
+
+    def run(self, jpeg):
+        '''Compute the time spent by each stage on the JPEG image.'''
+        for stage, function in self.stage_functions(jpeg):
+            for _ in range(self.warmup):
+                function()
+            samples = self.samples.setdefault(stage, [])
+            for _ in range(self.runs):
+                t_start = clock_ns()
+                function()
+                samples.append(clock_ns() - t_start)
+            if tracemalloc is not None:
+                # trace memory in a separate run, not to alter timings
+                tracemalloc.start()
+                function()
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                self.peak_bytes[stage] = max(peak,
+                                             self.peak_bytes.get(stage, 0))
+
+    def stats(self):
+        '''Returns the statistics of each stage as a dictionary'''
+        stats = {}
+        for stage in STAGES:
+            samples = sorted(self.samples.get(stage, []))
+            if len(samples) == 0:
+                continue
+            stats[stage] = {
+                'runs': len(samples),
+                'min_ns': samples[0],
+                'mean_ns': int(sum(samples) / len(samples)),
+                'p50_ns': int(percentile(samples, 50)),
+                'p90_ns': int(percentile(samples, 90)),
+                'p99_ns': int(percentile(samples, 99)),
+                'max_ns': samples[-1],
+                'peak_bytes': self.peak_bytes.get(stage)
+            }
+        return stats
+
+
+def report(results):
+    for image_name in sorted(results['images']):
+        print('\n%s:' % image_name)
+        print('%-8s %-13s %10s %10s %10s %10s %10s %10s' %
+              ('backend', 'stage', 'min ms', 'mean ms', 'p50 ms',
+               'p90 ms', 'p99 ms', 'peak KiB'))
+        backends = results['images'][image_name]
+        for backend_name in sorted(backends):
+            for stage in STAGES:
+                s = backends[backend_name].get(stage)
+                if s is None:
+                    continue
+                peak = '-' if s['peak_bytes'] is None \
+                                    else '%d' % (s['peak_bytes'] // 1024)
+                print('%-8s %-13s %10.3f %10.3f %10.3f %10.3f %10.3f %10s' %
+                      (backend_name, stage, s['min_ns'] / 1e6,
+                       s['mean_ns'] / 1e6, s['p50_ns'] / 1e6,
+                       s['p90_ns'] / 1e6, s['p99_ns'] / 1e6, peak))
+
+
+def compare(base_results, new_results, threshold=REGRESSION_THRESHOLD):
+    '''Print the median time change of each stage.
+    Returns the number of regressions.
+    '''
+    regressions = 0
+    print('\nCompare with %s results:' % base_results['meta']['date'])
+    for image_name in sorted(new_results['images']):
+        base_backends = base_results['images'].get(image_name, {})
+        for backend_name, stages in sorted(new_results['images'][image_name].items()):
+            for stage in STAGES:
+                new_stats = stages.get(stage)
+                base_stats = base_backends.get(backend_name, {}).get(stage)
+                if new_stats is None or base_stats is None:
+                    continue
+                change = 100.0 * (new_stats['p50_ns'] - base_stats['p50_ns']) \
+                                                    / max(base_stats['p50_ns'], 1)
+                flag = ''
+                if change > threshold:
+                    flag = 'REGRESSION'
+                    regressions = regressions + 1
+                print('%-24s %-8s %-13s %+7.1f%% %s' %
+                      (image_name, backend_name, stage, change, flag))
+    return regressions
+
+
+def main(argv):
+    parser = ArgumentParser(description='Benchmark the image backends.')
+    parser.add_argument('image_path', nargs='?', default=None,
+                        help='JPG file or directory; synthetic images if none')
+    parser.add_argument('-b', '--backends', default=None,
+                        help='comma separated backend names (default: all installed)')
+    parser.add_argument('-r', '--runs', type=int, default=20,
+                        help='timed runs of each stage (default 20)')
+    parser.add_argument('-w', '--warmup', type=int, default=3,
+                        help='untimed runs of each stage (default 3)')
+    parser.add_argument('-j', '--json', dest='json_file', default=None,
+                        help='save the results to JSON_FILE')
+    parser.add_argument('-c', '--compare', dest='base_file', default=None,
+                        help='compare the results with a previous JSON file')
+    parser.add_argument('-t', '--threshold', type=float,
+                        default=REGRESSION_THRESHOLD,
+                        help='regression threshold in percent (default %0.0f)'
+                                                    % REGRESSION_THRESHOLD)
+    args = parser.parse_args(argv[1:])
+
+    if args.backends is None:
+        backend_names = available_backends()
     else:
-        if imagePathName.lower().endswith('.jpg'):
-            # loop on single file
-            for loop_cnt in range(500):
-                if (loop_cnt % 10) == 0:
-                    print('Running loop %d...' % (loop_cnt+1))
-                bmPIL.run(imagePathName)
-                bmPIL_native.run(imagePathName)
-                bmCV.run(imagePathName)
-                bmCV_native.run(imagePathName)
-            loop_cnt = loop_cnt + 1
-        else:
-            print('JPG file required')
-    if loop_cnt > 0:
-        print('\nPIL stats:')
-        bmPIL.report()
-        print('\nOpenCV stats:')
-        bmCV.report()
-        print('\nPIL native stats:')
-        bmPIL_native.report()
-        print('\nOpenCV native stats:')
-        bmCV_native.report()
+        backend_names = args.backends.split(',')
+    images = load_images(args.image_path)
+    if len(images) == 0:
+        print('JPG file required')
+        return 1
+
+    results = {
+        'meta': {
+            'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'runs': args.runs,
+            'warmup': args.warmup,
+            'backends': dict((name, get_backend(name).version)
+                                            for name in backend_names)
+        },
+        'images': {}
+    }
+    for image_name, jpeg in images:
+        print('Running %s...' % image_name)
+        results['images'][image_name] = {}
+        for backend_name in backend_names:
+            benchmark = Benchmark(backend_name, args.runs, args.warmup)
+            benchmark.run(jpeg)
+            results['images'][image_name][backend_name] = benchmark.stats()
+    report(results)
+
+    if args.json_file is not None:
+        with open(args.json_file, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print('\nResults saved in %s' % args.json_file)
+    if args.base_file is not None:
+        with open(args.base_file) as f:
+            base_results = json.load(f)
+        if compare(base_results, results, args.threshold) > 0:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -32,17 +32,17 @@ http://www.bogotobogo.com/python/OpenCV_Python/python_opencv3_image_histogram_ca
 from __future__ import print_function
 
 import cv2
-from numpy import float32
 
 
 class ExtendedImage(object):
 
     def __init__(self, imageFileName):
         '''Opens and identifies the given image file.
-        OpenCV returns an uint8 image while matplotlib requires float32.
+        OpenCV returns an uint8 image, that matplotlib displays as is:
+        it is not promoted to float32 (4 times the memory).
         '''
         self.__VERSION__ = 'OpenCV ' + cv2.__version__
-        self._img = cv2.imread(imageFileName).astype(float32)
+        self._img = cv2.imread(imageFileName)
 
     def __getattr__(self, key):
         '''Delegate (almost) everything to self._img'''
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Corrado Ubezio
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Scan a directory tree (i.e. a datastore) for dark images
+
+The JPG images are shared among a pool of processes,
+each one counting the 'light' and 'dark' pixels of an image
+decoded in greyscale and reduced in size (see imgbackend.lightcounts).
+An image is dark if it has no more light pixels than dark ones,
+or than the given threshold.
+
+The results are written while available, one line for each image,
+in CSV (path;light;dark;dark-image) or JSON lines format.
+
+The light and dark counts of each image are cached in a JSON file
+keyed by path, modification time and size,
+so that a new scan processes only the images added or changed.
+
+The annotated greyscale copy (<image>_grey.jpg) of the former
+dark-image-detect.py is written only if requested.
+
+Usage: python darkscan.py -h
+'''
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+from argparse import ArgumentParser
+from multiprocessing import Pool, cpu_count
+from imgbackend import get_backend, lightcounts
+
+
+CACHE_FILE_NAME = '.darkscan-cache.json'
+CACHE_SAVE_INTERVAL = 500  # save the cache every number of new results
+REDUCE_DEFAULT = 8
+
+
+def list_images(top_dir):
+    '''Generates the path of JPG images under top_dir,
+    skipping the annotated copies.
+    '''
+    for dirname, dirnames, filenames in os.walk(top_dir):
+        dirnames.sort()
+        for image_file_name in sorted(filenames):
+            lower_name = image_file_name.lower()
+            if lower_name.endswith('.jpg') and \
+                                    not lower_name.endswith('_grey.jpg'):
+                yield os.path.join(dirname, image_file_name)
+
+
+def annotate_image(src_image_file, light_pixels, dark_pixels):
+    '''Save the greyscale copy of the image with the pixel counts
+    as <image>_grey.jpg
+    '''
+    from PIL import Image, ImageDraw
+
+    backend = get_backend()
+    gsimg = Image.fromarray(backend.decode(src_image_file, grey=True))
+    draw = ImageDraw.Draw(gsimg)
+    draw.text((1, 10), 'Dark pixels: %d' % dark_pixels, fill=255)
+    draw.text((1, 30), 'Light pixels: %d' % light_pixels, fill=255)
+    src_image_name, _ = os.path.splitext(src_image_file)
+    gsimg.save(src_image_name + '_grey.jpg')
+
+
+def scan_image(job):
+    '''Pool worker: count the light and dark pixels of an image.
+
+    Returns a result dictionary.
+    '''
+    image_path, size, mtime, reduce, backend, annotate = job
+    result = {'path': image_path, 'size': size, 'mtime': mtime}
+    try:
+        light_pixels, dark_pixels = lightcounts(image_path, reduce, backend)
+        result['light'] = int(light_pixels)
+        result['dark'] = int(dark_pixels)
+        if annotate is True:
+            annotate_image(image_path, light_pixels, dark_pixels)
+    except Exception as e:
+        result['error'] = '%s: %s' % (type(e).__name__, e)
+    return result
+
+
+class ScanCache(object):
+    '''Pixel counts of the images already scanned.'''
+
+    def __init__(self, cache_file):
+        '''cache_file None disables the cache (see --no-cache).'''
+        self.cache_file = cache_file
+        self.entries = {}
+        self.changes = 0
+        if cache_file is None:
+            return
+        try:
+            with open(cache_file) as f:
+                self.entries = json.load(f)
+        except (IOError, OSError, ValueError):
+            pass
+
+    def get(self, image_path, size, mtime):
+        '''Returns the cached result if the image didn't change,
+        None otherwise.
+        '''
+        entry = self.entries.get(image_path)
+        if entry is None or entry['size'] != size or entry['mtime'] != mtime:
+            return None
+        result = dict(entry)
+        result['path'] = image_path
+        return result
+
+    def put(self, result):
+        if 'error' in result:
+            return
+        entry = dict(result)
+        del entry['path']
+        self.entries[result['path']] = entry
+        self.changes = self.changes + 1
+        if self.changes % CACHE_SAVE_INTERVAL == 0:
+            self.save()
+
+    def save(self):
+        '''Write the cache to a temporary file, then replace the old one,
+        so that an interrupted save doesn't corrupt it.
+        '''
+        if self.cache_file is None:
+            return
+        tmp_file = self.cache_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.entries, f)
+        os.rename(tmp_file, self.cache_file)
+
+
+class ResultWriter(object):
+    '''Write each result as soon as it is available.'''
+
+    def __init__(self, out, out_format, threshold):
+        self.out = out
+        self.out_format = out_format
+        self.threshold = threshold
+        if out_format == 'csv':
+            self.out.write('path;light;dark;dark-image\n')
+
+    def is_dark(self, result):
+        threshold = self.threshold
+        if threshold is None:
+            threshold = result['dark']
+        return result['light'] <= threshold
+
+    def write(self, result):
+        if 'error' in result:
+            print('%s: %s' % (result['path'], result['error']), file=sys.stderr)
+            return
+        dark_image = self.is_dark(result)
+        if self.out_format == 'csv':
+            self.out.write('%s;%d;%d;%d\n' % (result['path'], result['light'],
+                                              result['dark'], dark_image))
+        else:
+            self.out.write(json.dumps({'path': result['path'],
+                                       'light': result['light'],
+                                       'dark': result['dark'],
+                                       'dark-image': dark_image}) + '\n')
+        self.out.flush()
+
+
+def darkscan(top_dir, writer, workers=None, reduce=REDUCE_DEFAULT,
+                        backend=None, annotate=False, cache_file=None):
+    '''Scan the images under top_dir writing the results.
+
+    Returns the number of images scanned and of those found in cache.
+    '''
+    cache = ScanCache(cache_file)
+    jobs = []
+    ncached = 0
+    for image_path in list_images(top_dir):
+        stat = os.stat(image_path)
+        result = cache.get(image_path, stat.st_size, stat.st_mtime)
+        if result is not None and annotate is not True:
+            writer.write(result)
+            ncached = ncached + 1
+            continue
+        jobs.append((image_path, stat.st_size, stat.st_mtime,
+                                                reduce, backend, annotate))
+    if len(jobs) > 0:
+        if workers is None:
+            workers = cpu_count()
+        pool = Pool(processes=workers)
+        try:
+            for result in pool.imap_unordered(scan_image, jobs, chunksize=16):
+                writer.write(result)
+                cache.put(result)
+            pool.close()
+        except KeyboardInterrupt:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            # keep what has been scanned, even if interrupted
+            cache.save()
+    return len(jobs), ncached
+
+
+def main(argv):
+    parser = ArgumentParser(description='Scan a directory tree for dark images.')
+    parser.add_argument('top_dir', help='directory to scan (i.e. the datastore)')
+    parser.add_argument('-f', '--format', dest='out_format', default='csv',
+                        choices=['csv', 'json'], help='output format (default csv)')
+    parser.add_argument('-o', '--output', default=None,
+                        help='output file (default stdout)')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='number of processes (default: number of CPUs)')
+    parser.add_argument('-t', '--threshold', type=int, default=None,
+                        help='dark if light pixels are no more than THRESHOLD '
+                             '(default: dark pixels)')
+    parser.add_argument('-r', '--reduce', type=int, default=REDUCE_DEFAULT,
+                        choices=[1, 2, 4, 8],
+                        help='decode images reduced by REDUCE (default %d)'
+                                                            % REDUCE_DEFAULT)
+    parser.add_argument('-b', '--backend', default=None,
+                        help='image backend (default: the fastest installed)')
+    parser.add_argument('-a', '--annotate', action='store_true',
+                        help='save the annotated greyscale copy of each image')
+    parser.add_argument('-c', '--cache', default=None,
+                        help='cache file (default: TOP_DIR/%s)' % CACHE_FILE_NAME)
+    parser.add_argument('--no-cache', action='store_true',
+                        help='scan all the images')
+    args = parser.parse_args(argv[1:])
+
+    cache_file = args.cache
+    if args.no_cache is True:
+        cache_file = None
+    elif cache_file is None:
+        cache_file = os.path.join(args.top_dir, CACHE_FILE_NAME)
+
+    out = sys.stdout if args.output is None else open(args.output, 'w')
+    try:
+        writer = ResultWriter(out, args.out_format, args.threshold)
+        nscanned, ncached = darkscan(args.top_dir, writer, args.workers,
+                                     args.reduce, args.backend, args.annotate,
+                                     cache_file)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print('Scanned %d images, %d from cache' % (nscanned, ncached),
+                                                            file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
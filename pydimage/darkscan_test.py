@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""Command-line test of darkscan.py scanning without cache (--no-cache)
+
+A dark and a light image are written in a temporary directory,
+then scanned: both must be reported and no cache file must be written.
+"""
+
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+import traceback
+from sys import exit, version_info
+
+from PIL import Image
+
+from darkscan import main as darkscan_main, ScanCache, CACHE_FILE_NAME
+
+
+def darkscan_test():
+    """Returns True if the scan without cache succeeds."""
+    top_dir = tempfile.mkdtemp(prefix='darkscan_test')
+    try:
+        Image.new('L', (64, 48), 10).save(os.path.join(top_dir, 'dark.jpg'))
+        Image.new('L', (64, 48), 240).save(os.path.join(top_dir, 'light.jpg'))
+        out_file = os.path.join(top_dir, 'out.csv')
+
+        # a disabled cache neither loads nor saves
+        cache = ScanCache(None)
+        cache.put({'path': 'x.jpg', 'size': 1, 'mtime': 1,
+                   'light': 1, 'dark': 1})
+        cache.save()
+
+        darkscan_main(['darkscan.py', top_dir, '--no-cache', '-w', '1',
+                                                        '-o', out_file])
+        with open(out_file) as f:
+            lines = sorted(f.read().splitlines()[1:])
+        dark_images = [line.rsplit(';', 1)[1] for line in lines]
+        if dark_images != ['1', '0']:
+            print('FAILED: unexpected results %s' % lines)
+            return False
+        if os.path.exists(os.path.join(top_dir, CACHE_FILE_NAME)):
+            print('FAILED: cache file written with --no-cache')
+            return False
+    except Exception:
+        print('FAILED: %s' % traceback.format_exc())
+        return False
+    finally:
+        shutil.rmtree(top_dir)
+    print('SUCCEEDED')
+    return True
+
+
+def main():
+    print('Python {}.{}.{}'.format(version_info.major, version_info.minor,
+                                    version_info.micro))
+    print('Scan a temporary directory without cache')
+    if darkscan_test() is not True:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
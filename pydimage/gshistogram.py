@@ -32,20 +32,18 @@ from __future__ import print_function
 
 import os
 import sys
-import numpy as np
 import matplotlib.pyplot as plt
-from pilib import ExtendedImage as pilImage
-from cvlib import ExtendedImage as cvImage
+from imgbackend import available_backends, get_backend
 
 
-def imageHist(ax_row, img_raw):
+def imageHist(ax_row, backend, src_image_file):
     '''Drow picture and histograms in a subplots row'''
-    img = np.array(img_raw)
+    img = backend.greyscale(backend.decode(src_image_file))
 
     # plot the picture
     ax_row[0].imshow(img, cmap=plt.get_cmap('gray'))
     ax_row[0].axis('off')  # clear x- and y-axes
-    ax_row[0].set_title(img_raw.__VERSION__)
+    ax_row[0].set_title(backend.version)
 
     # plot matplotlib histogram
     ax_row[1].hist(img.flatten(),128)
@@ -53,13 +51,13 @@ def imageHist(ax_row, img_raw):
     # Get the pixel counts, one for each pixel value in the source image.
     # Since the source image has one only band (greyscale),
     # there are 256 pixel counts, that is an index for each shade of grey.
-    pixel_counts = img_raw.histogram()
+    pixel_counts = backend.histogram(img)
 
     # In a greyscale representation, the first 128 values are 'dark' pixels,
     # the last 128 are 'light' ones.
     indexes = len(pixel_counts)  # should be 256 (an index for each shade of grey)
-    dark_pixels = sum(pixel_counts[:indexes/2])
-    light_pixels = sum(pixel_counts[indexes/2:])
+    dark_pixels = sum(pixel_counts[:indexes//2])
+    light_pixels = sum(pixel_counts[indexes//2:])
 
     # plot the histogram outline curve
     # text in axis coords (0,0 is lower-left and 1,1 is upper-right)
@@ -73,21 +71,23 @@ def imageHist(ax_row, img_raw):
 
 
 def gshistogram(src_image_file, interactive=False):
-    '''Convert image to greyscale both PIL and OpenCV
-     and save with histograms as PNG.
+    '''Convert image to greyscale with each installed backend
+     (see imgbackend module) and save with histograms as PNG.
 
     WARNING: At present matplotlib.pyplot.savefig() returns the error
     "TypeError: integer argument expected, got float"
     when saving as JPG.
     '''
-    # Creates a figure with 2 rows of 3 subplots:
+    # Creates a figure with a row of 3 subplots for each backend:
     #   picture, histogram and histogram outline curve.
-    fig, axes = plt.subplots(2, 3, figsize=(11, 7))
+    backends = available_backends()
+    fig, axes = plt.subplots(len(backends), 3, figsize=(11, 3.5*len(backends)),
+                             squeeze=False)
 
     # read source image to array and Drow picture and histograms
     # in the respective subplots row
-    imageHist(axes[0], pilImage(src_image_file).greyscale())
-    imageHist(axes[1], cvImage(src_image_file).greyscale())
+    for ax_row, backend_name in zip(axes, backends):
+        imageHist(ax_row, get_backend(backend_name), src_image_file)
 
     if interactive is True:
         plt.show()
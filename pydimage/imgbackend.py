@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Corrado Ubezio
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Image processing backends sharing a common interface
+
+Each backend wraps an imaging library (Pillow, OpenCV or NumPy only)
+and provides the same functions:
+    decode(source, grey=False, reduce=1)
+        source is a file name or a bytes-like object (i.e. a JPEG bytearray);
+        returns the image as an uint8 NumPy array:
+        height x width for greyscale, height x width x 3 for RGB color.
+        If reduce is 2, 4 or 8, the image is decoded reduced by that factor;
+        JPEG images are scaled while decoding (DCT scaling).
+    greyscale(img)
+        returns the uint8 greyscale image.
+    histogram(img)
+        returns the pixel counts of the greyscale image as a list,
+        that is an index for each shade of grey (256 counts).
+    encode(img, ext='.jpg')
+        returns the image compressed in the format given by ext as bytes.
+
+The images are never promoted to float (the former cvlib.ExtendedImage
+converted them to float32, 4 times the memory of uint8).
+
+The backends are registered by name.
+At import, DEFAULT_BACKEND is set to the fastest one installed
+according to BACKEND_PREFERENCE (see README.md for the comparison
+between PIL and OpenCV).
+'''
+
+from __future__ import print_function
+
+from io import BytesIO
+import numpy as np
+
+
+'''Names of the backends, from the fastest to the slowest.'''
+BACKEND_PREFERENCE = ['opencv', 'pil', 'numpy']
+
+
+def _is_buffer(source):
+    return isinstance(source, (bytes, bytearray, memoryview))
+
+
+class PILBackend(object):
+    '''Python Imaging Library (Pillow)'''
+    name = 'pil'
+
+    def __init__(self):
+        from PIL import Image
+        self.Image = Image
+        self.version = 'PIL ' + getattr(Image, '__version__',
+                                        getattr(Image, 'VERSION', ''))
+
+    def decode(self, source, grey=False, reduce=1):
+        if _is_buffer(source):
+            source = BytesIO(source)
+        img = self.Image.open(source)
+        mode = 'L' if grey else 'RGB'
+        width, height = img.size
+        size = (max(1, width // reduce), max(1, height // reduce))
+        # JPEG only: decode the luminance only and/or reduced in size
+        img.draft(mode, size)
+        if img.mode != mode:
+            img = img.convert(mode=mode)
+        if img.size[0] > size[0]:
+            # draft is not supported by the image format
+            img = img.resize(size, self.Image.NEAREST)
+        return np.asarray(img)
+
+    def greyscale(self, img):
+        if img.ndim == 2:
+            return img
+        return np.asarray(self.Image.fromarray(img).convert(mode='L'))
+
+    def histogram(self, img):
+        return self.Image.fromarray(self.greyscale(img)).histogram()
+
+    def encode(self, img, ext='.jpg'):
+        image_format = ext.lstrip('.').upper()
+        if image_format == 'JPG':
+            image_format = 'JPEG'
+        data = BytesIO()
+        self.Image.fromarray(img).save(data, format=image_format)
+        return data.getvalue()
+
+
+class OpenCVBackend(object):
+    '''OpenCV (CV2)'''
+    name = 'opencv'
+
+    def __init__(self):
+        import cv2
+        self.cv2 = cv2
+        self.version = 'OpenCV ' + cv2.__version__
+
+    def decode(self, source, grey=False, reduce=1):
+        cv2 = self.cv2
+        if grey:
+            flags = getattr(cv2, 'IMREAD_REDUCED_GRAYSCALE_%d' % reduce,
+                            cv2.IMREAD_GRAYSCALE)
+        else:
+            flags = getattr(cv2, 'IMREAD_REDUCED_COLOR_%d' % reduce,
+                            cv2.IMREAD_COLOR)
+        if _is_buffer(source):
+            img = cv2.imdecode(np.frombuffer(source, dtype=np.uint8), flags)
+        else:
+            img = cv2.imread(source, flags)
+        if img is None:
+            raise IOError('OpenCV: unable to decode the image')
+        if reduce > 1 and flags in (cv2.IMREAD_GRAYSCALE, cv2.IMREAD_COLOR):
+            # OpenCV 2 doesn't support reduced decoding
+            img = cv2.resize(img, None, fx=1.0/reduce, fy=1.0/reduce,
+                             interpolation=cv2.INTER_NEAREST)
+        if not grey:
+            # OpenCV decodes colors as BGR
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        return img
+
+    def greyscale(self, img):
+        if img.ndim == 2:
+            return img
+        return self.cv2.cvtColor(img, self.cv2.COLOR_RGB2GRAY)
+
+    def histogram(self, img):
+        hist = self.cv2.calcHist([self.greyscale(img)], [0], None,
+                                                    [256], [0, 256])
+        return hist.ravel().astype(np.int64).tolist()
+
+    def encode(self, img, ext='.jpg'):
+        if img.ndim == 3:
+            img = self.cv2.cvtColor(img, self.cv2.COLOR_RGB2BGR)
+        retVal, data = self.cv2.imencode(ext, img)
+        if not retVal:
+            raise IOError('OpenCV: unable to encode the image')
+        return data.tobytes()
+
+
+class NumPyBackend(object):
+    '''Pure NumPy image processing.
+    Decoding and encoding compressed images require a codec,
+    then they are delegated to Pillow or OpenCV, whichever is installed.
+    '''
+    name = 'numpy'
+
+    def __init__(self):
+        self.codec = None
+        for backend_class in (PILBackend, OpenCVBackend):
+            try:
+                self.codec = backend_class()
+                break
+            except ImportError:
+                pass
+        if self.codec is None:
+            raise ImportError('NumPy backend requires Pillow or OpenCV codecs')
+        self.version = 'NumPy %s (%s codec)' % (np.__version__,
+                                                self.codec.version)
+
+    def decode(self, source, grey=False, reduce=1):
+        img = self.codec.decode(source, grey=False, reduce=reduce)
+        if grey:
+            img = self.greyscale(img)
+        return img
+
+    def greyscale(self, img):
+        '''ITU-R 601-2 luma transform with 16 bits fixed point integers,
+        the same of Pillow.
+        '''
+        if img.ndim == 2:
+            return img
+        rgb = img.astype(np.uint32)
+        grey = rgb[..., 0] * 19595 + rgb[..., 1] * 38470 + \
+                                            rgb[..., 2] * 7471 + 0x8000
+        return (grey >> 16).astype(np.uint8)
+
+    def histogram(self, img):
+        grey = self.greyscale(img)
+        return np.bincount(grey.ravel(), minlength=256).tolist()
+
+    def encode(self, img, ext='.jpg'):
+        return self.codec.encode(img, ext)
+
+
+'''Registered backends classes by name'''
+BACKEND_CLASSES = {}
+
+_backends = {}  # backend instances, created on demand
+
+
+def register_backend(backend_class):
+    '''Add a backend class to the registry.'''
+    BACKEND_CLASSES[backend_class.name] = backend_class
+    return backend_class
+
+
+for _backend_class in (PILBackend, OpenCVBackend, NumPyBackend):
+    register_backend(_backend_class)
+
+
+def get_backend(name=None):
+    '''Returns the instance of the named backend,
+    DEFAULT_BACKEND if name is None.
+    Raises ImportError if the library of the backend is not installed.
+    '''
+    if name is None:
+        name = DEFAULT_BACKEND
+        if name is None:
+            raise ImportError('No image processing library installed')
+    backend = _backends.get(name)
+    if backend is None:
+        try:
+            backend_class = BACKEND_CLASSES[name]
+        except KeyError:
+            raise ValueError('Unknown image backend %s' % name)
+        backend = backend_class()
+        _backends[name] = backend
+    return backend
+
+
+def available_backends():
+    '''Returns the names of the installed backends,
+    from the fastest to the slowest.
+    '''
+    names = []
+    for name in BACKEND_PREFERENCE + sorted(BACKEND_CLASSES):
+        if name in names or name not in BACKEND_CLASSES:
+            continue
+        try:
+            get_backend(name)
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def lightcounts(source, reduce=1, backend=None):
+    '''Decode the image in greyscale, optionally reduced,
+    and count its 'dark' (first 128 values) and 'light' (last 128) pixels.
+    The pixels are counted on the decoded array, without histogram.
+    The counts are scaled up to the full size image.
+
+    Returns light_pixels, dark_pixels
+    '''
+    backend = get_backend(backend)
+    grey = backend.decode(source, grey=True, reduce=reduce)
+    light_pixels = int(np.count_nonzero(grey >= 128))
+    dark_pixels = grey.size - light_pixels
+    full_scale = reduce * reduce
+    return light_pixels * full_scale, dark_pixels * full_scale
+
+
+def set_default_backend(name):
+    '''Select the backend returned by get_backend() by default.'''
+    global DEFAULT_BACKEND
+    get_backend(name)
+    DEFAULT_BACKEND = name
+
+
+DEFAULT_BACKEND = None
+_available = available_backends()
+if len(_available) > 0:
+    DEFAULT_BACKEND = _available[0]
+
+
+if __name__ == "__main__":
+    print('Installed image backends (fastest first):')
+    for backend_name in available_backends():
+        print('  %s: %s' % (backend_name, get_backend(backend_name).version))
+    print('Default: %s' % DEFAULT_BACKEND)
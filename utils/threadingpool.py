@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2016 Corrado Ubezio
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Fan out a bunch of jobs on a bounded set of threads
+
+Each job is a callable without arguments.
+The jobs are run concurrently by at most max_workers threads
+and the caller waits until all of them have finished or:
+- a job has been running for more than job_timeout seconds, or
+- cycle_timeout seconds have passed since the fan out started.
+
+A thread cannot be killed, then a job that exceeds its deadline
+is abandoned: its result is discarded and a new worker thread
+takes its place, so that the remaining jobs are not held back.
+Worker threads are daemons, so an abandoned job doesn't prevent
+the process from exiting. A job with side effects (i.e. writing a file)
+should be given its own deadline, so that it discards its late result.
+
+The deadlines are measured by a monotonic clock (Python 3),
+not affected by the system clock updates (i.e. NTP).
+
+Works both with Python 2 and Python 3.
+'''
+
+from __future__ import print_function
+from threading import Condition, Thread
+
+try:
+    # For Python 3.3 and later
+    from time import monotonic
+except ImportError:
+    # Fall back to Python 2: wall clock
+    from time import time as monotonic
+
+
+class JobResult(object):
+    '''The outcome of a job.
+
+    finished    the job returned (value) or raised an exception (error)
+    timed_out   the job didn't finish before its deadline
+    elapsed     seconds spent running the job
+    '''
+    def __init__(self):
+        self.started = None
+        self.finished = False
+        self.timed_out = False
+        self.value = None
+        self.error = None
+        self.elapsed = 0.0
+
+    def resolved(self):
+        return self.finished or self.timed_out
+
+    def succeeded(self):
+        return self.finished and self.error is None
+
+
+def fan_out(jobs, max_workers, job_timeout=None, cycle_timeout=None,
+                                                    name='FanOut'):
+    '''Run the list of jobs with at most max_workers threads.
+    Timeouts are in seconds, None means wait forever.
+
+    Returns the list of JobResult, in the same order of jobs.
+    '''
+    results = [JobResult() for _ in jobs]
+    pending = list(range(len(jobs)))
+    cond = Condition()
+    state = {'stopped': False, 'workers': 0}
+
+    def worker():
+        while True:
+            with cond:
+                if state['stopped'] is True or len(pending) == 0:
+                    return
+                idx = pending.pop(0)
+                results[idx].started = monotonic()
+            value = None
+            error = None
+            try:
+                value = jobs[idx]()
+            except Exception as e:
+                error = e
+            with cond:
+                job = results[idx]
+                if job.timed_out is True:
+                    # the job has been abandoned:
+                    # a new worker has already taken its place
+                    return
+                job.value = value
+                job.error = error
+                job.elapsed = monotonic() - job.started
+                job.finished = True
+                cond.notify_all()
+
+    def start_worker():
+        state['workers'] = state['workers'] + 1
+        t = Thread(target=worker,
+                   name='%s-%d' % (name, state['workers']))
+        t.daemon = True
+        t.start()
+
+    if len(jobs) == 0:
+        return results
+    if max_workers is None or max_workers < 1:
+        max_workers = len(jobs)
+
+    t_start = monotonic()
+    with cond:
+        for _ in range(min(max_workers, len(jobs))):
+            start_worker()
+        while True:
+            now = monotonic()
+            unresolved = [job for job in results if not job.resolved()]
+            if len(unresolved) == 0:
+                break
+            if cycle_timeout is not None and now - t_start >= cycle_timeout:
+                # give up: abandon running jobs and skip the pending ones
+                state['stopped'] = True
+                for job in unresolved:
+                    job.timed_out = True
+                    if job.started is not None:
+                        job.elapsed = now - job.started
+                break
+            wait_time = None
+            if cycle_timeout is not None:
+                wait_time = t_start + cycle_timeout - now
+            expired = False
+            if job_timeout is not None:
+                for job in unresolved:
+                    if job.started is None:
+                        continue
+                    expiry = job.started + job_timeout
+                    if expiry <= now:
+                        job.timed_out = True
+                        job.elapsed = now - job.started
+                        expired = True
+                        if len(pending) > 0:
+                            # replace the worker stuck on the abandoned job
+                            start_worker()
+                    elif wait_time is None or expiry - now < wait_time:
+                        wait_time = expiry - now
+            if expired is True:
+                # check again the jobs left
+                continue
+            if wait_time is None or wait_time > 0:
+                cond.wait(wait_time)
+    return results
+
+
+if __name__ == '__main__':
+    '''fan_out Test Bench'''
+    from time import sleep, time
+
+    def job(duration):
+        return lambda: sleep(duration) or duration
+
+    t_bench = time()
+    res = fan_out([job(1), job(2), job(3)], 3)
+    print('3 jobs on 3 workers in %0.1fs (expected 3s)' % (time() - t_bench))
+
+    t_bench = time()
+    res = fan_out([job(1), job(10), job(1), job(1)], 2, job_timeout=2)
+    print('job timeout in %0.1fs (expected 3s):' % (time() - t_bench),
+          [r.timed_out for r in res])
+
+    t_bench = time()
+    res = fan_out([job(1), job(10)], 2, job_timeout=2, cycle_timeout=60)
+    print('job timeout in %0.1fs (expected 2s):' % (time() - t_bench),
+          [r.timed_out for r in res])
+
+    t_bench = time()
+    res = fan_out([job(1), job(10), job(10), job(1)], 2, cycle_timeout=3)
+    print('cycle timeout in %0.1fs (expected 3s):' % (time() - t_bench),
+          [r.timed_out for r in res])
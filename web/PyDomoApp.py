@@ -38,22 +38,39 @@ The simple web server from the python standard library is easy to improve to:
 - answer several requests at the same time, and
 - cancel a connection when the client stops responding.
 http://stackp.online.fr/?p=23
+
+With Python 3 the requests can be served instead by an asyncio event loop
+(see asyncserver module), setting in the site configuration:
+    "optional-server": "asyncio"
 '''
 
 from __future__ import print_function
 
 from os import curdir, sep, path
-from BaseHTTPServer import HTTPServer
-from SimpleHTTPServer import SimpleHTTPRequestHandler
-from SocketServer import ThreadingMixIn
-from urlparse import urlparse, parse_qsl
+
+try:
+    # For Python 3.0 and later
+    from http.server import HTTPServer, SimpleHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qsl
+except ImportError:
+    # Fall back to Python 2
+    from BaseHTTPServer import HTTPServer
+    from SimpleHTTPServer import SimpleHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qsl
+
 from jinja2 import Environment, PackageLoader, TemplateNotFound
 from datetime import datetime
 from sys import stderr
-from cameraman.camgrab import grabImage, lightsIP
+from cameraman.camgrab import lightsIP, httpPoolStats
+from web.snapcache import SnapshotCache
+from web.livehub import LiveHub, LIVE_BOUNDARY, frame_part_header
+from web.staticfiles import StaticFiles, STATIC_BLOCK_SIZE
 from time import sleep
+from email.utils import parsedate_tz, mktime_tz
+from shutil import copyfileobj
 import ssl
-import urllib
 import base64
 
 
@@ -67,6 +84,14 @@ that is CSS, JavaScript files and so on.
 STATIC_FILES_DIR = 'static'
 
 
+'''Define the path of the camera snapshots: /snapshot/<camIdx>.jpg'''
+SNAPSHOT_ENDPOINT = 'snapshot'
+
+
+'''Define the path of the camera live streams: /live/<camIdx>.mjpg'''
+LIVE_ENDPOINT = 'live'
+
+
 '''Define the name of the directory for template files.'''
 TEMPLATE_FILES_DIR = 'templates'
 
@@ -99,11 +124,11 @@ JINJA_ENV = Environment(
     trim_blocks=True,
 
     # Strip leading spaces and tabs from the start of a line to a block.
-    lstrip_blocks=True,
+    lstrip_blocks=True)
 
-    # The autoescape extension allows toggling the autoescape feature
-    # from within the template.
-    extensions=['jinja2.ext.autoescape'])
+    # The autoescape extension, allowing to toggle the autoescape feature
+    # from within the template, is built in since Jinja2 2.9
+    # and has been removed in 3.0.
 
 
 '''Define endpoint where address static resources'''
@@ -120,32 +145,43 @@ STATIC_ENDPOINT = THIS_MODULE_DIR + STATIC_FILES_DIR
 '''Create an instance of camera_desc_list'''
 camera_desc_list = []
 
-class CameraSnapshot( object ):
-    '''Subclass of object
-    See: https://stackoverflow.com/a/285086
-    '''
-    pass
+'''The snapshots of camera_desc_list shared by the requests'''
+snapshot_cache = None
 
+'''The live streams of camera_desc_list shared by the clients'''
+live_hub = None
+
+'''The index of the static files, built at startup'''
+static_files = None
+
+
+def static_url(url_path):
+    '''Template function: returns the URL of the static file
+    with its version, so that the browser keeps it until it changes.
+    '''
+    if static_files is None:
+        return url_path
+    return static_files.url(url_path)
 
-def binary2uri(binary_data):
-    '''Convert a raw binary bytearray into a data URI
-    to be embedded in a jinja template.
-    http://stackoverflow.com/a/25141121
 
-    An other approach can be found here:
-    http://stackoverflow.com/a/12035037
+JINJA_ENV.globals['static_url'] = static_url
 
-    Return the base64 encoded and interpolated binary_data.
+class CameraSnapshot( object ):
+    '''Subclass of object
+    See: https://stackoverflow.com/a/285086
     '''
-    base64_data = base64.b64encode(binary_data)
-    return '{}'.format(urllib.quote(base64_data.rstrip('\n')))
+    pass
 
 
-def get_snapshots_list(cameras_list):
-    '''Grab snapshots from a list of web cameras.
+def get_snapshots_list(cameras_list, cache):
+    '''Describe the snapshots of a list of web cameras to the template.
     The list of web cameras is read from the configuration file.
+    The images are not embedded in the page: the browser loads them
+    at the same time from the /snapshot/<camIdx>.jpg endpoints,
+    served from the snapshot cache (see snapcache module).
 
-    Return an image list encoded to base64 and interpolated in data URIs.
+    Return a list of CameraSnapshot, None if the camera is known
+    to be not answering.
     '''
     snapshots_idx = 0
     snapshots_list = []
@@ -153,14 +189,13 @@ def get_snapshots_list(cameras_list):
         '''The properties (ip address, optional credentials) of each web camera
         are read from the configuration file as descriptor.
         '''
-        grab_ok, jpg_image = grabImage(camera_desc)
-        if grab_ok is True:
-            '''Snapshots are returned as jpeg bytearrays,
-            then they are encoded to base64 and interpolated
-            and appended to the list.
+        cached = cache.peek(snapshots_idx)
+        if cached is None or cached.ok() or cached.expired():
+            '''The snapshot is described by the url of its image.
             '''
             snapshot = CameraSnapshot()
-            snapshot.jpeg_base64 = binary2uri(jpg_image)
+            snapshot.url = '%s/%d.jpg' % (SNAPSHOT_ENDPOINT, snapshots_idx)
+            snapshot.live_url = '%s/%d.mjpg' % (LIVE_ENDPOINT, snapshots_idx)
             snapshot.nightvwCamIdx = -1  # capability not present
             try:
                 if len(camera_desc['optional-irled']['url-ctrl']) > 0:
@@ -168,7 +203,7 @@ def get_snapshots_list(cameras_list):
             except KeyError:
                 pass
         else:
-            '''grabImage returns errors.
+            '''The last grab returned errors.
             '''
             snapshot = None
         snapshots_list.append(snapshot)
@@ -176,6 +211,13 @@ def get_snapshots_list(cameras_list):
     return snapshots_list
 
 
+def is_camera_request(command, url):
+    '''True if the request accesses the cameras
+    (snapshots and IR leds switching), then it may block for a while.
+    '''
+    return command == 'POST' or url.startswith('/%s/' % SNAPSHOT_ENDPOINT)
+
+
 class WebPagesHandler(SimpleHTTPRequestHandler):
     '''Main class to present webpages.
     http://www.acmesystems.it/python_httpd
@@ -205,10 +247,12 @@ class WebPagesHandler(SimpleHTTPRequestHandler):
         self.request.settimeout(self.socket_timeout)
         SimpleHTTPRequestHandler.setup(self)
 
-    def write_header(self, mimetype):
+    def write_header(self, mimetype, length=None):
         '''send header according to mimetype'''
         self.send_response(200)
         self.send_header('Content-type', mimetype)
+        if length is not None:
+            self.send_header('Content-Length', str(length))
         self.end_headers()
 
     def write_template(self, template_path):
@@ -218,17 +262,153 @@ class WebPagesHandler(SimpleHTTPRequestHandler):
         cyear = now.strftime("%y")
         try:
             template = JINJA_ENV.get_template(template_path)
-            self.write_header('text/html')
-            self.wfile.write(template.render(
+            page = template.render(
                 home_page=template_path,
-                snapshots=get_snapshots_list(camera_desc_list),
+                snapshots=get_snapshots_list(camera_desc_list,
+                                             snapshot_cache),
                 proj_name=WebPagesHandler.get_site_title(),
                 datetime_stamp=datetime_stamp,
                 cyear=cyear
-                ))
+                ).encode('utf-8')
+            self.write_header('text/html; charset=utf-8', len(page))
+            self.wfile.write(page)
         except TemplateNotFound as e:
                 self.send_error(404, 'Template Not Found: %s' % e.name)
 
+    def is_not_modified(self, etag, timestamp):
+        '''Check the conditional GET headers against the entity tag
+        and the last modification time of the resource.
+        '''
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            return etag in [tag.strip() for tag in if_none_match.split(',')] \
+                                                or if_none_match.strip() == '*'
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since is not None:
+            try:
+                return int(timestamp) <= mktime_tz(parsedate_tz(if_modified_since))
+            except (TypeError, ValueError, OverflowError):
+                pass
+        return False
+
+    def write_snapshot(self, snapshot_path):
+        '''Send the JPEG image of /snapshot/<camIdx>.jpg
+        from the snapshot cache (see snapcache module).
+        The browser keeps it until the snapshot expires,
+        then it validates its copy by entity tag or modification time.
+        '''
+        try:
+            camIdx = int(path.splitext(path.basename(snapshot_path))[0])
+            if camIdx < 0:
+                raise IndexError(camIdx)
+            snapshot = snapshot_cache.get(camIdx)
+        except (ValueError, IndexError):
+            self.send_error(404, 'Camera Not Found: %s' % snapshot_path)
+            return
+        if not snapshot.ok():
+            self.send_error(503, 'Camera Not Available: %s' % snapshot_path)
+            return
+        max_age = int(snapshot.max_age())
+        not_modified = self.is_not_modified(snapshot.etag, snapshot.timestamp)
+        if not_modified is True:
+            self.send_response(304)
+        else:
+            self.send_response(200)
+            self.send_header('Content-type', 'image/jpeg')
+            self.send_header('Content-Length', str(len(snapshot.jpeg)))
+        self.send_header('ETag', snapshot.etag)
+        self.send_header('Last-Modified',
+                                    self.date_time_string(snapshot.timestamp))
+        self.send_header('Cache-Control', 'private, max-age=%d' % max_age)
+        self.end_headers()
+        if not_modified is False:
+            self.wfile.write(snapshot.jpeg)
+
+    def write_static(self, static_path, params):
+        '''Send the static file from the index built at startup
+        (see staticfiles module): from memory, or from disk if large.
+        The gzip variant is sent to the browsers accepting it,
+        and the browser validates its copy by entity tag
+        or modification time.
+        '''
+        static_file = static_files.get(static_path)
+        if static_file is None:
+            self.send_error(404, 'File Not Found: %s' % static_path)
+            return
+        variant = static_file.variant(self.headers.get('Accept-Encoding'))
+        not_modified = self.is_not_modified(variant.etag, static_file.mtime)
+        if not_modified is True:
+            self.send_response(304)
+        else:
+            self.send_response(200)
+            self.send_header('Content-type', static_file.mimetype)
+            self.send_header('Content-Length', str(variant.size))
+            if variant.encoding is not None:
+                self.send_header('Content-Encoding', variant.encoding)
+        if static_file.gzip is not None:
+            self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('ETag', variant.etag)
+        self.send_header('Last-Modified',
+                                    self.date_time_string(static_file.mtime))
+        self.send_header('Cache-Control',
+                            static_files.cache_control(static_path, params))
+        self.end_headers()
+        if not_modified is True:
+            return
+        if variant.data is not None:
+            self.wfile.write(variant.data)
+            return
+        with open(variant.file_path, 'rb') as f:
+            sendfile = getattr(self.connection, 'sendfile', None)
+            if sendfile is not None:
+                # Python 3: the kernel copies the file to the socket
+                # (plain copy over SSL)
+                self.wfile.flush()
+                sendfile(f, 0, variant.size)
+            else:
+                copyfileobj(f, self.wfile, STATIC_BLOCK_SIZE)
+
+    def open_live(self, live_path):
+        '''Subscribe to the camera live stream of /live/<camIdx>.mjpg
+        (see livehub module) and send the response headers.
+        Returns the stream and the sequence number to read the frames
+        from, None if the camera is not found.
+        '''
+        try:
+            camIdx = int(path.splitext(path.basename(live_path))[0])
+            stream = live_hub.stream(camIdx)
+        except (ValueError, IndexError):
+            self.send_error(404, 'Camera Not Found: %s' % live_path)
+            return None
+        seq = stream.subscribe()
+        self.send_response(200)
+        self.send_header('Content-type',
+                    'multipart/x-mixed-replace; boundary=%s' % LIVE_BOUNDARY)
+        self.send_header('Cache-Control', 'no-cache, private')
+        self.send_header('Pragma', 'no-cache')
+        self.end_headers()
+        # the response ends with the connection
+        self.close_connection = True
+        return stream, seq
+
+    def write_live(self, live_path):
+        '''Send the frames of /live/<camIdx>.mjpg as they arrive
+        from the camera live stream,
+        until the client disconnects or the camera stops.
+        '''
+        live = self.open_live(live_path)
+        if live is None:
+            return
+        stream, seq = live
+        try:
+            for frame in stream.frames(seq):
+                self.wfile.write(frame_part_header(frame))
+                self.wfile.write(frame)
+                self.wfile.write(b'\r\n')
+                self.wfile.flush()
+        finally:
+            stream.unsubscribe()
+
     def split_pathNparams(self, url):
         '''Parse GET request URL into path and query string components.
         Return path and query string as a dictionary of name, value pairs.
@@ -252,11 +432,11 @@ class WebPagesHandler(SimpleHTTPRequestHandler):
         https://pymotw.com/2/BaseHTTPServer/#http-post
         https://gist.github.com/huyng/814831
         '''
-        content_length = self.headers.getheaders('content-length')
-        length = int(content_length[0]) if content_length else 0
+        content_length = self.headers.get('content-length')
+        length = int(content_length) if content_length else 0
         # parse_qsl returns a list of name, value pairs:
         # convert into a dictionary and return.
-        return dict(parse_qsl(self.rfile.read(length)))
+        return dict(parse_qsl(self.rfile.read(length).decode('utf-8')))
 
     def process_POST_data(self, params):
         try:
@@ -285,6 +465,8 @@ class WebPagesHandler(SimpleHTTPRequestHandler):
             print('Unable to connect <%s>:<%s>@%s' % (username, password, irLed_ctrl_url),
                                                                     file=stderr)
         sleep(1)
+        # the page shows the camera with the new IR leds state
+        snapshot_cache.invalidate(camIdx)
 
     def do_POST(self):
         '''Handler for data POSTed
@@ -305,49 +487,17 @@ class WebPagesHandler(SimpleHTTPRequestHandler):
         #for name in params.keys():
         #    print('%s : %s' % (name, params[name]), file=stderr)
 
-        #Check the file extension required and
-        #set the right mime type
-        sendReply = False
-        is_jinja_template = False
+        if self.path.startswith('/%s/' % SNAPSHOT_ENDPOINT):
+            self.write_snapshot(self.path)
+            return
+        if self.path.startswith('/%s/' % LIVE_ENDPOINT):
+            self.write_live(self.path)
+            return
+
         if self.path.endswith(".htm"):
-            mimetype = 'text/html'
-            is_jinja_template = True
-            sendReply = True
-        if self.path.endswith(".html"):
-            mimetype = 'text/html'
-            sendReply = True
-        if self.path.endswith(".jpg"):
-            mimetype = 'image/jpg'
-            sendReply = True
-        if self.path.endswith(".png"):
-            mimetype = 'image/png'
-            sendReply = True
-        if self.path.endswith(".gif"):
-            mimetype = 'image/gif'
-            sendReply = True
-        if self.path.endswith(".ico"):
-            mimetype = 'image/x-icon'
-            sendReply = True
-        if self.path.endswith(".js"):
-            mimetype = 'application/javascript'
-            sendReply = True
-        if self.path.endswith(".css"):
-            mimetype = 'text/css'
-            sendReply = True
-
-        if sendReply is True:
-            if is_jinja_template is True:
-                self.write_template(self.path)
-            else:
-                #Open the static file requested and send it
-                static_file_path = STATIC_ENDPOINT + self.path
-                try:
-                    static_file = open(static_file_path)
-                    self.write_header(mimetype)
-                    self.wfile.write(static_file.read())
-                    static_file.close()
-                except IOError:
-                    self.send_error(404, 'File Not Found: %s' % self.path)
+            self.write_template(self.path)
+        else:
+            self.write_static(self.path, params)
 
 
 class WebAuthPagesHandler(WebPagesHandler):
@@ -365,8 +515,8 @@ class WebAuthPagesHandler(WebPagesHandler):
         as an auth dictionary {"user-name" : "<site_admin_username>",
                                "password" : "<site_admin__password>"}
         '''
-        cls.auth_key = base64.b64encode('%s:%s' %
-                                    (auth['user-name'], auth['password']))
+        cls.auth_key = base64.b64encode(('%s:%s' %
+                (auth['user-name'], auth['password'])).encode('utf-8')).decode('ascii')
 
     @classmethod
     def get_auth_key(cls):
@@ -378,26 +528,27 @@ class WebAuthPagesHandler(WebPagesHandler):
         self.send_header('Content-type', 'text/html')
         self.end_headers()
 
-    def do_AUTHHEAD(self):
-        '''send WWW-Authenticate header'''
+    def do_AUTHHEAD(self, message=''):
+        '''send WWW-Authenticate header and the message'''
+        body = message.encode('utf-8')
         self.send_response(401)
         self.send_header('WWW-Authenticate',
                          'Basic realm=\"PyDomo\"')
         self.send_header('Content-type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
         self.end_headers()
+        self.wfile.write(body)
 
     def do_GET(self):
         ''' Present frontpage with user authentication. '''
-        if self.headers.getheader('Authorization') is None:
-            self.do_AUTHHEAD()
-            self.wfile.write('no auth header received')
-        elif self.headers.getheader('Authorization') == \
+        if self.headers.get('Authorization') is None:
+            self.do_AUTHHEAD('no auth header received')
+        elif self.headers.get('Authorization') == \
                                 'Basic ' + WebAuthPagesHandler.get_auth_key():
             WebPagesHandler.do_GET(self)
         else:
-            self.do_AUTHHEAD()
-            self.wfile.write(self.headers.getheader('Authorization'))
-            self.wfile.write('not authenticated')
+            self.do_AUTHHEAD(self.headers.get('Authorization') +
+                                                        'not authenticated')
 
 
 class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
@@ -421,7 +572,7 @@ class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
         except timeout:
             self.server_log(client_address[0],
                  'Timeout during request processing')
-        except error, e:
+        except error as e:
             self.server_log(client_address[0],
                  '%s during request processing' % e)
         except:
@@ -442,7 +593,7 @@ class PyDomoApp:
     def __init__(self, app_cfg, debug=False):
         '''Define the handler of the incoming request.
         '''
-        global camera_desc_list
+        global camera_desc_list, snapshot_cache, live_hub, static_files
         for camera_desc in app_cfg['cameras-list']:
             # store only camera descriptor with a valid source key
             try:
@@ -450,13 +601,16 @@ class PyDomoApp:
                     camera_desc_list.append(camera_desc)
             except KeyError:
                 pass
+        snapshot_cache = SnapshotCache(camera_desc_list)
+        live_hub = LiveHub(camera_desc_list)
+        static_files = StaticFiles(STATIC_ENDPOINT)
         WebPagesHandler.set_site_title(app_cfg['site']['title'])
         self.host_name = app_cfg['site']['host']['name']
         self.host_port = int(app_cfg['site']['host']['port'])
         if debug is True:
             '''Create an HTTP server'''
-            self.httpd = ThreadedHTTPServer((self.host_name, self.host_port),
-                                                            WebPagesHandler)
+            handler_class = WebPagesHandler
+            ssl_ctx = None
         else:
             '''Create an HTTPS server
             https://www.piware.de/2011/01/creating-an-https-server-in-python/
@@ -469,20 +623,33 @@ class PyDomoApp:
                     'Missing cert file %s' % app_cfg['site']['ssl']['certfile'])
 
             WebAuthPagesHandler.set_auth_key(app_cfg['site']['auth'])
-            self.httpd = ThreadedHTTPServer((self.host_name, self.host_port),
-                                                        WebAuthPagesHandler)
-            # SSL Socket creation
-            self.httpd.socket = ssl.wrap_socket(self.httpd.socket,
-                                   certfile=app_cfg['site']['ssl']['certfile'],
-                                   keyfile=app_cfg['site']['ssl']['keyfile'],
-                                   server_side=True)
-            '''Use SSL Contexts (New from Python 2.7.9)
-            ssl_ctx = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+            handler_class = WebAuthPagesHandler
+            '''Use SSL Contexts (New from Python 2.7.9)'''
+            ssl_ctx = ssl.SSLContext(getattr(ssl, 'PROTOCOL_TLS_SERVER',
+                                             ssl.PROTOCOL_SSLv23))
             ssl_ctx.load_cert_chain(app_cfg['site']['ssl']['certfile'],
-            keyfile=app_cfg['site']['ssl']['keyfile'])
-            self.httpd.socket = ssl_ctx.wrap_socket(self.httpd.socket,
-                                                    server_side=True)
-            '''
+                                    keyfile=app_cfg['site']['ssl']['keyfile'])
+        if app_cfg['site'].get('optional-server') == 'asyncio':
+            '''Serve the requests on an event loop'''
+            try:
+                from web.asyncserver import AsyncHTTPServer, ASYNC_WORKERS
+            except (ImportError, SyntaxError):
+                raise Exception('PyDomoApp',
+                                'The asyncio server requires Python 3')
+            try:
+                workers = int(app_cfg['site']['optional-executor-workers'])
+            except (KeyError, TypeError, ValueError):
+                workers = ASYNC_WORKERS
+            self.httpd = AsyncHTTPServer((self.host_name, self.host_port),
+                                         handler_class, ssl_ctx, workers,
+                                         offload=is_camera_request)
+        else:
+            self.httpd = ThreadedHTTPServer((self.host_name, self.host_port),
+                                                            handler_class)
+            if ssl_ctx is not None:
+                # SSL Socket creation
+                self.httpd.socket = ssl_ctx.wrap_socket(self.httpd.socket,
+                                                        server_side=True)
 
     def run(self):
         '''Wait forever for incoming http requests
@@ -496,7 +663,16 @@ class PyDomoApp:
             self.httpd.server_log('', 'Process stopped by the user!')
         finally:
             self.httpd.server_log('', 'Shutting down the server...')
+            # the live stream handlers would hold back server_close
+            live_hub.terminate()
             self.httpd.server_close()
+            snapshot_cache.terminate()
+            # report how many camera connections have been reused
+            for pool_stats in httpPoolStats():
+                self.httpd.server_log('', pool_stats)
+            # report how many frames the slow live clients have dropped
+            for live_stats in live_hub.stats():
+                self.httpd.server_log('', live_stats)
 
 
 if __name__ == "__main__":
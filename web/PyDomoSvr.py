@@ -33,7 +33,7 @@ from pwd import getpwnam
 from os import getuid, setuid
 from os.path import dirname, join, realpath
 from utils.cli import cfg_file_arg
-from PyDomoApp import PyDomoApp
+from web.PyDomoApp import PyDomoApp
 from utils.configdataload import ConfigData
 
 
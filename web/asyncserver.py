@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Corrado Ubezio
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Asyncio HTTP server serving the PyDomoApp request handlers
+
+ThreadedHTTPServer starts a thread for each connection:
+slow clients and scanners can exhaust the threads and the memory
+of a small board. Here all the connections are served by a single
+event loop thread, costing a coroutine each, and kept alive
+between requests (HTTP/1.1) for ASYNC_KEEPALIVE_TIMEOUT seconds.
+
+The request handlers are the same of ThreadedHTTPServer:
+each request is read in memory and the handler writes the response
+to a buffer, then sent by the event loop.
+The requests that may block on the cameras (see offload) are handled
+by a bounded pool of worker threads, the others by the event loop.
+The live streams frames are sent by the event loop
+(see livehub.LiveStream.add_listener).
+
+Requires Python 3.7 or later.
+'''
+
+import asyncio
+import re
+import ssl
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from io import BytesIO
+from sys import stderr
+from web.livehub import LIVE_FRAME_TIMEOUT, frame_part_header
+
+
+'''Worker threads handling the requests that may block.'''
+ASYNC_WORKERS = 4
+
+'''Connections served at the same time: the others are refused.'''
+ASYNC_MAX_CONNECTIONS = 512
+
+'''Seconds waiting for the next request on a connection kept alive.'''
+ASYNC_KEEPALIVE_TIMEOUT = 60
+
+'''Seconds waiting for the body of a request.'''
+ASYNC_BODY_TIMEOUT = 20
+
+'''Max size of the request headers and body.'''
+ASYNC_MAX_HEADERS_SIZE = 64 * 1024
+ASYNC_MAX_BODY_SIZE = 64 * 1024
+
+_CONTENT_LENGTH = re.compile(br'^content-length:[ \t]*(\d+)[ \t]*\r?$',
+                             re.IGNORECASE | re.MULTILINE)
+
+
+class BufferedRequestHandler(object):
+    '''Mix in a BaseHTTPRequestHandler subclass to handle a request
+    read in memory, buffering the response instead of writing it
+    to the socket.
+    '''
+
+    protocol_version = 'HTTP/1.1'
+
+    def __init__(self, request, client_address, server):
+        self.request_data = request
+        self.live = None
+        super(BufferedRequestHandler, self).__init__(None, client_address,
+                                                     server)
+
+    def setup(self):
+        self.connection = None
+        self.rfile = BytesIO(self.request_data)
+        self.wfile = BytesIO()
+
+    def handle(self):
+        '''The request is handled by handle_request.'''
+        pass
+
+    def finish(self):
+        pass
+
+    def handle_request(self):
+        '''Returns the response to the request.'''
+        self.close_connection = True
+        self.handle_one_request()
+        return self.wfile.getvalue()
+
+    def write_live(self, live_path):
+        '''Only the response headers: the frames are sent
+        by the event loop.
+        '''
+        self.live = self.open_live(live_path)
+
+
+class AsyncHTTPServer(object):
+    '''Same interface of ThreadedHTTPServer used by PyDomoApp.
+
+    offload(command, url) returns True for the requests
+    to be handled by the worker threads.
+    '''
+
+    def __init__(self, server_address, RequestHandlerClass, ssl_context=None,
+                        workers=ASYNC_WORKERS, offload=None,
+                        max_connections=ASYNC_MAX_CONNECTIONS,
+                        keepalive_timeout=ASYNC_KEEPALIVE_TIMEOUT):
+        self.server_address = server_address
+        self.handler_class = type('Buffered' + RequestHandlerClass.__name__,
+                            (BufferedRequestHandler, RequestHandlerClass), {})
+        self.ssl_context = ssl_context
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.offload = offload
+        self.max_connections = max_connections
+        self.keepalive_timeout = keepalive_timeout
+        self.connections = 0
+        self.loop = None
+
+    def server_log(self, client, message):
+        '''Logs an arbitrary message to sys.stderr.'''
+        print("%s - - [%s] \"%s\"" %
+             (client, datetime.now().strftime("%d/%b/%Y %H:%M:%S"), message),
+                file=stderr)
+
+    async def _read_request(self, reader):
+        '''Returns the request headers and body,
+        None if the connection is closed or idle.
+        '''
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'),
+                                          self.keepalive_timeout)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+            return None
+        match = _CONTENT_LENGTH.search(head)
+        if match is None:
+            return head
+        length = int(match.group(1))
+        if length > ASYNC_MAX_BODY_SIZE:
+            return None
+        body = await asyncio.wait_for(reader.readexactly(length),
+                                      ASYNC_BODY_TIMEOUT)
+        return head + body
+
+    async def _handle(self, request, client_address):
+        '''Returns the handler and the response to the request.'''
+        handler = self.handler_class(request, client_address, self)
+        command, _, url = request.split(b'\r\n', 1)[0].decode(
+                                            'latin-1').partition(' ')
+        if self.offload is not None and self.offload(command, url):
+            response = await self.loop.run_in_executor(self.executor,
+                                                       handler.handle_request)
+        else:
+            response = handler.handle_request()
+        return handler, response
+
+    async def _send_live(self, live, writer):
+        '''Send the frames of the live stream as they arrive.
+        While the client is slow, the frames are dropped by the stream.
+        '''
+        stream, seq = live
+        new_frame = asyncio.Event()
+
+        def notify():
+            self.loop.call_soon_threadsafe(new_frame.set)
+
+        stream.add_listener(notify)
+        try:
+            while True:
+                new_frame.clear()
+                seq, frame = stream.next_frame(seq, 0)
+                if frame is None:
+                    try:
+                        await asyncio.wait_for(new_frame.wait(),
+                                               LIVE_FRAME_TIMEOUT)
+                    except asyncio.TimeoutError:
+                        return
+                    continue
+                writer.write(frame_part_header(frame))
+                writer.write(frame)
+                writer.write(b'\r\n')
+                await writer.drain()
+        finally:
+            stream.remove_listener(notify)
+            stream.unsubscribe()
+
+    async def _serve_connection(self, reader, writer):
+        client_address = writer.get_extra_info('peername')
+        if self.connections >= self.max_connections:
+            writer.close()
+            return
+        self.connections = self.connections + 1
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                handler, response = await self._handle(request, client_address)
+                writer.write(response)
+                await writer.drain()
+                if handler.live is not None:
+                    await self._send_live(handler.live, writer)
+                    break
+                if handler.close_connection:
+                    break
+        except asyncio.TimeoutError:
+            self.server_log(client_address[0],
+                            'Timeout during request processing')
+        except (asyncio.LimitOverrunError, ValueError):
+            self.server_log(client_address[0], 'Request too large')
+        except (ConnectionError, ssl.SSLError, OSError) as e:
+            self.server_log(client_address[0],
+                            '%s during request processing' % e)
+        except Exception:
+            self.server_log(client_address[0], 'Error processing request')
+            traceback.print_exc()
+        except asyncio.CancelledError:
+            # server shutdown: end the connection quietly
+            # (a connection task ending cancelled is reported as an error)
+            pass
+        finally:
+            self.connections = self.connections - 1
+            writer.close()
+
+    def serve_forever(self):
+        '''Serve the requests till the process is interrupted.'''
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        server = self.loop.run_until_complete(asyncio.start_server(
+                            self._serve_connection,
+                            self.server_address[0], self.server_address[1],
+                            ssl=self.ssl_context,
+                            limit=ASYNC_MAX_HEADERS_SIZE))
+        try:
+            self.loop.run_forever()
+        finally:
+            server.close()
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(
+                        asyncio.gather(*tasks, return_exceptions=True))
+
+    def server_close(self):
+        self.executor.shutdown(wait=False)
+        if self.loop is not None:
+            self.loop.close()
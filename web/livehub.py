@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Corrado Ubezio
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Live camera streams shared by all the web app clients
+
+For each camera watched live, a single reader thread gets the frames:
+- from the camera MJPEG stream, if given in the camera descriptor:
+    "optional-stream": "<camera mjpeg stream protocol_and_address>"
+- otherwise grabbing snapshots, at most
+    "optional-stream-fps": "<frames_per_second>"
+  (LIVE_FPS by default).
+The frames are appended to a ring buffer of the camera,
+and each client reads them from there: the frames are immutable bytes
+shared by reference, never copied for a client.
+
+A client slower than the camera is not waited for:
+the frames overwritten in the ring before it reads them are dropped,
+and it goes on from the latest one.
+
+The reader is stopped LIVE_LINGER seconds after the last client has left.
+At shutdown, terminate ends the streams of the clients still watching.
+
+Works both with Python 2 and Python 3.
+'''
+
+from __future__ import print_function
+
+from collections import deque
+from threading import Condition, Lock, Thread
+from time import sleep, time
+from cameraman.camgrab import grabImage, iterFramesFromIP
+
+
+'''Frames kept for each camera.'''
+LIVE_RING_SIZE = 8
+
+'''Snapshots per second of the cameras without MJPEG stream.'''
+LIVE_FPS = 2
+
+'''Seconds the reader is kept running without clients.'''
+LIVE_LINGER = 5
+
+'''Seconds a client waits for a frame before giving up the stream.'''
+LIVE_FRAME_TIMEOUT = 15
+
+'''Seconds waiting before opening again a broken camera stream.'''
+LIVE_RETRY_DELAY = 2
+
+'''Boundary between the frames sent to the clients.'''
+LIVE_BOUNDARY = 'pydomoframe'
+
+
+def frame_part_header(frame):
+    '''Returns the multipart/x-mixed-replace boundary and headers
+    to send before the frame, as bytes.
+    '''
+    return ('--%s\r\n'
+            'Content-Type: image/jpeg\r\n'
+            'Content-Length: %d\r\n\r\n' %
+            (LIVE_BOUNDARY, len(frame))).encode('ascii')
+
+
+class LiveStream(object):
+    '''The reader of a camera and its ring buffer of frames.
+
+    Each frame has a sequence number, starting from 1:
+    the client keeps the number of the last frame received.
+    '''
+
+    def __init__(self, camera_desc, ring_size=LIVE_RING_SIZE,
+                                                    linger=LIVE_LINGER):
+        self.camera_desc = camera_desc
+        self.linger = linger
+        self.ring = deque(maxlen=ring_size)
+        self.seq = 0  # sequence number of the latest frame
+        self.cond = Condition()
+        self.clients = 0
+        self.dropped = 0  # frames dropped by the slow clients
+        self._left_time = 0  # when the last client has left
+        self._reader = None
+        self._listeners = []
+        self._f_running = True
+
+    def _frames(self):
+        '''Yields the frames of the camera,
+        until the camera stream ends or a grab fails.
+        '''
+        try:
+            username = self.camera_desc['optional-auth']['user-name']
+            password = self.camera_desc['optional-auth']['password']
+        except KeyError:
+            username = ''
+            password = ''
+        stream_url = self.camera_desc.get('optional-stream')
+        if stream_url:
+            for frame in iterFramesFromIP(stream_url, username, password):
+                yield frame
+            return
+        try:
+            interval = 1.0 / float(self.camera_desc['optional-stream-fps'])
+        except (KeyError, TypeError, ValueError, ZeroDivisionError):
+            interval = 1.0 / LIVE_FPS
+        while True:
+            t_start = time()
+            grab_ok, jpg_image = grabImage(self.camera_desc)
+            if grab_ok is not True or not jpg_image:
+                return
+            yield bytes(jpg_image)
+            sleep(max(t_start + interval - time(), 0))
+
+    def _running(self):
+        '''True while the reader is needed. Call under lock.'''
+        if self._f_running is not True:
+            return False
+        return self.clients > 0 or time() - self._left_time < self.linger
+
+    def _read(self):
+        '''Reader thread: append the frames to the ring
+        and wake up the clients.
+        '''
+        while True:
+            for frame in self._frames():
+                with self.cond:
+                    self.ring.append(frame)
+                    self.seq = self.seq + 1
+                    self.cond.notify_all()
+                    for listener in self._listeners:
+                        listener()
+                    if not self._running():
+                        self._stop()
+                        return
+            with self.cond:
+                if not self._running():
+                    self._stop()
+                    return
+            sleep(LIVE_RETRY_DELAY)
+
+    def _stop(self):
+        '''The reader is leaving: the frames become old.
+        Call under lock.
+        '''
+        self.ring.clear()
+        self._reader = None
+
+    def subscribe(self):
+        '''A client starts watching: returns the sequence number
+        to pass to frames.
+        '''
+        with self.cond:
+            self.clients = self.clients + 1
+            if self._reader is None:
+                self._reader = Thread(target=self._read, name='LiveReader')
+                self._reader.daemon = True
+                self._reader.start()
+            if len(self.ring) > 0:
+                # start from the latest frame
+                return self.seq - 1
+            return self.seq
+
+    def unsubscribe(self):
+        with self.cond:
+            self.clients = self.clients - 1
+            if self.clients == 0:
+                self._left_time = time()
+
+    def add_listener(self, listener):
+        '''Call listener() on each new frame, from the reader thread:
+        for the clients that can't wait on next_frame (i.e. coroutines).
+        It must return at once.
+        '''
+        with self.cond:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self.cond:
+            self._listeners.remove(listener)
+
+    def next_frame(self, last_seq, timeout=LIVE_FRAME_TIMEOUT):
+        '''Returns (seq, frame), the frame following last_seq,
+        or the latest one if those in between have been overwritten.
+        Returns (last_seq, None) if no frame arrives within timeout seconds
+        (at once if timeout is 0) or the stream has been terminated.
+        '''
+        deadline = time() + timeout
+        with self.cond:
+            while self._f_running is True and \
+                                (self.seq <= last_seq or len(self.ring) == 0):
+                remaining = deadline - time()
+                if remaining <= 0:
+                    return last_seq, None
+                self.cond.wait(remaining)
+            if self._f_running is not True:
+                # terminated
+                return last_seq, None
+            first_seq = self.seq - len(self.ring) + 1
+            if last_seq + 1 < first_seq:
+                # too slow: skip to the latest frame
+                self.dropped = self.dropped + self.seq - last_seq - 1
+                return self.seq, self.ring[-1]
+            return last_seq + 1, self.ring[last_seq + 1 - first_seq]
+
+    def terminate(self):
+        '''Wake up the clients: next_frame returns no frame
+        from now on, and the reader stops.
+        '''
+        with self.cond:
+            self._f_running = False
+            self.cond.notify_all()
+            for listener in self._listeners:
+                listener()
+
+    def join(self, timeout=None):
+        '''Wait for the reader to stop, at most timeout seconds.'''
+        with self.cond:
+            reader = self._reader
+        if reader is not None:
+            reader.join(timeout)
+
+    def frames(self, seq, timeout=LIVE_FRAME_TIMEOUT):
+        '''Yields the frames following seq (as returned by subscribe)
+        while they arrive within timeout seconds.
+        '''
+        while True:
+            seq, frame = self.next_frame(seq, timeout)
+            if frame is None:
+                return
+            yield frame
+
+
+class LiveHub(object):
+    '''The live streams of a list of cameras, indexed as the list.'''
+
+    def __init__(self, cameras_list):
+        self.cameras_list = cameras_list
+        self._lock = Lock()
+        self._streams = {}
+
+    def stream(self, camIdx):
+        '''Returns the LiveStream of the camera, creating it the first time.
+        Raises IndexError if camIdx is out of range.
+        '''
+        if camIdx < 0:
+            raise IndexError(camIdx)
+        camera_desc = self.cameras_list[camIdx]
+        with self._lock:
+            stream = self._streams.get(camIdx)
+            if stream is None:
+                stream = LiveStream(camera_desc)
+                self._streams[camIdx] = stream
+        return stream
+
+    def terminate(self):
+        '''End the live streams of all the clients (at shutdown),
+        waiting up to LIVE_RETRY_DELAY seconds for the readers to stop.
+        '''
+        with self._lock:
+            streams = list(self._streams.values())
+        for stream in streams:
+            stream.terminate()
+        deadline = time() + LIVE_RETRY_DELAY
+        for stream in streams:
+            stream.join(max(deadline - time(), 0))
+
+    def stats(self):
+        '''Returns the statistics of the live streams as a list of strings.'''
+        with self._lock:
+            streams = sorted(self._streams.items())
+        return ['live %d: %d frames, %d dropped, %d clients' %
+                        (camIdx, stream.seq, stream.dropped, stream.clients)
+                                            for camIdx, stream in streams]
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Corrado Ubezio
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Camera snapshots shared by all the web app requests
+
+Instead of grabbing every camera at each page request,
+the snapshots are kept in memory and grabbed again only when
+older than the camera TTL, given in the camera descriptor:
+    "optional-snapshot-ttl": "<seconds_a_snapshot_is_fresh>"
+A failed grab is kept for the TTL too, so that a camera not answering
+doesn't hold back each request.
+
+Concurrent requests of the same camera wait for the grab in flight
+instead of issuing their own (single flight).
+
+While the pages are requested, a background thread grabs the snapshots
+about to expire, so that the requests find them fresh.
+It stops grabbing after idle seconds without requests.
+
+Each snapshot has an entity tag (the digest of the image), then
+the clients can validate their copy instead of downloading it again.
+
+The expiry and the refresh are scheduled by a monotonic clock (Python 3),
+not affected by the system clock updates (i.e. NTP on a board without RTC):
+the wall clock is only the timestamp of the snapshot (Last-Modified).
+
+Works both with Python 2 and Python 3.
+'''
+
+from __future__ import print_function
+
+from hashlib import md5
+from threading import Condition, Thread
+from time import time
+from cameraman.camgrab import grabImage
+from utils.threadingpool import fan_out
+
+try:
+    # For Python 3.3 and later
+    from time import monotonic
+except ImportError:
+    # Fall back to Python 2: wall clock
+    from time import time as monotonic
+
+
+'''Seconds a snapshot is fresh, if not given in the camera descriptor.'''
+SNAPSHOT_TTL = 5
+
+'''Seconds without requests before stopping the background refresh.'''
+SNAPSHOT_IDLE = 60
+
+'''Max seconds waiting for a background refresh of the cameras.'''
+SNAPSHOT_DEADLINE = 20
+
+
+class Snapshot(object):
+    '''A grabbed image: jpeg is None if the grab failed.
+    timestamp is the wall clock time of the grab;
+    it is fresh until the expires monotonic() time.
+    '''
+
+    def __init__(self, jpeg, timestamp, expires):
+        self.jpeg = jpeg
+        self.timestamp = timestamp
+        self.expires = expires
+        self.etag = None
+        if jpeg is not None:
+            self.etag = '"%s"' % md5(jpeg).hexdigest()
+
+    def ok(self):
+        return self.jpeg is not None
+
+    def expired(self):
+        return self.expires <= monotonic()
+
+    def max_age(self):
+        '''Returns the seconds the snapshot is still fresh.'''
+        return max(self.expires - monotonic(), 0)
+
+
+class _CameraEntry(object):
+
+    def __init__(self, camera_desc, ttl):
+        self.camera_desc = camera_desc
+        self.ttl = ttl
+        self.snapshot = None
+        self.grabbing = False
+        self.grab_time = 0.0  # seconds spent by the last grab
+
+    def expiry(self):
+        if self.snapshot is None:
+            return 0
+        return self.snapshot.expires
+
+    def refresh_time(self):
+        '''When the refresh must start to end before the expiry'''
+        return self.expiry() - self.grab_time
+
+
+def snapshotTTL(camera_desc, default=SNAPSHOT_TTL):
+    '''Returns the TTL of the camera descriptor.
+    Missing or malformed values fall back to default.
+    '''
+    try:
+        return float(camera_desc['optional-snapshot-ttl'])
+    except (KeyError, TypeError, ValueError):
+        return default
+
+
+class SnapshotCache(object):
+    '''The snapshots of a list of cameras, indexed as the list.'''
+
+    def __init__(self, cameras_list, idle=SNAPSHOT_IDLE, grab=grabImage):
+        self.entries = [_CameraEntry(camera_desc, snapshotTTL(camera_desc))
+                                            for camera_desc in cameras_list]
+        self.idle = idle
+        self.grab = grab
+        self.cond = Condition()
+        self._last_request = 0
+        self._f_running = True
+        self._refresher = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _grab(self, entry):
+        '''Grab the snapshot of the entry marked as grabbing,
+        then wake up the requests waiting for it.
+        '''
+        t_start = monotonic()
+        jpeg = None
+        try:
+            grab_ok, jpg_image = self.grab(entry.camera_desc)
+            if grab_ok is True and jpg_image:
+                jpeg = bytes(jpg_image)
+        except Exception:
+            pass
+        now = monotonic()
+        snapshot = Snapshot(jpeg, time(), now + entry.ttl)
+        with self.cond:
+            entry.snapshot = snapshot
+            entry.grab_time = now - t_start
+            entry.grabbing = False
+            self.cond.notify_all()
+        return snapshot
+
+    def _touch(self):
+        '''Record a request, starting or waking up the refresher.
+        Call under lock.
+        '''
+        now = monotonic()
+        idle = now - self._last_request >= self.idle
+        self._last_request = now
+        if self._refresher is None:
+            self._refresher = Thread(target=self._refresh,
+                                     name='SnapshotRefresh')
+            self._refresher.daemon = True
+            self._refresher.start()
+        elif idle is True:
+            self.cond.notify_all()
+
+    def get(self, camIdx):
+        '''Returns the fresh Snapshot of the camera,
+        grabbing it if expired or waiting for the grab in flight.
+        Raises IndexError if camIdx is out of range.
+        '''
+        entry = self.entries[camIdx]
+        with self.cond:
+            self._touch()
+            while True:
+                if monotonic() < entry.expiry():
+                    return entry.snapshot
+                if entry.grabbing is False:
+                    entry.grabbing = True
+                    break
+                self.cond.wait()
+        return self._grab(entry)
+
+    def peek(self, camIdx):
+        '''Returns the last Snapshot of the camera, also if expired,
+        without grabbing it; None if never grabbed.
+        Raises IndexError if camIdx is out of range.
+        '''
+        with self.cond:
+            return self.entries[camIdx].snapshot
+
+    def invalidate(self, camIdx):
+        '''The camera has changed (i.e. IR leds switched):
+        the next request grabs it again.
+        '''
+        with self.cond:
+            snapshot = self.entries[camIdx].snapshot
+            if snapshot is not None:
+                snapshot.expires = 0
+
+    def _refresh(self):
+        '''Background thread: grab the snapshots about to expire
+        while there are requests.
+        '''
+        while True:
+            with self.cond:
+                while True:
+                    if self._f_running is not True:
+                        return
+                    now = monotonic()
+                    if now - self._last_request >= self.idle:
+                        # idle: wait for a request
+                        self.cond.wait()
+                        continue
+                    due = [entry for entry in self.entries
+                           if entry.grabbing is False and
+                              entry.refresh_time() <= now]
+                    if len(due) > 0:
+                        for entry in due:
+                            entry.grabbing = True
+                        break
+                    wake_time = self._last_request + self.idle
+                    for entry in self.entries:
+                        if entry.grabbing is False:
+                            wake_time = min(wake_time, entry.refresh_time())
+                    self.cond.wait(max(wake_time - now, 0.01))
+            fan_out([lambda entry=entry: self._grab(entry) for entry in due],
+                    0, cycle_timeout=SNAPSHOT_DEADLINE, name='SnapshotRefresh')
+
+    def terminate(self):
+        '''Stop the background refresh.'''
+        with self.cond:
+            self._f_running = False
+            self.cond.notify_all()
+        if self._refresher is not None and self._refresher.is_alive():
+            self._refresher.join()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+#
+# The MIT License (MIT)
+#
+# Copyright (c) 2015 Corrado Ubezio
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Index of the static files served by the web app
+
+The static files directory is scanned once at startup:
+- the files up to STATIC_CACHE_MAX_SIZE bytes are kept in memory,
+  the larger ones are sent from disk;
+- the entity tag of each file is the digest of its content;
+- the gzip compressed variant of a file is its precompressed copy
+  (<file>.gz) if any, otherwise the text files kept in memory
+  are compressed at startup, if smaller then.
+Only the files of the index are served, then a request can't reach
+a file out of the directory; restart the web app after changing them.
+
+The version of a file (see url) makes its URL change with its content,
+so that the browser can keep it as long as it likes.
+
+Works both with Python 2 and Python 3.
+'''
+
+from __future__ import print_function
+
+import re
+import zlib
+from hashlib import md5
+from os import walk
+from os.path import getmtime, getsize, isfile, join, relpath, splitext
+
+
+'''The files served, by extension, and their mime type.'''
+STATIC_MIMETYPES = {
+    '.html': 'text/html',
+    '.jpg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.ico': 'image/x-icon',
+    '.js': 'application/javascript',
+    '.css': 'text/css'
+}
+
+'''The mime types compressed at startup, if not precompressed.'''
+COMPRESSIBLE_MIMETYPES = ('text/html', 'text/css', 'application/javascript')
+
+'''Files larger than this are sent from disk.'''
+STATIC_CACHE_MAX_SIZE = 256 * 1024
+
+'''Size of the blocks read hashing the files.'''
+STATIC_BLOCK_SIZE = 64 * 1024
+
+'''Seconds the browser keeps a file requested without version.'''
+STATIC_MAX_AGE = 10 * 60
+
+'''Seconds the browser keeps a versioned file: one year.'''
+STATIC_VERSIONED_MAX_AGE = 365 * 24 * 60 * 60
+
+'''Query string parameter of the version'''
+VERSION_PARAM = 'v'
+
+'''File names with a version number (i.e. jquery-1.11.3.min.js)'''
+VERSIONED_NAME = re.compile(r'[-.]\d+\.\d+(\.\d+)*[-.]')
+
+GZIP_EXT = '.gz'
+
+
+def gzip_compress(data):
+    '''Returns data compressed in gzip format (without timestamp,
+    so that the same data are always compressed the same way).
+    '''
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def accepts_gzip(accept_encoding):
+    '''True if the Accept-Encoding header value accepts gzip'''
+    if accept_encoding is None:
+        return False
+    for coding in accept_encoding.split(','):
+        name, _, params = coding.partition(';')
+        if name.strip().lower() not in ('gzip', '*'):
+            continue
+        try:
+            quality = float(params.strip().partition('q=')[2] or 1)
+        except ValueError:
+            quality = 1
+        return quality > 0
+    return False
+
+
+class StaticVariant(object):
+    '''A representation of a static file:
+    data is None if it is not kept in memory.
+    '''
+
+    def __init__(self, file_path, size, data, digest, encoding=None):
+        self.file_path = file_path
+        self.size = size
+        self.data = data
+        self.encoding = encoding
+        self.etag = '"%s%s"' % (digest, '-' + encoding if encoding else '')
+
+
+def _file_digest(file_path):
+    '''Returns the digest of the file content, reading it in blocks.'''
+    digest = md5()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(STATIC_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class StaticFile(object):
+
+    def __init__(self, file_path, mimetype):
+        self.mimetype = mimetype
+        self.mtime = getmtime(file_path)
+        size = getsize(file_path)
+        data = None
+        if size <= STATIC_CACHE_MAX_SIZE:
+            with open(file_path, 'rb') as f:
+                data = f.read()
+            size = len(data)
+            digest = md5(data).hexdigest()
+        else:
+            digest = _file_digest(file_path)
+        self.version = digest[:12]
+        self.plain = StaticVariant(file_path, size, data, digest)
+        self.gzip = None
+        gz_file_path = file_path + GZIP_EXT
+        if isfile(gz_file_path):
+            gz_size = getsize(gz_file_path)
+            gz_data = None
+            if gz_size <= STATIC_CACHE_MAX_SIZE:
+                with open(gz_file_path, 'rb') as f:
+                    gz_data = f.read()
+                gz_size = len(gz_data)
+            self.gzip = StaticVariant(gz_file_path, gz_size, gz_data,
+                                                        digest, 'gzip')
+        elif data is not None and mimetype in COMPRESSIBLE_MIMETYPES:
+            gz_data = gzip_compress(data)
+            if len(gz_data) < size:
+                self.gzip = StaticVariant(None, len(gz_data), gz_data,
+                                                        digest, 'gzip')
+
+    def variant(self, accept_encoding):
+        '''Returns the variant to send to a client
+        accepting the encodings of the Accept-Encoding header value.
+        '''
+        if self.gzip is not None and accepts_gzip(accept_encoding):
+            return self.gzip
+        return self.plain
+
+
+class StaticFiles(object):
+    '''The static files under root_dir, by URL path (i.e. /css/x.css).'''
+
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+        self.files = {}
+        for dirpath, _, filenames in walk(root_dir):
+            for filename in filenames:
+                mimetype = STATIC_MIMETYPES.get(splitext(filename)[1])
+                if mimetype is None:
+                    continue
+                file_path = join(dirpath, filename)
+                url_path = '/' + relpath(file_path, root_dir).replace('\\', '/')
+                self.files[url_path] = StaticFile(file_path, mimetype)
+
+    def get(self, url_path):
+        '''Returns the StaticFile of the URL path, None if not found.'''
+        return self.files.get(url_path)
+
+    def url(self, url_path):
+        '''Returns the URL of the static file with its version
+        (i.e. css/x.css?v=<version>), to be used in the templates.
+        The URL path is returned as is if the file is not found.
+        '''
+        static_file = self.files.get('/' + url_path.lstrip('/'))
+        if static_file is None:
+            return url_path
+        return '%s?%s=%s' % (url_path, VERSION_PARAM, static_file.version)
+
+    @staticmethod
+    def cache_control(url_path, params):
+        '''Returns the Cache-Control header value of a request:
+        versioned files are kept for long, the others
+        are validated again after a while.
+        '''
+        if VERSION_PARAM in params or VERSIONED_NAME.search(url_path):
+            return 'private, max-age=%d' % STATIC_VERSIONED_MAX_AGE
+        return 'private, max-age=%d' % STATIC_MAX_AGE